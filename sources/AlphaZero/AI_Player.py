@@ -1,37 +1,22 @@
 from collections import defaultdict
 from concurrent.futures import ThreadPoolExecutor
 from logging import getLogger
-from threading import Lock, Condition
+from threading import Lock, Condition, local
 import concurrent.futures.thread
 
 import numpy as np
 import sources.chess.static_env as senv
+from sources.chess import movecache, planes, repetition
 from sources.config import Config
-from sources.chess.lookup_tables import Winner, ActionLabelsRed, flip_move
+from sources.chess.lookup_tables import Winner, ActionLabelsRed, ActionIndex, flip_move, mirror_policy
+from sources.AlphaZero.SearchTree import SearchTree, N, W, Q, P, LEAF, VALUE, WAITING
+from statistics import NormalDist
 from time import time, sleep
 import gc 
 import sys
 
 logger = getLogger(__name__)
 
-class VisitState:
-    def __init__(self):
-        self.a = defaultdict(ActionState)   # key: action, value: ActionState
-        self.sum_n = 0                      # visit count
-        self.visit = []                     # thread id that has visited this state
-        self.p = None                       # policy of this state
-        self.legal_moves = None             # all leagal moves of this state
-        self.waiting = False                # is waiting for NN's predict
-        self.w = 0
-
-
-class ActionState:
-    def __init__(self):
-        self.n = 0      # N(s, a) : visit count
-        self.w = 0      # W(s, a) : total action value
-        self.q = 0      # Q(s, a) = N / W : action value
-        self.p = 0      # P(s, a) : prior probability
-
 class AI_Player:
     def __init__(self, config: Config, search_tree=None, pipes=None, play_config=None, 
             enable_resign=False, debugging=False, uci=False, use_history=False, side=0):
@@ -39,18 +24,28 @@ class AI_Player:
         self.play_config = play_config or self.config.play
         self.labels_n = len(ActionLabelsRed)
         self.labels = ActionLabelsRed
-        self.move_lookup = {move: i for move, i in zip(self.labels, range(self.labels_n))}
+        self.move_lookup = ActionIndex
         self.pipe = pipes                   # pipes that used to communicate with Module thread
-        self.node_lock = defaultdict(Lock)  # key: state key, value: Lock of that state
+        self.node_lock = defaultdict(Lock)  # key: position key, value: Lock of that state
         self.use_history = use_history
         self.increase_temp = False
 
         if search_tree is None:
-            self.tree = defaultdict(VisitState)  # key: state key, value: VisitState
+            self.tree = SearchTree()        # position key -> node id, edge statistics in pools
         else:
             self.tree = search_tree
-
-        self.root_state = None
+        # a tree shared across self-play games is kept whole
+        self.reuse_tree = self.play_config.enable_tree_reuse and not self.play_config.share_mtcs_info_in_self_play
+
+        self.root_key = None
+        self.key_bits = self.play_config.position_key_bits
+        self.verify_keys = self.play_config.verify_position_keys
+        self.key_states = {}            # for debug: position key -> first state seen with it
+        self.key_collisions = 0
+        # NN results by canonical key, shared by a position and its mirror image
+        self.share_mirror = self.play_config.share_mirror_evaluations and not use_history
+        self.evaluations = {}
+        movecache.configure(self.play_config.move_cache_sets, self.play_config.move_cache_bytes)
 
         self.enable_resign = enable_resign
         self.debugging = debugging
@@ -63,20 +58,31 @@ class AI_Player:
         self.run_lock = Lock()
         self.q_lock = Lock()            # queue lock
         self.t_lock = Lock()
-        self.buffer_planes = []         # prediction queue
+        self.buffer_leaves = []         # prediction queue: (squares, side), or state histories
         self.buffer_history = []
+        self.search_batch = self.play_config.batch_size_neural_network     # 0: a thread per simulation
+        self.batch_planes = planes.new_buffer(max(256, self.search_batch), history=use_history, dtype=np.uint8)
 
         self.all_done = Lock()
         self.num_task = 0
         self.done_tasks = 0
         self.uci = uci
         self.no_act = None
+        self.root_setup = None          # (noisy priors, no_act mask) of the root, once per search
+        self.early_stop = False
+        self.saved_simulations = 0      # simulations of the last search's budget left unused by an early stop
+        self.deadline = None            # (soft, hard) end of a time-managed search
+        self.search_start = 0
+        self.search_base = 0            # done_tasks when the search started
 
         self.job_done = False
+        self.search_boards = local()    # per worker thread: (root state, board kept at the root)
 
-        self.executor = ThreadPoolExecutor(max_workers=self.play_config.search_threads + 2)
-        self.executor.submit(self.receiver)
-        self.executor.submit(self.sender)
+        self.executor = None
+        if not self.search_batch:
+            self.executor = ThreadPoolExecutor(max_workers=self.play_config.search_threads + 2)
+            self.executor.submit(self.receiver)
+            self.executor.submit(self.sender)
 
     def close(self, wait=True):
         self.job_done = True
@@ -92,15 +98,16 @@ class AI_Player:
             # self.executor = None
             self.executor._threads.clear()
             concurrent.futures.thread._threads_queues.clear()
-        policy, resign = self.calc_policy(state, turns, no_act)
+        no_act = self.to_actions(no_act)
+        key = self.state_key(state)
+        policy, resign = self.calc_policy(key, turns, no_act)
         if resign:  # resign
             return None
         if no_act is not None:
-            for act in no_act:
-                policy[self.move_lookup[act]] = 0
+            policy[list(no_act)] = 0
         my_action = int(np.random.choice(range(self.labels_n), p=self.apply_temperature(policy, turns)))
-        if state in self.debug:
-            _, value = self.debug[state]
+        if key in self.debug:
+            _, value = self.debug[key]
         else:
             value = 0
         return self.labels[my_action], value, self.done_tasks // 100
@@ -112,9 +119,8 @@ class AI_Player:
             with self.q_lock:
                 l = min(limit, len(self.buffer_history))
                 if l > 0:
-                    t_data = self.buffer_planes[0:l]
                     # logger.debug(f"send queue size = {l}")
-                    self.pipe.send(t_data)
+                    self.pipe.send(self.encode_batch(self.buffer_leaves[0:l]))
                 else:
                     self.run_lock.release()
                     sleep(0.001)
@@ -130,20 +136,56 @@ class AI_Player:
                 for ret in rets:
                     self.executor.submit(self.update_tree, ret[0], ret[1], self.buffer_history[k])
                     k = k + 1
-                self.buffer_planes = self.buffer_planes[k:]
+                self.buffer_leaves = self.buffer_leaves[k:]
                 self.buffer_history = self.buffer_history[k:]
             self.run_lock.release()
 
-    def action(self, state, turns, no_act=None, depth=None, infinite=False, hist=None, increase_temp=False) -> str:
+    def encode_batch(self, leaves):
+        # one-hot planes of the whole batch, written into the reused uint8 buffer
+        if self.use_history:
+            return planes.encode_histories(leaves, self.batch_planes)
+        squares, sides = zip(*leaves)
+        return planes.encode_squares(squares, sides, self.batch_planes)
+
+    def to_actions(self, moves):
+        # move strings from the callers -> set of action indices
+        if moves is None:
+            return None
+        return {self.move_lookup[mov] for mov in moves}
+
+    def state_key(self, state):
+        return senv.position_key(state, self.key_bits)
+
+    def check_key(self, key, state):
+        # debug mode: the incremental key must match the state, and count states sharing a key
+        if key != self.state_key(state):
+            logger.error(f"Position key {key:x} does not match state {state}")
+        with self.s_lock:
+            seen = self.key_states.setdefault(key, state)
+            if seen != state:
+                self.key_collisions += 1
+                logger.warning(f"Position key collision #{self.key_collisions}: {seen} / {state}")
+
+    def action(self, state, turns, no_act=None, depth=None, infinite=False, hist=None, increase_temp=False,
+               movetime=None, time_left=None, increment=0) -> str:
+        # searches for `depth` simulations (simulation_num_per_move by default), or until stopped
+        # with `infinite`; given a `movetime`, or the `time_left` on the clock and its `increment`
+        # per move (seconds), until the time allotted by time_budget() is over, `depth` if set
+        # still capping the simulations
         self.all_done.acquire(True)
-        self.root_state = state
+        key = self.state_key(state)
+        if self.reuse_tree and key != self.root_key:
+            self.reuse_subtree(state, key)
+        self.root_key = key
+        no_act = self.to_actions(no_act)
         self.no_act = no_act
+        self.root_setup = None
         self.increase_temp = increase_temp
         if hist and len(hist) >= 5:
             hist = hist[-5:]
         done = 0
-        if state in self.tree:
-            done = self.tree[state].sum_n
+        if key in self.tree:
+            done = self.tree.visits[self.tree.get(key)]
         if no_act or increase_temp or done == self.play_config.simulation_num_per_move:
             done = 0
         self.done_tasks = done
@@ -152,10 +194,22 @@ class AI_Player:
             self.num_task = depth - done if depth > done else 0
         if infinite:
             self.num_task = 100000
-        depth = 0
         start_time = time()
+        self.deadline = None
+        if movetime is not None or time_left is not None:
+            soft, hard = self.time_budget(state, movetime, time_left, increment)
+            self.deadline = (start_time + soft, start_time + hard)
+            if not depth:
+                self.num_task = 100000
+        self.early_stop = self.play_config.enable_early_stopping and not infinite
+        self.saved_simulations = 0
+        self.search_start = start_time
+        self.search_base = self.done_tasks
+        depth = 0
         # MCTS search
-        if self.num_task > 0:
+        if self.num_task > 0 and self.search_batch:
+            self.batched_search(state, turns, hist, start_time)
+        elif self.num_task > 0:
             all_tasks = self.num_task
             batch = all_tasks // self.config.play.search_threads
             if all_tasks % self.config.play.search_threads != 0:
@@ -164,192 +218,393 @@ class AI_Player:
                 self.num_task = min(self.config.play.search_threads, all_tasks - self.config.play.search_threads * iter)
                 self.done_tasks += self.num_task
                 for i in range(self.num_task):
-                    self.executor.submit(self.MCTS_search, state, [state], True, hist)
+                    self.executor.submit(self.MCTS_search, state, [key], True, hist)
                 self.all_done.acquire(True)
                 if self.uci and depth != self.done_tasks // 100:
                     depth = self.done_tasks // 100
-                    _, value = self.debug[state]
+                    _, value = self.debug[key]
                     self.print_depth_info(state, turns, start_time, value, no_act)
+                remaining = all_tasks - self.config.play.search_threads * (iter + 1)
+                if remaining > 0 and self.stop_search(remaining):
+                    break
         self.all_done.release()
+        searched = self.done_tasks - self.search_base
+        if self.deadline:
+            logger.debug(f"Searched {searched} simulations in {time() - start_time:.2f}s, "
+                         f"allotted {soft:.2f}s to {hard:.2f}s")
+        if self.saved_simulations:
+            logger.debug(f"Early stop after {searched} simulations, {self.saved_simulations} saved")
+        if self.verify_keys:
+            logger.debug(f"{len(self.key_states)} keys checked, {self.key_collisions} collisions")
+        if self.debugging:
+            logger.debug(f"move cache: {movecache.MOVE_CACHE.stats()}")
 
-        policy, resign = self.calc_policy(state, turns, no_act)
+        policy, resign = self.calc_policy(key, turns, no_act)
 
         if resign:  # resign
             return None, list(policy)
         if no_act is not None:
-            for act in no_act:
-                policy[self.move_lookup[act]] = 0
+            policy[list(no_act)] = 0
 
         my_action = int(np.random.choice(range(self.labels_n), p=self.apply_temperature(policy, turns)))
         return self.labels[my_action], list(policy)
 
-    def MCTS_search(self, state, history=[], is_root_node=False, real_hist=None) -> float:
-        while True:
-            game_over, v, _ = senv.done(state)
-            if game_over:
-                v = v * 2
-                self.executor.submit(self.update_tree, None, v, history)
+    def reuse_subtree(self, state, key):
+        # the new root keeps its subtree down to tree_reuse_depth plies, copied into fresh pools;
+        # the rest of the tree (moves not played, earlier roots) is released at once
+        before = len(self.tree)
+        keys = self.tree.reachable(senv.ChessBoard(state), self.key_bits, self.play_config.tree_reuse_depth) \
+            if key in self.tree else ()
+        self.tree.retain(keys)
+        self.node_lock = defaultdict(Lock)
+        logger.debug(f"Tree reuse: {len(self.tree)} of {before} nodes kept")
+
+    def search_board(self, state, is_root_node):
+        # searches from the root reuse this thread's board and walk it down and back with
+        # push/pop; searches resumed at a leaf start from a fresh board
+        if not is_root_node:
+            return senv.ChessBoard(state)
+        cached = getattr(self.search_boards, 'root', None)
+        if cached is None or cached[0] != state:
+            cached = (state, senv.ChessBoard(state))
+            self.search_boards.root = cached
+        return cached[1]
+
+    def MCTS_search(self, state, history=[], is_root_node=False, real_hist=None, board=None) -> float:
+        # history: [root key, action, key, action, ..., key]; a search resumed at a leaf
+        # brings its own board, already walked down to history[-1]
+        if board is None:
+            board = self.search_board(state, is_root_node)
+        try:
+            outcome, result = self.descend(board, history)
+            if outcome == VALUE:
+                self.executor.submit(self.update_tree, None, result, history)
+            elif outcome == LEAF:
+                self.expand_and_evaluate(board, history, real_hist if len(history) == 1 else None, result)
+        finally:
+            if is_root_node:
+                while board.undo:
+                    board.pop()
+
+    def batched_search(self, state, turns, real_hist, start_time):
+        # single-threaded search: descend from the root with virtual loss until search_batch
+        # leaves wait for the NN, evaluate them in one request and back them all up. A descent
+        # that ends on a leaf already in the batch is backed up with that leaf's value; one that
+        # ends on the root itself (not expanded yet) closes the batch.
+        board = self.search_board(state, True)
+        depth = 0
+        while self.num_task > 0 and not self.job_done:
+            batch = min(self.search_batch, self.num_task)
+            leaves, paths, repeats = [], [], []
+            in_batch = {}               # node id -> index of its evaluation in the batch
+            simulations = 0
+            for _ in range(batch):
+                history = [self.root_key]
+                try:
+                    outcome, result = self.descend(board, history, park=False)
+                    simulations += 1
+                    if outcome == VALUE:
+                        self.backup(None, result, history)
+                    elif outcome == WAITING and len(history) == 1 and result in in_batch:
+                        simulations -= 1
+                        break
+                    elif outcome == WAITING and result in in_batch:
+                        repeats.append((in_batch[result], history))
+                    else:
+                        # a new leaf, or one left waiting by an interrupted search
+                        evaluation = self.cached_evaluation(board, history)
+                        if evaluation is not None:
+                            self.backup(*evaluation, history)
+                            continue
+                        in_batch[self.tree.get(history[-1])] = len(paths)
+                        leaf = result if outcome == LEAF else None
+                        leaves.append(self.leaf_input(board, history, real_hist if len(history) == 1 else None, leaf))
+                        paths.append(history)
+                finally:
+                    while board.undo:
+                        board.pop()
+            if leaves:
+                self.pipe.send(self.encode_batch(leaves))
+                rets = self.pipe.recv()
+                for (p, v), history in zip(rets, paths):
+                    self.backup(p, v, history)
+                for k, history in repeats:
+                    self.backup(None, rets[k][1], history)
+            self.num_task -= simulations
+            self.done_tasks += simulations
+            if self.uci and depth != self.done_tasks // 100:
+                depth = self.done_tasks // 100
+                _, value = self.debug[self.root_key]
+                self.print_depth_info(state, turns, start_time, value, self.no_act)
+            if self.num_task > 0 and self.stop_search(self.num_task):
                 break
 
-            with self.node_lock[state]:
-                if state not in self.tree:
+    def time_budget(self, state, movetime=None, time_left=None, increment=0):
+        # (soft, hard) seconds of search for this move. A movetime is used as it is. A clock is
+        # shared out over the moves expected to remain, from time_moves_left_opening with all
+        # pieces on the board down to time_moves_left_endgame, plus the increment; the search
+        # may then go on past soft, up to hard, while the root is undecided.
+        pc = self.play_config
+        if movetime is not None:
+            hard = max(movetime - pc.time_safety_margin, 0)
+            return hard, hard
+        phase = max(min(sum(c.isalpha() for c in state.split(' ')[0]), 32) - 2, 0) / 30
+        moves_left = pc.time_moves_left_endgame + phase * (pc.time_moves_left_opening - pc.time_moves_left_endgame)
+        soft = time_left / moves_left + increment
+        hard = min(soft * pc.time_max_extension, time_left * pc.time_max_fraction + increment,
+                   time_left - pc.time_safety_margin)
+        hard = max(hard, 0)
+        return min(soft, hard), hard
+
+    def root_undecided(self) -> bool:
+        # the most visited root move has less than time_stable_share of the visits, or a move
+        # visited at least a quarter as often has a higher Q
+        node = self.tree.get(self.root_key)
+        if node is None or self.tree.waiting[node]:
+            return True
+        stats, _ = self.tree.edges(node)
+        n = stats[N]
+        best = n.argmax()
+        if n[best] < self.play_config.time_stable_share * n.sum():
+            return True
+        return bool(stats[Q, n >= n[best] / 4].max() > stats[Q, best])
+
+    def stop_search(self, remaining) -> bool:
+        # after a batch or chunk of simulations: the time is over, or the `remaining` budget
+        # (capped by the simulations the time left allows at the rate so far) cannot change the move
+        if self.deadline:
+            now = time()
+            soft, hard = self.deadline
+            if now >= hard or (now >= soft and not self.root_undecided()):
+                return True
+            rate = (self.done_tasks - self.search_base) / max(now - self.search_start, 1e-3)
+            remaining = min(remaining, int(rate * (hard - now)))
+        if self.early_stop and self.stop_early(remaining):
+            self.saved_simulations = remaining
+            return True
+        return False
+
+    def stop_early(self, remaining) -> bool:
+        # the most visited root move cannot be overtaken by the `remaining` simulations, or, with
+        # early_stopping_confidence, its Q interval lies above those of all other visited moves.
+        # The variance of a value in [-1, 1] with mean Q is at most 1 - Q^2.
+        node = self.tree.get(self.root_key)
+        if node is None or self.tree.waiting[node]:
+            return False
+        stats, _ = self.tree.edges(node)
+        n = stats[N].astype(np.float64)
+        _, blocked = self.root_priors(node)
+        if blocked is not None:
+            n[blocked] = -1
+        order = np.argsort(n)
+        best = order[-1]
+        if len(n) == 1 or n[order[-2]] < 0:
+            return True             # a single move to play
+        if n[best] - n[order[-2]] > remaining:
+            return True
+        confidence = self.play_config.early_stopping_confidence
+        if not confidence or n[best] < 1 / (1 - confidence):
+            return False
+        q = stats[Q].astype(np.float64)
+        z = NormalDist().inv_cdf(confidence)
+        spread = z * np.sqrt(np.maximum(1 - q * q, 0) / np.maximum(n, 1))
+        others = n >= 1
+        others[best] = False
+        return bool(others.any()) and q[best] - spread[best] > (q + spread)[others].max()
+
+    def descend(self, board, history, park=True):
+        # walk down from history[-1], adding virtual loss, to where this simulation ends:
+        #   (LEAF, leaf planes input)   a new position, added to the tree and waiting for the NN
+        #   (VALUE, v)                  a game result or a repetition, for the side to move there
+        #   (WAITING, node id)          a leaf still waiting for the NN; with `park` the search
+        #                               is queued on it and resumed by update_tree
+        key = history[-1]
+        while True:
+            with self.node_lock[key]:
+                node = self.tree.get(key)
+                if node is None:
+                    # positions in the tree are never terminal, so only new ones are examined
+                    record = board.expand(self.key_bits, draw_check=key != self.root_key)
+                    if record.terminal:
+                        return VALUE, record.value * 2
                     # Expand and Evaluate
-                    self.tree[state].sum_n = 1
-                    self.tree[state].legal_moves = senv.get_legal_moves(state)
-                    self.tree[state].waiting = True
-                    if is_root_node and real_hist:
-                        self.expand_and_evaluate(state, history, real_hist)
-                    else:
-                        self.expand_and_evaluate(state, history)
-                    break
+                    self.tree.add(key, record.legal_actions)
+                    return LEAF, record.leaf
 
-                if state in history[:-1]: # loop
-                    for i in range(len(history) - 1):
-                        if history[i] == state:
-                            if senv.will_check_or_catch(state, history[i+1]):
-                                self.executor.submit(self.update_tree, None, -1, history)
-                            elif senv.be_catched(state, history[i+1]):
-                                self.executor.submit(self.update_tree, None, 1, history)
-                            else:
-                                self.executor.submit(self.update_tree, None, 0, history)
-                            break
-                    break
+                if key in history[0:-1:2]: # loop: perpetual check / chase loses, otherwise a draw
+                    plies = (len(history) - 1 - 2 * history[0:-1:2].index(key)) // 2
+                    return VALUE, repetition.cycle_value(board, plies)
 
                 # Select
-                node = self.tree[state]
-                if node.waiting:
-                    node.visit.append(history)
-                    break
-
-                sel_action = self.select_action_q_and_u(state, is_root_node)
+                if self.tree.waiting[node]:
+                    if park:
+                        self.tree.pending.setdefault(node, []).append((history, board.copy()))
+                    return WAITING, node
+
+                i = self.select_action_q_and_u(node, key)
+                if i is None:
+                    # every root move is in no_act: the side to move has lost, nothing is pushed
+                    return VALUE, -1
+                stats, actions = self.tree.edges(node)
+                sel_action = int(actions[i])
 
                 virtual_loss = self.config.play.virtual_loss
-                self.tree[state].sum_n += 1
-                
-                action_state = self.tree[state].a[sel_action]
-                action_state.n += virtual_loss
-                action_state.w -= virtual_loss
-                action_state.q = action_state.w / action_state.n
+                self.tree.visits[node] += 1
+                stats[N, i] += virtual_loss
+                stats[W, i] -= virtual_loss
+                stats[Q, i] = stats[W, i] / stats[N, i]
                 history.append(sel_action)
-                state = senv.step(state, sel_action)
-                history.append(state)
-
-    def select_action_q_and_u(self, state, is_root_node) -> str:
-        is_root_node = self.root_state == state
-        node = self.tree[state]
-        legal_moves = node.legal_moves
-        if node.p is not None:
-            all_p = 0
-            for mov in legal_moves:
-                mov_p = node.p[self.move_lookup[mov]]
-                node.a[mov].p = mov_p
-                all_p += mov_p
-            if all_p == 0:
-                all_p = 1
-            for mov in legal_moves:
-                node.a[mov].p /= all_p
-            node.p = None
-
-        xx_ = np.sqrt(node.sum_n + 1)  
-
-        e = self.play_config.noise_eps
-        c_puct = self.play_config.c_puct
-        dir_alpha = self.play_config.dirichlet_alpha
-
-        best_score = -99999999
-        best_action = None
-        move_counts = len(legal_moves)
-
-        for mov in legal_moves:
-            if is_root_node and self.no_act and mov in self.no_act:
-                continue
-            action_state = node.a[mov]
-            p_ = action_state.p
-            if is_root_node:
-                p_ = (1 - e) * p_ + e * np.random.dirichlet(dir_alpha * np.ones(move_counts))[0]
-            # Q + U
-            score = action_state.q + c_puct * p_ * xx_ / (1 + action_state.n)
-            if action_state.q > (1 - 1e-7):
-                best_action = mov
-                break
-            if score >= best_score:
-                best_score = score
-                best_action = mov
-
-        if best_action == None:
-            logger.error(f"Best action is None, legal_moves = {legal_moves}, best_score = {best_score}")
-        return best_action
-
-    def expand_and_evaluate(self, state, history, real_hist=None):
-        if self.use_history:
-            if real_hist:
-                state_planes = senv.state_history_to_planes(state, real_hist)
-            else:
-                state_planes = senv.state_history_to_planes(state, history)
-        else:
-            state_planes = senv.state_to_planes(state)
+                board.push_action(sel_action)
+                key = board.position_key(self.key_bits)
+                history.append(key)
+
+    def select_action_q_and_u(self, node, key) -> int:
+        # position of the selected child among the node's edges: argmax of Q + U
+        stats, legal_moves = self.tree.edges(node)
+        priors, blocked = stats[P], None
+        if self.root_key == key:
+            priors, blocked = self.root_priors(node)
+        score = stats[Q] + self.play_config.c_puct * np.sqrt(self.tree.visits[node] + 1) * priors / (1 + stats[N])
+        won = stats[Q] > (1 - 1e-7)
+        if blocked is not None:
+            if blocked.all():
+                logger.error(f"Best action is None, legal_moves = {legal_moves}, no_act = {self.no_act}")
+                return None
+            score[blocked] = -np.inf
+            won &= ~blocked
+        if won.any():
+            return int(won.argmax())
+        return int(score.argmax())
+
+    def root_priors(self, node):
+        # Dirichlet noise is drawn once per search, when the root is first selected from,
+        # and mixed into its priors; no_act moves are masked out
+        if self.root_setup is None:
+            stats, legal_moves = self.tree.edges(node)
+            e = self.play_config.noise_eps
+            noise = np.random.dirichlet(self.play_config.dirichlet_alpha * np.ones(len(legal_moves)))
+            blocked = np.isin(legal_moves, list(self.no_act)) if self.no_act else None
+            self.root_setup = ((1 - e) * stats[P] + e * noise, blocked)
+        return self.root_setup
+
+    def expand_and_evaluate(self, board, history, real_hist=None, leaf=None):
+        evaluation = self.cached_evaluation(board, history)
+        if evaluation is not None:
+            self.executor.submit(self.update_tree, *evaluation, history)
+            return
+        leaf = self.leaf_input(board, history, real_hist, leaf)
         with self.q_lock:
-            self.buffer_planes.append(state_planes)
+            self.buffer_leaves.append(leaf)
             self.buffer_history.append(history)
 
+    def cached_evaluation(self, board, history):
+        # (p, v) of the new leaf history[-1] from its mirror image's NN result, if shared
+        if self.share_mirror:
+            node = self.tree.get(history[-1])
+            self.tree.mirror[node] = canonical, mirrored = board.canonical_key(self.key_bits)
+            if canonical in self.evaluations:
+                p, v = self.evaluations[canonical]
+                return mirror_policy(p) if mirrored else p, v
+        return None
+
+    def leaf_input(self, board, history, real_hist=None, leaf=None):
+        # what encode_batch takes for the leaf on `board`: (squares, side) or the state history
+        if self.verify_keys:
+            self.check_key(history[-1], board.to_state())
+        if self.use_history:
+            return real_hist if real_hist else self.path_states(board, history)
+        if leaf is None:
+            leaf = (bytes(board.squares), board.side)
+        return leaf
+
+    def share_evaluation(self, mirror, p, v):
+        # stored in the canonical orientation
+        canonical, mirrored = mirror
+        with self.s_lock:
+            if len(self.evaluations) >= self.play_config.evaluation_cache_size:
+                self.evaluations.clear()
+            self.evaluations[canonical] = (mirror_policy(p) if mirrored else p, v)
+
+    def path_states(self, board, history):
+        # [state, move, state, ...] strings along the searched path, for the history planes
+        board = board.copy()
+        path = [board.to_state()]
+        for i in range(len(history) - 2, 0, -2):
+            board.pop()
+            path[:0] = [board.to_state(), self.labels[history[i]]]
+        return path
+
     def update_tree(self, p, v, history):
-        state = history.pop()
-        z = v
+        for hist, board in self.backup(p, v, history):
+            self.executor.submit(self.MCTS_search, None, hist, False, None, board)
+
+        with self.t_lock:
+            self.num_task -= 1
+            if self.num_task <= 0:
+                self.all_done.release()
+
+    def backup(self, p, v, history):
+        # p, v: NN result of the leaf history[-1], or p = None and the value of a game end;
+        # the virtual loss along the path is replaced by v. Returns the searches parked on the leaf.
+        key = history.pop()
+        parked = ()
 
         if p is not None:
-            with self.node_lock[state]:
-                node = self.tree[state]
-                node.p = p
-                node.waiting = False
+            with self.node_lock[key]:
+                node = self.tree.get(key)
+                self.tree.set_priors(node, p)
+                self.tree.waiting[node] = False
                 if self.debugging:
-                    self.debug[state] = (p, v)
-                for hist in node.visit:
-                    self.executor.submit(self.MCTS_search, state, hist)
-                node.visit = []
+                    self.debug[key] = (p, v)
+                if node in self.tree.mirror:
+                    self.share_evaluation(self.tree.mirror.pop(node), p, v)
+                parked = self.tree.pending.pop(node, ())
 
         virtual_loss = self.config.play.virtual_loss
         while len(history) > 0:
             action = history.pop()
-            state = history.pop()
+            key = history.pop()
             v = - v
-            with self.node_lock[state]:
-                node = self.tree[state]
-                action_state = node.a[action]
-                action_state.n += 1 - virtual_loss
-                action_state.w += v + virtual_loss
-                action_state.q = action_state.w * 1.0 / action_state.n
-
-        with self.t_lock:
-            self.num_task -= 1
-            if self.num_task <= 0:
-                self.all_done.release()
-
-    def calc_policy(self, state, turns, no_act) -> np.ndarray:
-        node = self.tree[state]
+            with self.node_lock[key]:
+                node = self.tree.get(key)
+                stats, _ = self.tree.edges(node)
+                i = self.tree.edge(node, action)
+                stats[N, i] += 1 - virtual_loss
+                stats[W, i] += v + virtual_loss
+                stats[Q, i] = stats[W, i] / stats[N, i]
+        return parked
+
+    def calc_policy(self, key, turns, no_act) -> np.ndarray:
+        node = self.tree.get(key)
         policy = np.zeros(self.labels_n)
         max_q_value = -100
         debug_result = {}
 
-        for mov, action_state in node.a.items():
-            policy[self.move_lookup[mov]] = action_state.n
+        edges = ()
+        if node is not None:
+            stats, actions = self.tree.edges(node)
+            edges = zip(actions.tolist(), stats[N].tolist(), stats[Q].tolist(), stats[P].tolist())
+        for mov, n, q, p in edges:
+            policy[mov] = n
             if no_act and mov in no_act:
-                policy[self.move_lookup[mov]] = 0
+                policy[mov] = 0
                 continue
             if self.debugging:
-                debug_result[mov] = (action_state.n, action_state.q, action_state.p)
-            if action_state.q > max_q_value:
-                max_q_value = action_state.q
+                debug_result[mov] = (n, q, p)
+            if q > max_q_value:
+                max_q_value = q
 
         if max_q_value < self.play_config.resign_threshold and self.enable_resign and turns > self.play_config.min_resign_turn:
             return policy, True
+        if not policy.any():    # every move is in no_act
+            return policy, True
 
         if self.debugging:
             temp = sorted(range(len(policy)), key=lambda k: policy[k], reverse=True)
             for i in range(5):
                 index = temp[i]
-                mov = ActionLabelsRed[index]
-                if mov in debug_result:
-                    self.search_results[mov] = debug_result[mov]
+                if index in debug_result:
+                    self.search_results[self.labels[index]] = debug_result[index]
 
         policy /= np.sum(policy)
         return policy, False
@@ -360,21 +615,25 @@ class AI_Player:
         pv = ""
         i = 0
         while i < 20:
-            node = self.tree[state]
+            node = self.tree.get(self.state_key(state))
             bestmove = None
             root = True
             n = 0
-            if len(node.a) == 0:
+            if node is None:
+                break
+            stats, actions = self.tree.edges(node)
+            if not stats[N].any():
                 break
-            for mov, action_state in node.a.items():
-                if action_state.n >= n:
+            for mov, mov_n in zip(actions.tolist(), stats[N].tolist()):
+                if mov_n >= n:
                     if root and no_act and mov in no_act:
                         continue
-                    n = action_state.n
+                    n = mov_n
                     bestmove = mov
             if bestmove is None:
-                logger.error(f"state = {state}, turns = {turns}, no_act = {no_act}, root = {root}, len(as) = {len(node.a)}")
+                logger.error(f"state = {state}, turns = {turns}, no_act = {no_act}, root = {root}, len(as) = {len(actions)}")
                 break
+            bestmove = self.labels[bestmove]
             state = senv.step(state, bestmove)
             root = False
             if turns % 2 == 1:
@@ -383,8 +642,9 @@ class AI_Player:
             pv += " " + bestmove
             i += 1
             turns += 1
-        if state in self.debug:
-            _, value = self.debug[state]
+        key = self.state_key(state)
+        if key in self.debug:
+            _, value = self.debug[key]
             if turns % 2 != self.side:
                 value = -value
         score = int(value * 1000)
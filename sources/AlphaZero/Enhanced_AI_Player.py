@@ -1,51 +1,39 @@
 from collections import defaultdict
 from concurrent.futures import ThreadPoolExecutor
 from logging import getLogger
-from threading import Lock, Condition
+from threading import Lock, Condition, local
 import concurrent.futures.thread
 import hashlib
 import math
+from statistics import NormalDist
 
 import numpy as np
 import sources.chess.static_env as senv
+from sources.chess import movecache, planes, repetition
 from sources.config_enhanced import EnhancedConfig as Config
-from sources.chess.lookup_tables import Winner, ActionLabelsRed, flip_move
-from sources.AlphaZero.ZobristHash import get_zobrist_hash
+from sources.chess.lookup_tables import Winner, ActionLabelsRed, ActionIndex, flip_move, mirror_policy
 from sources.AlphaZero.MemoryManager import MemoryManager
+from sources.AlphaZero.SearchTree import ExtendedSearchTree, N, W, Q, P, V, RAVE_N, RAVE_W, LEAF, VALUE, WAITING
 from time import time, sleep
 import gc 
 import sys
 
 logger = getLogger(__name__)
 
-class EnhancedVisitState:
-    def __init__(self):
-        self.a = defaultdict(EnhancedActionState)
-        self.sum_n = 0
-        self.visit = []
-        self.p = None
-        self.legal_moves = None
-        self.waiting = False
-        self.w = 0
-        self.q_variance = 0  # 用于UCB1-TUNED
-        self.last_updated = 0
-        self.zobrist_hash = None
-
-class EnhancedActionState:
-    def __init__(self):
-        self.n = 0
-        self.w = 0
-        self.q = 0
-        self.p = 0
-        self.q_variance = 0
-        self.rave_n = 0  # RAVE访问次数
-        self.rave_w = 0  # RAVE总价值
-        self.rave_q = 0  # RAVE平均价值
-        self.unlock_threshold = 0  # 渐进解锁阈值
+# 搜索树：节点为整数编号，子节点统计（访问次数、价值、先验、方差、RAVE）连续存放在NumPy池中
+EnhancedSearchTree = ExtendedSearchTree
+
+
+class SearchPath(list):
+    """一次模拟的路径[根局面键, 动作, 局面键, ...]，另记下行时各边施加的动态虚拟损失，回传时原样撤销"""
+    def __init__(self, keys=()):
+        super().__init__(keys)
+        self.losses = []
 
 class TranspositionTable:
-    """转置表，避免重复计算"""
-    def __init__(self, max_size=1000000):
+    """转置表，避免重复计算；存放搜索树的节点编号"""
+    def __init__(self, tree, max_size=1000000):
+        self.tree = tree
         self.table = {}
         self.max_size = max_size
         self.lock = Lock()
@@ -58,13 +46,19 @@ class TranspositionTable:
         with self.lock:
             if len(self.table) >= self.max_size:
                 # 简单的LRU：删除最少访问的节点
-                min_visits = min(node.sum_n for node in self.table.values())
-                keys_to_remove = [k for k, v in self.table.items() if v.sum_n == min_visits]
+                visits = self.tree.visits
+                min_visits = min(visits[node] for node in self.table.values())
+                keys_to_remove = [k for k, v in self.table.items() if visits[v] == min_visits]
                 for k in keys_to_remove[:len(keys_to_remove)//2]:
                     del self.table[k]
             
             self.table[zobrist_hash] = node
 
+    def remap(self, ids):
+        """搜索树重建后换成新的节点编号，丢弃已释放的节点"""
+        with self.lock:
+            self.table = {k: ids[v] for k, v in self.table.items() if v in ids}
+
 class Enhanced_AI_Player:
     def __init__(self, config: Config, search_tree=None, pipes=None, play_config=None, 
             enable_resign=False, debugging=False, uci=False, use_history=False, side=0):
@@ -72,18 +66,33 @@ class Enhanced_AI_Player:
         self.play_config = play_config or self.config.play
         self.labels_n = len(ActionLabelsRed)
         self.labels = ActionLabelsRed
-        self.move_lookup = {move: i for move, i in zip(self.labels, range(self.labels_n))}
+        self.move_lookup = ActionIndex
         self.pipe = pipes
         self.node_lock = defaultdict(Lock)
         self.use_history = use_history
         self.increase_temp = False
 
         if search_tree is None:
-            self.tree = defaultdict(EnhancedVisitState)
+            self.tree = EnhancedSearchTree()
         else:
             self.tree = search_tree
-
-        self.root_state = None
+        # 走子后只保留新根节点的子树；自对弈跨局共用搜索树时保留整棵树
+        self.reuse_tree = hasattr(self.play_config, 'enable_tree_reuse') and self.play_config.enable_tree_reuse and \
+            not self.play_config.share_mtcs_info_in_self_play
+
+        self.root_key = None
+        self.key_bits = self.play_config.position_key_bits if hasattr(self.play_config, 'position_key_bits') else 64
+        self.verify_keys = hasattr(self.play_config, 'verify_position_keys') and self.play_config.verify_position_keys
+        self.key_states = {}  # 调试：局面键 -> 首次出现的局面
+        self.key_collisions = 0
+        # 按规范局面键缓存神经网络结果，左右镜像的局面共用
+        self.share_mirror = hasattr(self.play_config, 'share_mirror_evaluations') and \
+            self.play_config.share_mirror_evaluations and not use_history
+        self.evaluations = {}
+        self.evaluation_cache_size = self.play_config.evaluation_cache_size if hasattr(self.play_config, 'evaluation_cache_size') else 100000
+        # 进程内共用的合法着法缓存
+        movecache.configure(getattr(self.play_config, 'move_cache_sets', movecache.DEFAULT_SETS),
+                            getattr(self.play_config, 'move_cache_bytes', movecache.DEFAULT_MAX_BYTES))
         self.enable_resign = enable_resign
         self.debugging = debugging
         self.search_results = {}
@@ -92,14 +101,9 @@ class Enhanced_AI_Player:
 
         # 优化组件
         tt_size = self.play_config.transposition_table_size if hasattr(self.play_config, 'transposition_table_size') else 1000000
-        self.transposition_table = TranspositionTable(max_size=tt_size) if hasattr(self.play_config, 'enable_transposition_table') and self.play_config.enable_transposition_table else None
+        self.transposition_table = TranspositionTable(self.tree, max_size=tt_size) if hasattr(self.play_config, 'enable_transposition_table') and self.play_config.enable_transposition_table else None
         self.rave_table = defaultdict(lambda: defaultdict(list))
-        self.zobrist_hash = get_zobrist_hash()
-        
-        # 哈希缓存：避免重复计算相同状态的哈希
-        self.hash_cache = {}
-        self.hash_cache_max_size = 10000
-        
+
         # 内存管理器
         self.memory_manager = MemoryManager(self)
         
@@ -108,328 +112,426 @@ class Enhanced_AI_Player:
         self.run_lock = Lock()
         self.q_lock = Lock()
         self.t_lock = Lock()
-        self.buffer_planes = []
+        self.buffer_leaves = []  # 待评估队列：(棋盘数组, 走子方)，或局面历史
         self.buffer_history = []
+        # 单线程批量搜索每次送神经网络评估的叶子数；0则每次模拟一个线程
+        self.search_batch = self.play_config.batch_size_neural_network if hasattr(self.play_config, 'batch_size_neural_network') else 0
+        self.batch_planes = planes.new_buffer(max(256, self.search_batch), history=use_history, dtype=np.uint8)  # 复用的批量特征平面
         self.all_done = Lock()
         self.num_task = 0
         self.done_tasks = 0
         self.uci = uci
         self.no_act = None
+        self.root_setup = None  # 根节点的狄利克雷噪声与禁着掩码，每次搜索只生成一次
+        self.early_stop = False
+        self.saved_simulations = 0  # 上次搜索因早停省下的模拟次数
+        self.deadline = None  # 限时搜索的(软, 硬)截止时刻
+        self.search_start = 0
+        self.search_base = 0  # 本次搜索开始时的done_tasks
         self.job_done = False
-
-        self.executor = ThreadPoolExecutor(max_workers=self.play_config.search_threads + 2)
-        self.executor.submit(self.receiver)
-        self.executor.submit(self.sender)
-
-    def compute_zobrist_hash(self, state):
-        """计算局面的Zobrist哈希值 - 带缓存优化"""
-        # 首先检查缓存
-        if state in self.hash_cache:
-            return self.hash_cache[state]
-        
-        # 计算哈希值
-        hash_val = self.zobrist_hash.compute_hash_from_state(state)
-        
-        # 存入缓存（如果缓存未满）
-        if len(self.hash_cache) < self.hash_cache_max_size:
-            self.hash_cache[state] = hash_val
-        elif len(self.hash_cache) >= self.hash_cache_max_size:
-            # 简单的缓存清理：清除一半
-            keys_to_remove = list(self.hash_cache.keys())[:len(self.hash_cache)//2]
-            for key in keys_to_remove:
-                del self.hash_cache[key]
-            self.hash_cache[state] = hash_val
-        
-        return hash_val
-    
-    def compute_incremental_hash(self, current_hash, current_state, move_str):
-        """增量计算哈希值 - 性能关键优化"""
-        try:
-            # 首先生成新状态，检查是否已缓存
-            new_state = senv.step(current_state, move_str)
-            if new_state in self.hash_cache:
-                return self.hash_cache[new_state]
-            
-            # 解析走法进行增量更新
-            from_x, from_y = int(move_str[0]), int(move_str[1])
-            to_x, to_y = int(move_str[2]), int(move_str[3])
-            
-            # 获取当前棋盘状态
-            board = senv.state_to_board(current_state)
-            
-            # 获取移动的棋子和被吃的棋子
-            moving_piece = board[from_y][from_x]
-            captured_piece = board[to_y][to_x] if board[to_y][to_x] != '.' else None
-            
-            from sources.chess.static_env import Position
-            from_pos = Position(from_x, from_y)
-            to_pos = Position(to_x, to_y)
-            
-            # 使用增量更新
-            new_hash = self.zobrist_hash.update_hash_for_move(
-                current_hash, from_pos, to_pos, moving_piece, captured_piece
-            )
-            
-            # 缓存结果
-            if len(self.hash_cache) < self.hash_cache_max_size:
-                self.hash_cache[new_state] = new_hash
-            
-            return new_hash
-            
-        except Exception:
-            # 如果增量更新失败，回退到完整计算
-            new_state = senv.step(current_state, move_str)
-            return self.compute_zobrist_hash(new_state)
-
-    def enhanced_select_action(self, state, is_root_node=False):
-        """增强的UCB选择策略：UCB1-TUNED + RAVE"""
-        node = self.tree[state]
-        legal_moves = node.legal_moves
-        
-        if not legal_moves:
+        self.search_boards = local()  # 每个工作线程保留一个根局面棋盘，走子/撤销代替逐层复制
+
+        self.executor = None
+        if not self.search_batch:
+            self.executor = ThreadPoolExecutor(max_workers=self.play_config.search_threads + 2)
+            self.executor.submit(self.receiver)
+            self.executor.submit(self.sender)
+
+    def state_key(self, state):
+        """局面字符串 -> 局面键"""
+        return senv.position_key(state, self.key_bits)
+
+    def check_key(self, key, state):
+        """调试模式：校验增量维护的局面键，并统计键碰撞"""
+        if key != self.state_key(state):
+            logger.error(f"局面键 {key:x} 与局面不符: {state}")
+        with self.s_lock:
+            seen = self.key_states.setdefault(key, state)
+            if seen != state:
+                self.key_collisions += 1
+                logger.warning(f"局面键碰撞 #{self.key_collisions}: {seen} / {state}")
+
+    def enhanced_select_action(self, node, is_root_node=False):
+        """增强的UCB选择策略：UCB1-TUNED + RAVE，对子节点数组整体计算；返回所选子节点的位置"""
+        stats, legal_moves = self.tree.edges(node)
+        
+        if not len(legal_moves):
             return None
-            
-        best_score = -float('inf')
-        best_action = None
+        sum_n = self.tree.visits[node]
         
         # RAVE权重计算
-        rave_weight = self._compute_rave_weight(node.sum_n)
-        
-        for move in legal_moves:
-            if is_root_node and self.no_act and move in self.no_act:
-                continue
-                
-            action_state = node.a[move]
-            
-            # UCB1-TUNED分数
-            ucb_score = self._compute_ucb_tuned(action_state, node)
-            
-            # RAVE分数
-            rave_score = action_state.rave_q if action_state.rave_n > 0 else 0
-            
-            # 混合分数
-            final_score = (1 - rave_weight) * ucb_score + rave_weight * rave_score
-            
-            # 渐进解锁奖励
-            if self._should_unlock_move(move, node.sum_n):
-                final_score += self._get_unlock_bonus(move)
-            
-            # 根节点添加噪声
-            if is_root_node:
-                noise = np.random.dirichlet([self.play_config.dirichlet_alpha] * len(legal_moves))[0]
-                final_score = (1 - self.play_config.noise_eps) * final_score + \
-                            self.play_config.noise_eps * noise
-            
-            if final_score > best_score:
-                best_score = final_score
-                best_action = move
-        
-        return best_action
-
-    def _compute_ucb_tuned(self, action_state, parent_node):
-        """计算UCB1-TUNED分数"""
-        if action_state.n == 0:
-            return float('inf')
+        rave_weight = self._compute_rave_weight(sum_n)
+        
+        # UCB1-TUNED分数与RAVE分数的混合
+        ucb_score = self._compute_ucb_tuned(stats, sum_n)
+        rave_n = stats[RAVE_N]
+        rave_score = np.where(rave_n > 0, stats[RAVE_W] / np.where(rave_n > 0, rave_n, 1), 0)
+        final_score = (1 - rave_weight) * ucb_score + rave_weight * rave_score
+        
+        # 渐进解锁奖励
+        final_score += self._unlock_bonus(legal_moves, sum_n)
+        
+        # 根节点：混入本次搜索的噪声，屏蔽禁着
+        if is_root_node:
+            noise, blocked = self.root_noise(node)
+            final_score = (1 - self.play_config.noise_eps) * final_score + self.play_config.noise_eps * noise
+            if blocked is not None:
+                if blocked.all():
+                    return None
+                final_score[blocked] = -np.inf
+        
+        return int(final_score.argmax())
+
+    def root_noise(self, node):
+        """根节点的狄利克雷噪声（每次搜索在根节点首次选择时抽取一次）和禁着掩码"""
+        if self.root_setup is None:
+            _, legal_moves = self.tree.edges(node)
+            noise = np.random.dirichlet(self.play_config.dirichlet_alpha * np.ones(len(legal_moves)))
+            blocked = np.isin(legal_moves, list(self.no_act)) if self.no_act else None
+            self.root_setup = (noise, blocked)
+        return self.root_setup
+
+    def _compute_ucb_tuned(self, stats, parent_n):
+        """计算各子节点的UCB1-TUNED分数，未访问的为无穷大"""
+        n = stats[N]
+        visited = n != 0
         
         # 标准UCB项
-        exploration_term = math.sqrt(2 * math.log(parent_node.sum_n) / action_state.n)
+        exploration_term = np.sqrt(2 * math.log(parent_n) / np.where(visited, n, 1))
         
         # UCB1-TUNED的方差项
-        variance_term = action_state.q_variance + math.sqrt(2 * math.log(parent_node.sum_n) / action_state.n)
+        variance_term = stats[V] + exploration_term
         bound = self.play_config.variance_bound if hasattr(self.play_config, 'variance_bound') else 0.25
-        variance_bound = min(bound, variance_term)  # 方差上界
+        variance_bound = np.minimum(bound, variance_term)  # 方差上界
         
         # 最终UCB1-TUNED分数
-        ucb_tuned = action_state.q + exploration_term * variance_bound
-        
-        return ucb_tuned
+        return np.where(visited, stats[Q] + exploration_term * variance_bound, np.inf)
 
     def _compute_rave_weight(self, n):
         """计算RAVE权重 beta = sqrt(k/(3n+k))"""
         k = self.play_config.rave_k_value if hasattr(self.play_config, 'rave_k_value') else 2000
         return math.sqrt(k / (3 * n + k))
 
-    def _should_unlock_move(self, move, visit_count):
-        """渐进解锁：复杂走法需要更多访问才解锁"""
+    def _unlock_bonus(self, moves, visit_count):
+        """渐进解锁：复杂走法需要更多访问才解锁，已解锁的走法获得奖励"""
+        bonus = self.play_config.unlock_bonus if hasattr(self.play_config, 'unlock_bonus') else 0.1
         if not hasattr(self.play_config, 'enable_progressive_unlock') or not self.play_config.enable_progressive_unlock:
-            return True
-        complexity = self._get_move_complexity(move)
+            return bonus
         multiplier = self.play_config.unlock_complexity_multiplier if hasattr(self.play_config, 'unlock_complexity_multiplier') else 50
-        threshold = complexity * multiplier
-        return visit_count >= threshold
+        threshold = self._get_move_complexity(moves) * multiplier
+        return np.where(visit_count >= threshold, bonus, 0)
 
-    def _get_move_complexity(self, move):
-        """评估走法复杂度"""
-        # 简化实现：根据走法类型返回复杂度
+    def _get_move_complexity(self, moves):
+        """评估各走法的复杂度"""
+        # 简化实现：所有走法复杂度相同
         # 实际可以根据走法是否为杀棋、弃子、长将等判断
-        return 1
+        return np.ones(len(moves))
 
-    def _get_unlock_bonus(self, move):
-        """获取解锁奖励"""
-        return self.play_config.unlock_bonus if hasattr(self.play_config, 'unlock_bonus') else 0.1
-
-    def enhanced_virtual_loss(self, action_state, parent_node):
+    def enhanced_virtual_loss(self, n, q, parent_n):
         """动态虚拟损失"""
         base_loss = self.play_config.virtual_loss
         
         # 根据访问比例调整
-        visit_ratio = action_state.n / max(1, parent_node.sum_n)
+        visit_ratio = n / max(1, parent_n)
         dynamic_multiplier = 1 + visit_ratio * 0.5
         
         # 根据Q值调整：Q值越低，虚拟损失越大
-        q_adjustment = max(0, 0.5 - action_state.q) * 2
+        q_adjustment = max(0, 0.5 - q) * 2
         
         return base_loss * dynamic_multiplier + q_adjustment
 
-    def MCTS_search_enhanced(self, state, history=[], is_root_node=False, real_hist=None):
-        """增强的MCTS搜索"""
-        zobrist_hash = self.compute_zobrist_hash(state)
-        
-        # 检查转置表
-        if self.transposition_table:
-            cached_node = self.transposition_table.get(zobrist_hash)
-            threshold = self.play_config.transposition_table_threshold if hasattr(self.play_config, 'transposition_table_threshold') else 10
-            if cached_node and cached_node.sum_n > threshold:
-                return cached_node.q_variance
-        
-        while True:
-            game_over, v, _ = senv.done(state)
-            if game_over:
-                v = v * 2
-                self.executor.submit(self.enhanced_update_tree, None, v, history, zobrist_hash)
+    def search_board(self, state, is_root_node):
+        """根节点开始的搜索复用线程内棋盘，沿树push下行、pop返回；从叶子恢复的搜索新建棋盘"""
+        if not is_root_node:
+            return senv.ChessBoard(state)
+        cached = getattr(self.search_boards, 'root', None)
+        if cached is None or cached[0] != state:
+            cached = (state, senv.ChessBoard(state))
+            self.search_boards.root = cached
+        return cached[1]
+
+    def MCTS_search_enhanced(self, state, history=[], is_root_node=False, real_hist=None, board=None):
+        """增强的MCTS搜索；history为SearchPath [根局面键, 动作, 局面键, ...]，从叶子恢复的搜索自带已走到history[-1]的棋盘"""
+        if board is None:
+            board = self.search_board(state, is_root_node)
+        try:
+            outcome, result = self.descend(board, history)
+            if outcome == VALUE:
+                self.executor.submit(self.enhanced_update_tree, None, result, history)
+            elif outcome == LEAF:
+                self.expand_and_evaluate(board, history, real_hist if len(history) == 1 else None, result)
+        finally:
+            if is_root_node:
+                while board.undo:
+                    board.pop()
+
+    def batched_search(self, state, real_hist):
+        """单线程批量搜索：从根节点带虚拟损失反复下行，攒够search_batch个待评估叶子后
+        一次送神经网络评估，再全部回传。下行到本批已有的叶子时，按该叶子的评估值回传；
+        下行到尚未扩展的根节点则结束本批。"""
+        board = self.search_board(state, True)
+        while self.num_task > 0 and not self.job_done:
+            batch = min(self.search_batch, self.num_task)
+            leaves, paths, repeats = [], [], []
+            in_batch = {}  # 节点编号 -> 本批中该叶子的评估序号
+            simulations = 0
+            for _ in range(batch):
+                history = SearchPath([self.root_key])
+                try:
+                    outcome, result = self.descend(board, history, park=False)
+                    simulations += 1
+                    if outcome == VALUE:
+                        self.backup(None, result, history)
+                    elif outcome == WAITING and len(history) == 1 and result in in_batch:
+                        simulations -= 1
+                        break
+                    elif outcome == WAITING and result in in_batch:
+                        repeats.append((in_batch[result], history))
+                    else:
+                        # 新叶子，或被中断的搜索遗留的待评估叶子
+                        evaluation = self.cached_evaluation(board, history)
+                        if evaluation is not None:
+                            self.backup(*evaluation, history)
+                            continue
+                        in_batch[self.tree.get(history[-1])] = len(paths)
+                        leaf = result if outcome == LEAF else None
+                        leaves.append(self.leaf_input(board, history, real_hist if len(history) == 1 else None, leaf))
+                        paths.append(history)
+                finally:
+                    while board.undo:
+                        board.pop()
+            if leaves:
+                self.pipe.send(self.encode_batch(leaves))
+                rets = self.pipe.recv()
+                for (p, v), history in zip(rets, paths):
+                    self.backup(p, v, history)
+                for k, history in repeats:
+                    self.backup(None, rets[k][1], history)
+            self.num_task -= simulations
+            self.done_tasks += simulations
+            if self.num_task > 0 and self.stop_search(self.num_task):
                 break
 
-            with self.node_lock[state]:
-                if state not in self.tree:
+    def time_budget(self, state, movetime=None, time_left=None, increment=0):
+        """本步搜索的(软, 硬)时限，单位秒。movetime直接使用；否则把剩余时间按预计剩余步数分配，
+        满盘时按time_moves_left_opening步、只剩双将时按time_moves_left_endgame步，再加每步加秒。
+        过了软时限而根节点仍未分胜负时，可继续搜索到硬时限"""
+        pc = self.play_config
+        margin = pc.time_safety_margin if hasattr(pc, 'time_safety_margin') else 0.1
+        if movetime is not None:
+            hard = max(movetime - margin, 0)
+            return hard, hard
+        opening = pc.time_moves_left_opening if hasattr(pc, 'time_moves_left_opening') else 50
+        endgame = pc.time_moves_left_endgame if hasattr(pc, 'time_moves_left_endgame') else 20
+        extension = pc.time_max_extension if hasattr(pc, 'time_max_extension') else 2.0
+        fraction = pc.time_max_fraction if hasattr(pc, 'time_max_fraction') else 0.2
+        phase = max(min(sum(c.isalpha() for c in state.split(' ')[0]), 32) - 2, 0) / 30
+        soft = time_left / (endgame + phase * (opening - endgame)) + increment
+        hard = max(min(soft * extension, time_left * fraction + increment, time_left - margin), 0)
+        return min(soft, hard), hard
+
+    def root_undecided(self):
+        """根节点尚未分出胜负：访问最多的着法占比不足time_stable_share，
+        或访问次数不少于其四分之一的着法中有Q值更高的"""
+        node = self.tree.get(self.root_key)
+        if node is None or self.tree.waiting[node]:
+            return True
+        stats, _ = self.tree.edges(node)
+        n = stats[N]
+        best = n.argmax()
+        share = self.play_config.time_stable_share if hasattr(self.play_config, 'time_stable_share') else 0.5
+        if n[best] < share * n.sum():
+            return True
+        return bool(stats[Q, n >= n[best] / 4].max() > stats[Q, best])
+
+    def stop_search(self, remaining):
+        """每批（或每组线程）模拟之后判断是否结束搜索：时间已到，或剩余的remaining次模拟
+        （限时搜索时不超过按当前速度剩余时间内能完成的次数）已无法改变着法"""
+        if self.deadline:
+            now = time()
+            soft, hard = self.deadline
+            if now >= hard or (now >= soft and not self.root_undecided()):
+                return True
+            rate = (self.done_tasks - self.search_base) / max(now - self.search_start, 1e-3)
+            remaining = min(remaining, int(rate * (hard - now)))
+        if self.early_stop and self.stop_early(remaining):
+            self.saved_simulations = remaining
+            return True
+        return False
+
+    def stop_early(self, remaining):
+        """根节点访问最多的着法已不可能被剩余的remaining次模拟超过时早停；
+        设置early_stopping_confidence时，其Q的置信下界高于其余已访问着法的置信上界也早停。
+        方差取[-1, 1]内均值为Q的价值的上界1 - Q²（q_variance行只是UCB1-TUNED的启发量）"""
+        node = self.tree.get(self.root_key)
+        if node is None or self.tree.waiting[node]:
+            return False
+        stats, _ = self.tree.edges(node)
+        n = stats[N].astype(np.float64)
+        _, blocked = self.root_noise(node)
+        if blocked is not None:
+            n[blocked] = -1
+        order = np.argsort(n)
+        best = order[-1]
+        if len(n) == 1 or n[order[-2]] < 0:
+            return True  # 只有一步可走
+        if n[best] - n[order[-2]] > remaining:
+            return True
+        confidence = self.play_config.early_stopping_confidence if hasattr(self.play_config, 'early_stopping_confidence') else 0
+        if not confidence or n[best] < 1 / (1 - confidence):
+            return False
+        z = NormalDist().inv_cdf(confidence)
+        q = stats[Q].astype(np.float64)
+        spread = z * np.sqrt(np.maximum(1 - q * q, 0) / np.maximum(n, 1))
+        others = n >= 1
+        others[best] = False
+        return bool(others.any()) and q[best] - spread[best] > (q + spread)[others].max()
+
+    def descend(self, board, history, park=True):
+        """从history[-1]带虚拟损失下行（history为SearchPath），返回本次模拟的终点：
+        (LEAF, 叶子输入)    新局面，已加入搜索树，等待神经网络评估
+        (VALUE, v)          终局或重复局面，v为该局面走子方的价值
+        (WAITING, 节点编号)  仍在等待评估的叶子；park为真时把本次搜索挂在该节点上，由回传时恢复"""
+        key = history[-1]
+        losses = history.losses
+        while True:
+            with self.node_lock[key]:
+                node = self.tree.get(key)
+                if node is None:
+                    # 树中节点均非终局，只对新局面一次性求终局、着法、键值和编码输入
+                    record = board.expand(self.key_bits, draw_check=key != self.root_key)
+                    if record.terminal:
+                        # 吃将、被将死/困毙或子力必和
+                        return VALUE, record.value * 2
                     # 扩展和评估
-                    node = self.tree[state]
-                    node.sum_n = 1
-                    node.legal_moves = senv.get_legal_moves(state)
-                    node.waiting = True
-                    node.zobrist_hash = zobrist_hash
+                    node = self.tree.add(key, record.legal_actions)
                     
                     # 存储到转置表
                     if self.transposition_table:
-                        self.transposition_table.put(zobrist_hash, node)
-                    
-                    if is_root_node and real_hist:
-                        self.expand_and_evaluate(state, history, real_hist)
-                    else:
-                        self.expand_and_evaluate(state, history)
-                    break
+                        self.transposition_table.put(key, node)
+                    return LEAF, record.leaf
 
-                # 检查重复局面
-                if state in history[:-1]:
-                    for i in range(len(history) - 1):
-                        if history[i] == state:
-                            if senv.will_check_or_catch(state, history[i+1]):
-                                self.executor.submit(self.enhanced_update_tree, None, -1, history, zobrist_hash)
-                            elif senv.be_catched(state, history[i+1]):
-                                self.executor.submit(self.enhanced_update_tree, None, 1, history, zobrist_hash)
-                            else:
-                                self.executor.submit(self.enhanced_update_tree, None, 0, history, zobrist_hash)
-                            break
-                    break
+                # 检查重复局面：按循环内双方的将军/捉子判定长将、长捉或闲着
+                if key in history[0:-1:2]:
+                    plies = (len(history) - 1 - 2 * history[0:-1:2].index(key)) // 2
+                    return VALUE, repetition.cycle_value(board, plies)
 
                 # 选择行动
-                node = self.tree[state]
-                if node.waiting:
-                    node.visit.append(history)
-                    break
-
-                sel_action = self.enhanced_select_action(state, is_root_node)
-                if sel_action is None:
-                    break
+                if self.tree.waiting[node]:
+                    if park:
+                        self.tree.pending.setdefault(node, []).append((history, board.copy()))
+                    return WAITING, node
+
+                i = self.enhanced_select_action(node, key == self.root_key)
+                if i is None:
+                    # 所有着法都被禁止：本次模拟不改变统计
+                    return VALUE, 0
+                stats, actions = self.tree.edges(node)
+                sel_action = int(actions[i])
 
                 # 应用动态虚拟损失
-                virtual_loss = self.enhanced_virtual_loss(node.a[sel_action], node)
-                node.sum_n += 1
-                
-                action_state = node.a[sel_action]
-                action_state.n += virtual_loss
-                action_state.w -= virtual_loss
-                action_state.q = action_state.w / action_state.n
-                
+                virtual_loss = self.enhanced_virtual_loss(float(stats[N, i]), float(stats[Q, i]), self.tree.visits[node])
+                self.tree.visits[node] += 1
+            
+                stats[N, i] += virtual_loss
+                stats[W, i] -= virtual_loss
+                stats[Q, i] = stats[W, i] / stats[N, i]
+                losses.append(virtual_loss)
+            
                 history.append(sel_action)
-                # 使用增量哈希更新提升性能
-                new_state = senv.step(state, sel_action)
-                new_zobrist_hash = self.compute_incremental_hash(zobrist_hash, state, sel_action)
-                zobrist_hash = new_zobrist_hash
-                state = new_state
-                history.append(state)
+                board.push_action(sel_action)
+                key = board.position_key(self.key_bits)
+                history.append(key)
 
     def enhanced_update_tree(self, p, v, history, zobrist_hash=None):
-        """增强的树更新，包含RAVE更新和方差计算"""
-        state = history.pop()
-        z = v
+        """多线程搜索的回传：更新路径，恢复挂起的搜索，计数完成的模拟"""
+        for hist, board in self.backup(p, v, history):
+            self.executor.submit(self.MCTS_search_enhanced, None, hist, False, None, board)
+
+        with self.t_lock:
+            self.num_task -= 1
+            if self.num_task <= 0:
+                self.all_done.release()
+
+    def backup(self, p, v, history):
+        """增强的树更新，包含RAVE更新和方差计算；p为叶子history[-1]的策略（终局时为None），
+        返回挂在该叶子上等待的搜索"""
+        losses = history.losses
+        key = history.pop()
+        parked = ()
 
         if p is not None:
-            with self.node_lock[state]:
-                node = self.tree[state]
-                node.p = p
-                node.waiting = False
+            with self.node_lock[key]:
+                node = self.tree.get(key)
+                self.tree.set_priors(node, p)
+                self.tree.waiting[node] = False
                 if self.debugging:
-                    self.debug[state] = (p, v)
-                for hist in node.visit:
-                    self.executor.submit(self.MCTS_search_enhanced, state, hist)
-                node.visit = []
+                    self.debug[key] = (p, v)
+                if node in self.tree.mirror:
+                    self.share_evaluation(self.tree.mirror.pop(node), p, v)
+                parked = self.tree.pending.pop(node, ())
 
         # 回传更新，包含RAVE更新
         moves_in_path = []
-        virtual_loss = self.play_config.virtual_loss
         
         while len(history) > 0:
             action = history.pop()
-            state = history.pop()
+            key = history.pop()
             moves_in_path.append(action)
             v = -v
+            virtual_loss = losses.pop()
             
-            with self.node_lock[state]:
-                node = self.tree[state]
-                action_state = node.a[action]
+            with self.node_lock[key]:
+                node = self.tree.get(key)
+                stats, _ = self.tree.edges(node)
+                i = self.tree.edge(node, action)
                 
                 # 标准更新
-                old_q = action_state.q
-                action_state.n += 1 - virtual_loss
-                action_state.w += v + virtual_loss
-                action_state.q = action_state.w / action_state.n
+                old_q = stats[Q, i]
+                stats[N, i] += 1 - virtual_loss
+                stats[W, i] += v + virtual_loss
+                stats[Q, i] = stats[W, i] / stats[N, i]
                 
                 # 更新方差（用于UCB1-TUNED）
-                delta = action_state.q - old_q
-                action_state.q_variance += delta * delta
-                action_state.q_variance *= (action_state.n - 1) / action_state.n
+                delta = stats[Q, i] - old_q
+                stats[V, i] += delta * delta
+                stats[V, i] *= (stats[N, i] - 1) / stats[N, i]
                 
                 # RAVE更新：为后续路径中的所有走法更新RAVE值
                 self._update_rave_values(node, moves_in_path[:-1], v)
-
-        with self.t_lock:
-            self.num_task -= 1
-            if self.num_task <= 0:
-                self.all_done.release()
+        return parked
 
     def _update_rave_values(self, node, future_moves, value):
-        """更新RAVE值"""
-        for move in future_moves:
-            if move in node.a:
-                action_state = node.a[move]
-                action_state.rave_n += 1
-                action_state.rave_w += value
-                action_state.rave_q = action_state.rave_w / action_state.rave_n
+        """更新RAVE值：后续路径中每出现一次该走法，计数加一"""
+        if not future_moves:
+            return
+        stats, actions = self.tree.edges(node)
+        counts = np.bincount(future_moves, minlength=self.labels_n)[actions]
+        stats[RAVE_N] += counts
+        stats[RAVE_W] += counts * value
 
     # 保持原有接口兼容性
-    def action(self, state, turns, no_act=None, depth=None, infinite=False, hist=None, increase_temp=False):
-        """主要action接口，使用增强的MCTS"""
+    def action(self, state, turns, no_act=None, depth=None, infinite=False, hist=None, increase_temp=False,
+               movetime=None, time_left=None, increment=0):
+        """主要action接口，使用增强的MCTS。默认搜索depth（缺省为simulation_num_per_move）次模拟，
+        infinite则一直搜索到被停止；给出movetime或剩余时间time_left及每步加秒increment（单位秒）时，
+        搜索到time_budget分配的时间用完为止，depth仍限制模拟次数"""
         self.all_done.acquire(True)
-        self.root_state = state
+        key = self.state_key(state)
+        if self.reuse_tree and key != self.root_key:
+            self.reuse_subtree(state, key)
+        self.root_key = key
+        no_act = self.to_actions(no_act)
         self.no_act = no_act
+        self.root_setup = None
         self.increase_temp = increase_temp
         
         if hist and len(hist) >= 5:
             hist = hist[-5:]
             
         done = 0
-        if state in self.tree:
-            done = self.tree[state].sum_n
+        if key in self.tree:
+            done = self.tree.visits[self.tree.get(key)]
             
         if no_act or increase_temp or done == self.play_config.simulation_num_per_move:
             done = 0
@@ -441,11 +543,23 @@ class Enhanced_AI_Player:
             self.num_task = depth - done if depth > done else 0
         if infinite:
             self.num_task = 100000
-            
         start_time = time()
+        self.deadline = None
+        if movetime is not None or time_left is not None:
+            soft, hard = self.time_budget(state, movetime, time_left, increment)
+            self.deadline = (start_time + soft, start_time + hard)
+            if not depth:
+                self.num_task = 100000
+        self.early_stop = hasattr(self.play_config, 'enable_early_stopping') and \
+            self.play_config.enable_early_stopping and not infinite
+        self.saved_simulations = 0
+        self.search_start = start_time
+        self.search_base = self.done_tasks
         
         # 使用增强的MCTS搜索
-        if self.num_task > 0:
+        if self.num_task > 0 and self.search_batch:
+            self.batched_search(state, hist)
+        elif self.num_task > 0:
             all_tasks = self.num_task
             batch = all_tasks // self.config.play.search_threads
             if all_tasks % self.config.play.search_threads != 0:
@@ -457,29 +571,58 @@ class Enhanced_AI_Player:
                 self.done_tasks += self.num_task
                 
                 for i in range(self.num_task):
-                    self.executor.submit(self.MCTS_search_enhanced, state, [state], True, hist)
+                    self.executor.submit(self.MCTS_search_enhanced, state, SearchPath([key]), True, hist)
                     
                 self.all_done.acquire(True)
+                remaining = all_tasks - self.config.play.search_threads * (iter + 1)
+                if remaining > 0 and self.stop_search(remaining):
+                    break
                 
         self.all_done.release()
+        searched = self.done_tasks - self.search_base
+        if self.deadline:
+            logger.debug(f"限时搜索：{time() - start_time:.2f}秒完成 {searched} 次模拟，分配 {soft:.2f}~{hard:.2f}秒")
+        if self.saved_simulations:
+            logger.debug(f"早停：搜索 {searched} 次模拟后停止，省下 {self.saved_simulations} 次")
+        if self.verify_keys:
+            logger.debug(f"已校验 {len(self.key_states)} 个局面键，碰撞 {self.key_collisions} 次")
+        if self.debugging:
+            logger.debug(f"着法缓存：{movecache.MOVE_CACHE.stats()}")
         
         # 自动内存管理
         if hasattr(self, 'memory_manager'):
             self.memory_manager.auto_memory_management()
         
-        policy, resign = self.calc_policy(state, turns, no_act)
+        policy, resign = self.calc_policy(key, turns, no_act)
         
         if resign:
             return None, list(policy)
             
         if no_act is not None:
-            for act in no_act:
-                policy[self.move_lookup[act]] = 0
+            policy[list(no_act)] = 0
                 
         my_action = int(np.random.choice(range(self.labels_n), 
                                        p=self.apply_temperature(policy, turns)))
         return self.labels[my_action], list(policy)
 
+    def reuse_subtree(self, state, key):
+        """树复用：新根节点保留其下tree_reuse_depth层的子树，复制到新的存储池；
+        其余节点（未走的着法、之前的根节点）随旧存储池一并释放"""
+        before = len(self.tree)
+        depth = self.play_config.tree_reuse_depth if hasattr(self.play_config, 'tree_reuse_depth') else 3
+        keys = self.tree.reachable(senv.ChessBoard(state), self.key_bits, depth) if key in self.tree else ()
+        ids = self.tree.retain(keys)
+        if self.transposition_table:
+            self.transposition_table.remap(ids)
+        self.node_lock = defaultdict(Lock)
+        logger.debug(f"树复用：保留 {len(self.tree)}/{before} 个节点")
+
+    def to_actions(self, moves):
+        """调用方传入的走法字符串 -> 动作索引集合"""
+        if moves is None:
+            return None
+        return {self.move_lookup[mov] for mov in moves}
+
     # 保持其他必要的方法...
     def close(self, wait=True):
         self.job_done = True
@@ -495,8 +638,7 @@ class Enhanced_AI_Player:
             with self.q_lock:
                 l = min(limit, len(self.buffer_history))
                 if l > 0:
-                    t_data = self.buffer_planes[0:l]
-                    self.pipe.send(t_data)
+                    self.pipe.send(self.encode_batch(self.buffer_leaves[0:l]))
                 else:
                     self.run_lock.release()
                     sleep(0.001)
@@ -512,37 +654,83 @@ class Enhanced_AI_Player:
                 for ret in rets:
                     self.executor.submit(self.enhanced_update_tree, ret[0], ret[1], self.buffer_history[k])
                     k = k + 1
-                self.buffer_planes = self.buffer_planes[k:]
+                self.buffer_leaves = self.buffer_leaves[k:]
                 self.buffer_history = self.buffer_history[k:]
             self.run_lock.release()
     
-    def expand_and_evaluate(self, state, history, real_hist=None):
+    def encode_batch(self, leaves):
+        """整批编码为one-hot特征平面，写入复用的uint8缓冲区"""
         if self.use_history:
-            if real_hist:
-                state_planes = senv.state_history_to_planes(state, real_hist)
-            else:
-                state_planes = senv.state_history_to_planes(state, history)
-        else:
-            state_planes = senv.state_to_planes(state)
+            return planes.encode_histories(leaves, self.batch_planes)
+        squares, sides = zip(*leaves)
+        return planes.encode_squares(squares, sides, self.batch_planes)
+
+    def expand_and_evaluate(self, board, history, real_hist=None, leaf=None):
+        evaluation = self.cached_evaluation(board, history)
+        if evaluation is not None:
+            self.executor.submit(self.enhanced_update_tree, *evaluation, history)
+            return
+        leaf = self.leaf_input(board, history, real_hist, leaf)
         with self.q_lock:
-            self.buffer_planes.append(state_planes)
+            self.buffer_leaves.append(leaf)
             self.buffer_history.append(history)
+
+    def cached_evaluation(self, board, history):
+        """共用镜像评估时，新叶子history[-1]由其镜像局面的评估结果得到(p, v)，没有则为None"""
+        if self.share_mirror:
+            node = self.tree.get(history[-1])
+            self.tree.mirror[node] = canonical, mirrored = board.canonical_key(self.key_bits)
+            if canonical in self.evaluations:
+                p, v = self.evaluations[canonical]
+                return mirror_policy(p) if mirrored else p, v
+        return None
+
+    def leaf_input(self, board, history, real_hist=None, leaf=None):
+        """棋盘上叶子局面交给encode_batch的输入：(棋盘数组, 走子方)，或局面历史"""
+        if self.verify_keys:
+            self.check_key(history[-1], board.to_state())
+        if self.use_history:
+            return real_hist if real_hist else self.path_states(board, history)
+        if leaf is None:
+            leaf = (bytes(board.squares), board.side)
+        return leaf
+
+    def share_evaluation(self, mirror, p, v):
+        """以规范方向存入评估缓存"""
+        canonical, mirrored = mirror
+        with self.s_lock:
+            if len(self.evaluations) >= self.evaluation_cache_size:
+                self.evaluations.clear()
+            self.evaluations[canonical] = (mirror_policy(p) if mirrored else p, v)
+
+    def path_states(self, board, history):
+        """搜索路径上的[局面, 走法, 局面, ...]字符串，供历史特征平面使用"""
+        board = board.copy()
+        path = [board.to_state()]
+        for i in range(len(history) - 2, 0, -2):
+            board.pop()
+            path[:0] = [board.to_state(), self.labels[history[i]]]
+        return path
     
-    def calc_policy(self, state, turns, no_act):
-        node = self.tree[state]
+    def calc_policy(self, key, turns, no_act):
+        node = self.tree.get(key)
         policy = np.zeros(self.labels_n)
         max_q_value = -100
         debug_result = {}
 
-        for mov, action_state in node.a.items():
-            policy[self.move_lookup[mov]] = action_state.n
+        edges = ()
+        if node is not None:
+            stats, actions = self.tree.edges(node)
+            edges = zip(actions.tolist(), stats[N].tolist(), stats[Q].tolist(), stats[P].tolist())
+        for mov, n, q, p in edges:
+            policy[mov] = n
             if no_act and mov in no_act:
-                policy[self.move_lookup[mov]] = 0
+                policy[mov] = 0
                 continue
             if self.debugging:
-                debug_result[mov] = (action_state.n, action_state.q, action_state.p)
-            if action_state.q > max_q_value:
-                max_q_value = action_state.q
+                debug_result[self.labels[mov]] = (n, q, p)
+            if q > max_q_value:
+                max_q_value = q
 
         if max_q_value < self.play_config.resign_threshold and self.enable_resign and turns > self.play_config.min_resign_turn:
             return policy, True
@@ -613,6 +801,5 @@ class Enhanced_AI_Player:
         return {
             'memory_health': health,
             'tree_stats': tree_stats,
-            'hash_cache_size': len(getattr(self, 'hash_cache', {})),
             'transposition_table_size': len(getattr(self.transposition_table, 'table', {})) if self.transposition_table else 0
         } 
\ No newline at end of file
@@ -105,7 +105,7 @@ class SearchTreeManager:
         max_visits = 0
         
         for state, node in tree.items():
-            visits = getattr(node, 'sum_n', 0)
+            visits = tree.visits[node]
             visit_counts.append(visits)
             total_visits += visits
             max_visits = max(max_visits, visits)
@@ -125,7 +125,8 @@ class SearchTreeManager:
             'median_visits': median_visits,
             'max_visits': max_visits,
             'low_visit_nodes': low_visit_nodes,
-            'low_visit_ratio': low_visit_nodes / total_nodes if total_nodes > 0 else 0
+            'low_visit_ratio': low_visit_nodes / total_nodes if total_nodes > 0 else 0,
+            'pool_bytes': tree.nbytes()
         }
     
     def should_cleanup(self) -> bool:
@@ -164,9 +165,7 @@ class SearchTreeManager:
         # 收集所有节点的访问信息
         node_info = []
         for state, node in tree.items():
-            visits = getattr(node, 'sum_n', 0)
-            last_updated = getattr(node, 'last_updated', 0)
-            node_info.append((state, visits, last_updated))
+            node_info.append((state, tree.visits[node]))
         
         # 按访问次数排序，保留高访问节点
         node_info.sort(key=lambda x: x[1], reverse=True)
@@ -177,17 +176,13 @@ class SearchTreeManager:
             1000  # 至少保留1000个节点
         )
         
-        # 清理低访问节点
-        nodes_to_remove = node_info[keep_count:]
-        removed_count = 0
-        
-        for state, visits, _ in nodes_to_remove:
-            if visits < self.min_visit_threshold:
-                try:
-                    del tree[state]
-                    removed_count += 1
-                except KeyError:
-                    pass
+        # 清理低访问节点：其余节点复制到新的存储池，旧存储池整体释放
+        removed = {state for state, visits in node_info[keep_count:] if visits < self.min_visit_threshold}
+        removed_count = len(removed)
+        if removed:
+            ids = tree.retain(state for state, _ in node_info if state not in removed)
+            if hasattr(self.ai_player, 'transposition_table') and self.ai_player.transposition_table:
+                self.ai_player.transposition_table.remap(ids)
         
         # 更新清理时间
         self.last_cleanup_time = time.time()
@@ -210,20 +205,6 @@ class SearchTreeManager:
         """清理各种缓存"""
         cleanup_results = {}
         
-        # 清理哈希缓存
-        if hasattr(self.ai_player, 'hash_cache'):
-            initial_hash_cache = len(self.ai_player.hash_cache)
-            # 保留最近使用的一半
-            if initial_hash_cache > 1000:
-                keys_to_remove = list(self.ai_player.hash_cache.keys())[initial_hash_cache//2:]
-                for key in keys_to_remove:
-                    del self.ai_player.hash_cache[key]
-                cleanup_results['hash_cache'] = {
-                    'initial': initial_hash_cache,
-                    'removed': len(keys_to_remove),
-                    'remaining': len(self.ai_player.hash_cache)
-                }
-        
         # 清理转置表
         if hasattr(self.ai_player, 'transposition_table') and self.ai_player.transposition_table:
             tt = self.ai_player.transposition_table
@@ -232,7 +213,7 @@ class SearchTreeManager:
                 # 简单清理：移除低访问节点
                 if initial_tt_size > tt.max_size * 0.8:
                     min_visits = 10
-                    keys_to_remove = [k for k, v in tt.table.items() if getattr(v, 'sum_n', 0) < min_visits]
+                    keys_to_remove = [k for k, v in tt.table.items() if tt.tree.visits[v] < min_visits]
                     for key in keys_to_remove[:len(keys_to_remove)//2]:
                         del tt.table[key]
                     cleanup_results['transposition_table'] = {
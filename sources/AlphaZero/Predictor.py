@@ -20,6 +20,7 @@ class Predictor:
         self.config = config
         self.need_reload = True
         self.done = False
+        self.planes = None      # float32 batch buffer, grown on demand
 
     def start(self, need_reload=True):
         self.need_reload = need_reload
@@ -51,12 +52,12 @@ class Predictor:
                         logger.error(f"EOF error: {e}")
                         pipe.close()
                     else:
-                        data.extend(tmp)
+                        data.append(tmp)
                         data_len.append(len(tmp))
                         result_pipes.append(pipe)
             if not data:
                 continue
-            data = np.asarray(data, dtype=np.float32)
+            data = self.batch_planes(data, sum(data_len))
             # In TensorFlow 2.x, we don't need to use graph context
             policy_ary, value_ary = self.model.model.predict_on_batch(data)
             buf = []
@@ -70,6 +71,17 @@ class Predictor:
                     k = 0
                     i += 1
 
+    def batch_planes(self, chunks, size):
+        # players send uint8 plane batches; copy them into one float32 buffer for the model
+        shape = np.shape(chunks[0])[1:]
+        if self.planes is None or self.planes.shape[1:] != shape or len(self.planes) < size:
+            self.planes = np.empty((max(size, 256),) + shape, dtype=np.float32)
+        offset = 0
+        for chunk in chunks:
+            self.planes[offset:offset + len(chunk)] = chunk
+            offset += len(chunk)
+        return self.planes[:size]
+
     def try_reload_model(self, config_file=None):
         if config_file:
             config_path = os.path.join(self.config.resource.model_dir, config_file)
@@ -0,0 +1,169 @@
+"""
+Search tree storage of the MCTS players, as a struct of arrays.
+
+Nodes are integer ids and the tree maps position keys to them. The scalars of a node live
+in lists indexed by id: visit count (sum_n), first edge, edge count and the waiting flag
+(NN result pending). The edges of a node, one per legal move, are a contiguous block of a
+pool chunk: a float32 row per statistic in FIELDS and a uint16 row of action indices
+(ActionLabelsRed). Chunks are allocated whole and never resized, so the views one search
+thread holds stay valid while another expands the tree; a block never straddles chunks.
+
+    node = tree.add(key, legal_actions)     # children start with zero statistics
+    stats, actions = tree.edges(node)       # (len(FIELDS), k) and (k,) views
+    stats[N, i] += 1                        # writes go to the pool
+
+A node with k children costs 4 * len(FIELDS) * k + 2 * k bytes of edges plus about 200
+bytes of scalars and index entry: 0.9 KB at k = 40 (1.4 KB with the extended rows), where
+an object per child took 5.6 KB (7.5 KB).
+Dropping a key only unlinks it from the index; the storage comes back with clear(), or
+with retain(), which copies the nodes still wanted into fresh pools and lets the old
+chunks go at once.
+"""
+
+from threading import Lock
+from typing import Dict, Iterable, Iterator, Optional, Set, Tuple
+
+import numpy as np
+
+N, W, Q, P = range(4)           # rows of SearchTree.FIELDS
+V, RAVE_N, RAVE_W = range(4, 7)  # extra rows of ExtendedSearchTree.FIELDS
+
+LEAF, VALUE, WAITING = range(3)  # where a descent from the root ends
+
+CHUNK_SHIFT = 16
+CHUNK_EDGES = 1 << CHUNK_SHIFT
+
+
+class SearchTree:
+    FIELDS = ('n', 'w', 'q', 'p')
+
+    def __init__(self):
+        self.lock = Lock()
+        self.clear()
+
+    def clear(self) -> None:
+        with self.lock:
+            self.index = {}             # position key -> node id
+            self.visits = []            # node id -> sum_n
+            self.first = []             # node id -> global index of its first edge
+            self.count = []             # node id -> number of edges
+            self.waiting = []           # node id -> waiting for the NN result
+            self.pending = {}           # node id -> [(history, board)] of searches parked on it
+            self.mirror = {}            # node id -> (canonical key, mirrored) when sharing NN results
+            self.stats = []             # chunks of edge statistics, (len(FIELDS), CHUNK_EDGES) float32
+            self.actions = []           # chunks of action indices, (CHUNK_EDGES,) uint16
+            self.edges_used = CHUNK_EDGES  # edges taken in the last chunk
+
+    def __contains__(self, key) -> bool:
+        return key in self.index
+
+    def __len__(self) -> int:
+        return len(self.index)
+
+    def __delitem__(self, key) -> None:
+        del self.index[key]
+
+    def get(self, key) -> Optional[int]:
+        return self.index.get(key)
+
+    def items(self) -> Iterator[Tuple[int, int]]:
+        """(position key, node id) pairs, on a copy of the index."""
+        return iter(list(self.index.items()))
+
+    def add(self, key, legal_actions, visits=1) -> int:
+        """New node for `key` whose edges are `legal_actions`, marked as waiting."""
+        k = len(legal_actions)
+        with self.lock:
+            if self.edges_used + k > CHUNK_EDGES:
+                self.stats.append(np.zeros((len(self.FIELDS), CHUNK_EDGES), dtype=np.float32))
+                self.actions.append(np.zeros(CHUNK_EDGES, dtype=np.uint16))
+                self.edges_used = 0
+            chunk = len(self.stats) - 1
+            offset = self.edges_used
+            self.actions[chunk][offset:offset + k] = legal_actions
+            self.edges_used += k
+            node = len(self.visits)
+            self.visits.append(visits)
+            self.first.append(chunk << CHUNK_SHIFT | offset)
+            self.count.append(k)
+            self.waiting.append(True)
+            self.index[key] = node
+        return node
+
+    def edges(self, node) -> Tuple[np.ndarray, np.ndarray]:
+        """Statistics (len(FIELDS), k) and action indices (k,) of the children of `node`."""
+        first = self.first[node]
+        chunk, offset = first >> CHUNK_SHIFT, first & (CHUNK_EDGES - 1)
+        end = offset + self.count[node]
+        return self.stats[chunk][:, offset:end], self.actions[chunk][offset:end]
+
+    def edge(self, node, action) -> int:
+        """Position of `action` among the children of `node`, -1 if it is not one."""
+        _, actions = self.edges(node)
+        found = np.flatnonzero(actions == action)
+        return int(found[0]) if len(found) else -1
+
+    def set_priors(self, node, policy) -> None:
+        """P of the children from a full policy vector, renormalised over the legal moves."""
+        stats, actions = self.edges(node)
+        priors = np.asarray(policy)[actions]
+        total = priors.sum()
+        stats[P] = priors / (total if total else 1)
+
+    def reachable(self, board, key_bits, depth) -> Set[int]:
+        """
+        Keys of the nodes reached from the position on `board` through visited edges, at most
+        `depth` plies below it. The board is walked with push/pop and left as it was.
+        """
+        root = board.position_key(key_bits)
+        left = {root: depth}        # key -> most plies still allowed below it
+
+        def walk(key):
+            node = self.index.get(key)
+            if node is None or not left[key]:
+                return
+            stats, actions = self.edges(node)
+            for action in actions[stats[N] > 0].tolist():
+                board.push_action(action)
+                child = board.position_key(key_bits)
+                if child in self.index and left.get(child, -1) < left[key] - 1:
+                    left[child] = left[key] - 1
+                    walk(child)
+                board.pop()
+
+        walk(root)
+        return set(left)
+
+    def retain(self, keys: Iterable[int]) -> Dict[int, int]:
+        """
+        Keep only the nodes of `keys`, copied into new pools; everything else is released
+        with the old chunks. Node ids change: returns old id -> new id.
+        """
+        index, visits, waiting = self.index, self.visits, self.waiting
+        pending, mirror = self.pending, self.mirror
+        kept = [(key, index[key]) for key in keys if key in index]
+        blocks = [self.edges(node) for _, node in kept]
+        self.clear()
+        remap = {}
+        for (key, node), (stats, actions) in zip(kept, blocks):
+            new = self.add(key, actions, visits[node])
+            self.edges(new)[0][:] = stats
+            self.waiting[new] = waiting[node]
+            remap[node] = new
+        self.pending = {remap[node]: parked for node, parked in pending.items() if node in remap}
+        self.mirror = {remap[node]: m for node, m in mirror.items() if node in remap}
+        return remap
+
+    def nbytes(self) -> int:
+        """Bytes held by the edge pools."""
+        return sum(s.nbytes for s in self.stats) + sum(a.nbytes for a in self.actions)
+
+    def summary(self) -> dict:
+        edges = sum(self.count)
+        return {'nodes': len(self.index), 'allocated_nodes': len(self.visits), 'edges': edges,
+                'chunks': len(self.stats), 'pool_bytes': self.nbytes()}
+
+
+class ExtendedSearchTree(SearchTree):
+    """Adds the UCB1-tuned variance and RAVE rows used by Enhanced_AI_Player."""
+    FIELDS = ('n', 'w', 'q', 'p', 'q_variance', 'rave_n', 'rave_w')
@@ -224,6 +224,11 @@ class Book:
         #     print(str(i))
         return list(set(result + result1))
 
+    def probe(self, board):
+        # query() for a board that keeps its .obk locks up to date (Chessboard, FastChessboard,
+        # static_env.ChessBoard): the side to move comes from the board, nothing is recomputed
+        return list(set(self.get(board.book_key(False), 0) + self.get(board.book_key(True), 1)))
+
     def get(self, zobrist, leftRightSwap):
         results = []
 
@@ -0,0 +1,235 @@
+"""
+90-bit bitboards for attack queries.
+
+Bit y * 9 + x stands for file x, rank y (red home rank = 0), in absolute orientation.
+Leaper attacks (knight, elephant, advisor, king, pawn) come from precomputed tables that
+carry the square which blocks them (knight leg, elephant eye). Rooks and cannons use
+occupancy-indexed tables per rank and per file, so "is square X attacked by side S" is a
+handful of table lookups instead of a full move generation.
+"""
+
+from typing import List, Tuple
+
+KING, ADVISOR, BISHOP, KNIGHT, ROOK, CANNON, PAWN = range(7)
+RED, BLACK = 0, 1
+
+BITS = tuple(1 << b for b in range(90))
+FULL = (1 << 90) - 1
+
+
+def bit_index(x: int, y: int) -> int:
+    return y * 9 + x
+
+
+def _on_board(x: int, y: int) -> bool:
+    return 0 <= x < 9 and 0 <= y < 10
+
+
+def _in_palace(x: int, y: int) -> bool:
+    return 3 <= x <= 5 and (0 <= y <= 2 or 7 <= y <= 9)
+
+
+def _home(side: int, y: int) -> bool:
+    return y <= 4 if side == RED else y >= 5
+
+
+def _mask(squares) -> int:
+    m = 0
+    for x, y in squares:
+        m |= BITS[bit_index(x, y)]
+    return m
+
+
+def _slide_table(length: int) -> List[List[Tuple[int, int]]]:
+    # table[pos][occ] = (rook attacks, cannon attacks) along one line, as `length`-bit masks
+    table = []
+    for pos in range(length):
+        row = []
+        for occ in range(1 << length):
+            rook = cannon = 0
+            for step in (-1, 1):
+                i = pos + step
+                while 0 <= i < length and not occ >> i & 1:
+                    rook |= 1 << i
+                    i += step
+                if 0 <= i < length:
+                    rook |= 1 << i
+                    i += step
+                    while 0 <= i < length and not occ >> i & 1:
+                        i += step
+                    if 0 <= i < length:
+                        cannon |= 1 << i
+            row.append((rook, cannon))
+        table.append(row)
+    return table
+
+
+RANK_ATTACKS = _slide_table(9)      # [x][rank occupancy]
+FILE_ATTACKS = _slide_table(10)     # [y][file occupancy]
+# FILE_SPREAD[x][bits] turns a 10-bit file mask into a board mask on file x
+FILE_SPREAD = [[_mask((x, y) for y in range(10) if bits >> y & 1) for bits in range(1 << 10)]
+               for x in range(9)]
+
+
+def _leaper_tables():
+    knight_moves, knight_attackers = [], []
+    bishop_moves, advisor_moves, king_moves = [], [], []
+    pawn_moves = ([], [])
+    pawn_attackers = ([], [])
+    for b in range(90):
+        x, y = b % 9, b // 9
+        # knight: (leg, targets) from b, and (leg, sources) that reach b
+        moves, attackers = [], []
+        for lx, ly in ((0, 1), (0, -1), (1, 0), (-1, 0)):
+            if not _on_board(x + lx, y + ly):
+                continue
+            targets = [(x + 2 * lx + ly, y + 2 * ly + lx), (x + 2 * lx - ly, y + 2 * ly - lx)]
+            moves.append((BITS[bit_index(x + lx, y + ly)], _mask(t for t in targets if _on_board(*t))))
+        for dx, dy in ((1, 1), (1, -1), (-1, 1), (-1, -1)):
+            if not _on_board(x + dx, y + dy):
+                continue
+            sources = [(x + 2 * dx, y + dy), (x + dx, y + 2 * dy)]
+            attackers.append((BITS[bit_index(x + dx, y + dy)], _mask(s for s in sources if _on_board(*s))))
+        knight_moves.append(tuple(moves))
+        knight_attackers.append(tuple(attackers))
+        # elephant: (eye, target); the move is symmetric so the table also lists attackers
+        side = RED if y <= 4 else BLACK
+        bishop_moves.append(tuple(
+            (BITS[bit_index(x + dx, y + dy)], BITS[bit_index(x + 2 * dx, y + 2 * dy)])
+            for dx, dy in ((1, 1), (1, -1), (-1, 1), (-1, -1))
+            if _on_board(x + 2 * dx, y + 2 * dy) and _home(side, y + 2 * dy)))
+        advisor_moves.append(_mask((x + dx, y + dy) for dx, dy in ((1, 1), (1, -1), (-1, 1), (-1, -1))
+                                   if _in_palace(x, y) and _in_palace(x + dx, y + dy)))
+        king_moves.append(_mask((x + dx, y + dy) for dx, dy in ((1, 0), (-1, 0), (0, 1), (0, -1))
+                                if _in_palace(x, y) and _in_palace(x + dx, y + dy)))
+        for side, forward in ((RED, 1), (BLACK, -1)):
+            targets = [(x, y + forward)]
+            if not _home(side, y):
+                targets += [(x - 1, y), (x + 1, y)]
+            pawn_moves[side].append(_mask(t for t in targets if _on_board(*t)))
+            sources = [(x, y - forward)] + [(x + dx, y) for dx in (-1, 1) if not _home(side, y)]
+            pawn_attackers[side].append(_mask(s for s in sources if _on_board(*s)))
+    return (tuple(knight_moves), tuple(knight_attackers), tuple(bishop_moves), tuple(advisor_moves),
+            tuple(king_moves), (tuple(pawn_moves[0]), tuple(pawn_moves[1])),
+            (tuple(pawn_attackers[0]), tuple(pawn_attackers[1])))
+
+
+(KNIGHT_MOVES, KNIGHT_ATTACKERS, BISHOP_MOVES, ADVISOR_MOVES,
+ KING_MOVES, PAWN_MOVES, PAWN_ATTACKERS) = _leaper_tables()
+
+
+def lowest_bit(mask: int) -> int:
+    return (mask & -mask).bit_length() - 1
+
+
+def iter_bits(mask: int):
+    while mask:
+        low = mask & -mask
+        yield low.bit_length() - 1
+        mask ^= low
+
+
+class Bitboards:
+    """Piece masks per side and type plus rank/file occupancy for the slider tables."""
+    __slots__ = ('pieces', 'sides', 'ranks', 'files')
+
+    def __init__(self):
+        self.pieces = [0] * 14          # index side * 7 + type
+        self.sides = [0, 0]
+        self.ranks = [0] * 10           # 9-bit occupancy per rank
+        self.files = [0] * 9            # 10-bit occupancy per file
+
+    def copy(self) -> 'Bitboards':
+        bits = Bitboards.__new__(Bitboards)
+        bits.pieces = self.pieces[:]
+        bits.sides = self.sides[:]
+        bits.ranks = self.ranks[:]
+        bits.files = self.files[:]
+        return bits
+
+    @property
+    def occupied(self) -> int:
+        return self.sides[0] | self.sides[1]
+
+    def put(self, b: int, side: int, kind: int) -> None:
+        bit = BITS[b]
+        self.pieces[side * 7 + kind] |= bit
+        self.sides[side] |= bit
+        self.ranks[b // 9] |= 1 << b % 9
+        self.files[b % 9] |= 1 << b // 9
+
+    def remove(self, b: int, side: int, kind: int) -> None:
+        bit = ~BITS[b]
+        self.pieces[side * 7 + kind] &= bit
+        self.sides[side] &= bit
+        self.ranks[b // 9] &= ~(1 << b % 9)
+        self.files[b % 9] &= ~(1 << b // 9)
+
+    # ---------------------------------------------------------------- sliders
+
+    def rook_cannon(self, b: int) -> Tuple[int, int]:
+        """Rook and cannon attack masks from square b under the current occupancy."""
+        x, y = b % 9, b // 9
+        rank_rook, rank_cannon = RANK_ATTACKS[x][self.ranks[y]]
+        file_rook, file_cannon = FILE_ATTACKS[y][self.files[x]]
+        spread = FILE_SPREAD[x]
+        shift = y * 9
+        return (rank_rook << shift | spread[file_rook],
+                rank_cannon << shift | spread[file_cannon])
+
+    # ---------------------------------------------------------------- queries
+
+    def attacks(self, b: int, side: int, kind: int) -> int:
+        """Squares a `kind` piece of `side` standing on b attacks (own pieces included)."""
+        if kind == ROOK:
+            return self.rook_cannon(b)[0]
+        if kind == CANNON:
+            return self.rook_cannon(b)[1]
+        if kind == KNIGHT:
+            occupied = self.sides[0] | self.sides[1]
+            mask = 0
+            for leg, targets in KNIGHT_MOVES[b]:
+                if not occupied & leg:
+                    mask |= targets
+            return mask
+        if kind == BISHOP:
+            occupied = self.sides[0] | self.sides[1]
+            mask = 0
+            for eye, target in BISHOP_MOVES[b]:
+                if not occupied & eye:
+                    mask |= target
+            return mask
+        if kind == ADVISOR:
+            return ADVISOR_MOVES[b]
+        if kind == PAWN:
+            return PAWN_MOVES[side][b]
+        return KING_MOVES[b]
+
+    def attackers(self, b: int, side: int, flying: bool = False) -> int:
+        """Mask of `side` pieces attacking square b. `flying` adds the facing-kings capture."""
+        pieces = self.pieces
+        base = side * 7
+        rook, cannon = self.rook_cannon(b)
+        found = rook & pieces[base + ROOK] | cannon & pieces[base + CANNON]
+        knights = pieces[base + KNIGHT]
+        if knights:
+            occupied = self.sides[0] | self.sides[1]
+            for leg, sources in KNIGHT_ATTACKERS[b]:
+                if knights & sources and not occupied & leg:
+                    found |= knights & sources
+        found |= PAWN_ATTACKERS[side][b] & pieces[base + PAWN]
+        found |= KING_MOVES[b] & pieces[base + KING]
+        found |= ADVISOR_MOVES[b] & pieces[base + ADVISOR]
+        bishops = pieces[base + BISHOP]
+        if bishops:
+            occupied = self.sides[0] | self.sides[1]
+            for eye, source in BISHOP_MOVES[b]:
+                if bishops & source and not occupied & eye:
+                    found |= source
+        if flying:
+            x = b % 9
+            found |= FILE_SPREAD[x][FILE_ATTACKS[b // 9][self.files[x]][0]] & pieces[base + KING]
+        return found
+
+    def is_attacked(self, b: int, side: int, flying: bool = False) -> bool:
+        return self.attackers(b, side, flying) != 0
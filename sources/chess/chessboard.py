@@ -1,12 +1,32 @@
 import codecs
+from typing import NamedTuple
 
 from sources.chess.lookup_tables import Winner
 from sources.chess.chessman import *
+from sources.chess.mailbox import STATE_TO_PIECE, square
+from sources.chess.zobrist import BOOK_KEYS, book_lock
 
 from sources.utils.logger import getLogger
 
 logger = getLogger(__name__)
 
+
+def book_entry(chessman, col_num, row_num):
+    return BOOK_KEYS[STATE_TO_PIECE[ord(chessman.fen)] * 256 + square(col_num, row_num)]
+
+
+class BoardSnapshot(NamedTuple):
+    '''
+    Immutable board state: cells[x * 10 + y] is 0 for an empty square or 1 + the roster
+    index of the chessman standing there. Only valid for the board that took it or its copies.
+    '''
+    cells: bytes
+    is_red_turn: bool
+    turns: int
+    record: str
+    winner: object
+
+
 class Chessboard(object):
 
     def __init__(self, name='000'):
@@ -14,6 +34,22 @@ class Chessboard(object):
         self.__is_red_turn = True
         self.__chessmans = [([None] * 10) for i in range(9)]
         self.__chessmans_hash = {}
+        # moving lists last calculated per chessman name; a name in __stale has to be
+        # recalculated because a square its moves depend on changed since
+        self.__moving_lists = {}
+        self.__stale = set()
+        # who watches what: chessmans indexed by the squares their moving list depends
+        # on (cell col_num * 10 + row_num), rooks and cannons by their file and rank
+        self.__cell_watchers = [set() for i in range(90)]
+        self.__file_watchers = [set() for i in range(9)]
+        self.__rank_watchers = [set() for i in range(10)]
+        self.__watching = {}            # name -> the watcher sets it is in
+        self.__move_strs = {}           # name -> (moving list, col, row, its move strings)
+        self.__sides = None             # (name, chessman) of black and red, in __chessmans_hash order
+        # every chessman ever placed, in order; snapshots refer to them by index
+        self.__roster = []
+        self.__roster_index = {}
+        self.__book = 0                 # running .obk lock pair, see zobrist.BOOK_KEYS
         self.turns = 1
         self.record = ''
         self.winner = None
@@ -51,12 +87,16 @@ class Chessboard(object):
             for chess in row:
                 if chess != None:
                     chess.reset_board(self)
+        self.__forget_moving_lists()
+        self.__rebook()
 
     def Set_chessmans_hash(self, hash):
         self.__chessmans_hash.clear()
         self.__chessmans_hash.update(hash)
         for chess in self.__chessmans_hash.values():
             chess.reset_board(self)
+        self.__forget_moving_lists()
+
     def init_board(self):
         red_rook_left = Rook(u" 车l红 ", "red_rook_left", True, self, 'R')
         red_rook_left.add_to_board(0, 0)
@@ -144,29 +184,151 @@ class Chessboard(object):
 
     def add_chessman(self, chessman, col_num, row_num):
         self.chessmans[col_num][row_num] = chessman
+        self.__book ^= book_entry(chessman, col_num, row_num)
+        if chessman.name not in self.__roster_index:
+            self.__roster_index[chessman.name] = len(self.__roster)
+            self.__roster.append(chessman)
         if chessman.name not in self.__chessmans_hash:
             self.__chessmans_hash[chessman.name] = chessman
+            self.__sides = None
+        self.__stale.add(chessman.name)
+        self.__touch(col_num, row_num)
+        self.__watch(chessman, col_num, row_num)
 
     def remove_chessman_target(self, col_num, row_num):
         chessman_old = self.get_chessman(col_num, row_num)
         if chessman_old != None:
+            self.__book ^= book_entry(chessman_old, col_num, row_num)
             self.__chessmans_hash.pop(chessman_old.name)
+            self.__sides = None
+            self.__moving_lists.pop(chessman_old.name, None)
+            self.__move_strs.pop(chessman_old.name, None)
+            self.__unwatch(chessman_old.name)
             chessman_old.is_alive = False
         return chessman_old
 
     def remove_chessman_source(self, col_num, row_num):
+        chessman = self.chessmans[col_num][row_num]
+        if chessman != None:
+            self.__book ^= book_entry(chessman, col_num, row_num)
         self.chessmans[col_num][row_num] = None
+        self.__touch(col_num, row_num)
+
+    def __touch(self, col_num, row_num):
+        # the chessmans whose rays, legs, eyes or targets cover the changed square
+        stale = self.__stale
+        stale |= self.__cell_watchers[col_num * 10 + row_num]
+        stale |= self.__file_watchers[col_num]
+        stale |= self.__rank_watchers[row_num]
+
+    def __watch(self, chessman, col_num, row_num):
+        name = chessman.name
+        self.__unwatch(name)
+        if chessman.WATCH_LINES:
+            watching = (self.__file_watchers[col_num], self.__rank_watchers[row_num])
+        else:
+            cells = self.__cell_watchers
+            watching = [cells[(col_num + dx) * 10 + row_num + dy] for dx, dy in chessman.WATCH_OFFSETS
+                        if 0 <= col_num + dx <= 8 and 0 <= row_num + dy <= 9]
+        for watchers in watching:
+            watchers.add(name)
+        self.__watching[name] = watching
+
+    def __unwatch(self, name):
+        for watchers in self.__watching.pop(name, ()):
+            watchers.discard(name)
+
+    def __rebook(self):
+        book = 0
+        for col_num, column in enumerate(self.__chessmans):
+            for row_num, chessman in enumerate(column):
+                if chessman != None:
+                    book ^= book_entry(chessman, col_num, row_num)
+        self.__book = book
+
+    def book_key(self, mirror=False):
+        '''Lock of the position in .obk opening books, kept up to date move by move.'''
+        return book_lock(self.__book, self.__is_red_turn, mirror)
+
+    def __forget_moving_lists(self):
+        self.__sides = None
+        self.__moving_lists.clear()
+        self.__move_strs.clear()
+        self.__stale = set(self.__chessmans_hash)
+        for name in list(self.__watching):
+            self.__unwatch(name)
+        for chessman in self.__chessmans_hash.values():
+            self.__watch(chessman, chessman.position.x, chessman.position.y)
+
+    def __side_to_move(self):
+        sides = self.__sides
+        if sides is None:
+            sides = self.__sides = ([], [])
+            for name, chessman in self.__chessmans_hash.items():
+                sides[chessman.is_red].append((name, chessman))
+        return sides[self.__is_red_turn]
 
     def calc_chessmans_moving_list(self):
-        for chessman in self.__chessmans_hash.values():
-            if chessman.is_red == self.__is_red_turn:
+        # only the chessmans touched by the moves since their last calculation are
+        # recalculated, the others get their previous list back; the lists are shared,
+        # every calc_moving_list() starts from a fresh one after clear_moving_list()
+        moving_lists = self.__moving_lists
+        stale = self.__stale
+        for name, chessman in self.__side_to_move():
+            if name in stale or name not in moving_lists:
                 chessman.clear_moving_list()
                 chessman.calc_moving_list()
+                moving_lists[name] = chessman.moving_list
+                stale.discard(name)
+            else:
+                chessman.restore_moving_list(moving_lists[name])
 
     def clear_chessmans_moving_list(self):
         for chessman in self.__chessmans_hash.values():
             chessman.clear_moving_list()
 
+    def snapshot(self):
+        cells = bytearray(90)
+        index = self.__roster_index
+        for name, chessman in self.__chessmans_hash.items():
+            cells[chessman.col_num * 10 + chessman.row_num] = index[name] + 1
+        return BoardSnapshot(bytes(cells), self.__is_red_turn, self.turns, self.record, self.winner)
+
+    def restore(self, snapshot):
+        '''Put the chessmans back where `snapshot` has them; the same objects are reused.'''
+        for column in self.__chessmans:
+            for i in range(10):
+                column[i] = None
+        self.__chessmans_hash.clear()
+        roster = self.__roster
+        for cell, code in enumerate(snapshot.cells):
+            if code:
+                chessman = roster[code - 1]
+                chessman.is_alive = True
+                chessman.position.x = cell // 10
+                chessman.position.y = cell % 10
+                self.__chessmans[cell // 10][cell % 10] = chessman
+                self.__chessmans_hash[chessman.name] = chessman
+        for chessman in roster:
+            if chessman.name not in self.__chessmans_hash:
+                chessman.is_alive = False
+        self.__is_red_turn = snapshot.is_red_turn
+        self.turns = snapshot.turns
+        self.record = snapshot.record
+        self.winner = snapshot.winner
+        self.__forget_moving_lists()
+        self.__rebook()
+
+    def copy(self):
+        board = Chessboard(self.__name)
+        for chessman in self.__roster:
+            twin = type(chessman)(chessman.name_cn, chessman.name, chessman.is_red, board, chessman.fen)
+            board.__roster_index[twin.name] = len(board.__roster)
+            board.__roster.append(twin)
+        board.restore(self.snapshot())
+        board.calc_chessmans_moving_list()
+        return board
+
     def move_chessman(self, chessman, col_num, row_num, 
                       is_record = False, old_x = 0, old_y = 0):
         if chessman.is_red == self.__is_red_turn:
@@ -198,15 +360,30 @@ class Chessboard(object):
 
     def legal_moves(self):
         _legal_moves = []
-        for chessman in self.__chessmans_hash.values():
-            if chessman.is_red == self.is_red_turn:
-                p = chessman.position
-                x0 = p.x
-                y0 = p.y
-                for point in chessman.moving_list:
-                    _legal_moves.append(self.move_to_str(x0, y0, point.x, point.y))
+        move_strs = self.__move_strs
+        for name, chessman in self.__side_to_move():
+            p = chessman.position
+            x0 = p.x
+            y0 = p.y
+            points = chessman.moving_list
+            cached = move_strs.get(name)
+            # the strings are reused as long as the same list is handed back
+            if cached is None or cached[0] is not points or cached[1] != x0 or cached[2] != y0:
+                cached = (points, x0, y0, [self.move_to_str(x0, y0, point.x, point.y) for point in points])
+                move_strs[name] = cached
+            _legal_moves.extend(cached[3])
         return _legal_moves
 
+    def __king_capture(self, target):
+        # the first move onto the enemy king, in legal_moves() order, or None
+        x = target.x
+        y = target.y
+        for name, chessman in self.__side_to_move():
+            if chessman.in_moving_list(x, y):
+                p = chessman.position
+                return self.move_to_str(p.x, p.y, x, y)
+        return None
+
 
     def is_end(self):
         red_king = self.get_chessman_by_name('red_king')
@@ -227,18 +404,15 @@ class Chessboard(object):
                 else:
                     self.winner = Winner.black
         if self.winner is None:
-            legal_moves = self.legal_moves()
             if self.is_red_turn:
                 target = black_king.position
             else:
                 target = red_king.position
-            for move in legal_moves:
-                if int(move[2]) == target.x and int(move[3]) == target.y:
-                    if self.is_red_turn:
-                        self.winner = Winner.red
-                    else:
-                        self.winner = Winner.black
-                    break
+            if self.__king_capture(target) is not None:
+                if self.is_red_turn:
+                    self.winner = Winner.red
+                else:
+                    self.winner = Winner.black
         return self.winner != None
 
 
@@ -542,19 +716,16 @@ class Chessboard(object):
                 else:
                     self.winner = Winner.black
         if self.winner is None:
-            legal_moves = self.legal_moves()
             if self.is_red_turn:
                 target = black_king.position
             else:
                 target = red_king.position
-            for move in legal_moves:
-                if int(move[2]) == target.x and int(move[3]) == target.y:
-                    if self.is_red_turn:
-                        self.winner = Winner.red
-                    else:
-                        self.winner = Winner.black
-                    final_move = move
-                    break
+            final_move = self.__king_capture(target)
+            if final_move is not None:
+                if self.is_red_turn:
+                    self.winner = Winner.red
+                else:
+                    self.winner = Winner.black
         return (self.winner != None, final_move)
 
 
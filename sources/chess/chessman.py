@@ -16,6 +16,10 @@ def creat_points(list_points, list_vs, list_hs):
 
 
 class Chessman(object):
+    # what a moving list depends on: the squares at these (dx, dy) offsets, or with
+    # WATCH_LINES the whole rank and file of the chessman
+    WATCH_OFFSETS = ()
+    WATCH_LINES = False
 
     def __init__(self, name_cn, name, is_red, chessboard, fen):
         self.__name = name
@@ -81,6 +85,9 @@ class Chessman(object):
     def clear_moving_list(self):
         self.__moving_list = []
 
+    def restore_moving_list(self, points):
+        self.__moving_list = points
+
     def add_to_board(self, col_num, row_num):
         if self.border_check(col_num, row_num):
             self.__position.x = col_num
@@ -196,6 +203,9 @@ class Rook(Chessman):
         self._Chessman__left = 0
         self._Chessman__right = 8
 
+    # blockers anywhere on the rank and file
+    WATCH_LINES = True
+
     def calc_moving_list(self):
         current_v_c = super(Rook, self).position.x
         current_h_c = super(Rook, self).position.y
@@ -228,6 +238,10 @@ class Knight(Chessman):
         self._Chessman__left = 0
         self._Chessman__right = 8
 
+    # legs and targets
+    WATCH_OFFSETS = ((1, 0), (-1, 0), (0, 1), (0, -1),
+                     (1, 2), (1, -2), (-1, 2), (-1, -2), (2, 1), (2, -1), (-2, 1), (-2, -1))
+
     def calc_moving_list(self):
         current_v_c = super(Knight, self).position.x
         current_h_c = super(Knight, self).position.y
@@ -269,6 +283,9 @@ class Cannon(Chessman):
         self._Chessman__left = 0
         self._Chessman__right = 8
 
+    # screens and targets anywhere on the rank and file
+    WATCH_LINES = True
+
     def calc_moving_list(self):
         current_v_c = super(Cannon, self).position.x
         current_h_c = super(Cannon, self).position.y
@@ -327,6 +344,8 @@ class Mandarin(Chessman):
             self._Chessman__left = 3
             self._Chessman__right = 5
 
+    WATCH_OFFSETS = ((1, 1), (1, -1), (-1, 1), (-1, -1))
+
     def calc_moving_list(self):
         current_v_c = super(Mandarin, self).position.x
         current_h_c = super(Mandarin, self).position.y
@@ -356,6 +375,9 @@ class Elephant(Chessman):
             self._Chessman__left = 0
             self._Chessman__right = 8
 
+    # eyes and targets
+    WATCH_OFFSETS = ((1, 1), (1, -1), (-1, 1), (-1, -1), (2, 2), (2, -2), (-2, 2), (-2, -2))
+
     def calc_moving_list(self):
         current_v_c = super(Elephant, self).position.x
         current_h_c = super(Elephant, self).position.y
@@ -396,6 +418,8 @@ class Pawn(Chessman):
             self.__direction = -1
             self.__river = 4
 
+    WATCH_OFFSETS = ((1, 0), (-1, 0), (0, 1), (0, -1))
+
     def calc_moving_list(self):
         current_v_c = super(Pawn, self).position.x
         current_h_c = super(Pawn, self).position.y
@@ -428,6 +452,8 @@ class King(Chessman):
             self._Chessman__left = 3
             self._Chessman__right = 5
 
+    WATCH_OFFSETS = ((1, 0), (-1, 0), (0, 1), (0, -1))
+
     def calc_moving_list(self):
         current_v_c = super(King, self).position.x
         current_h_c = super(King, self).position.y
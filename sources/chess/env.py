@@ -4,7 +4,9 @@ import copy
 
 from sources.chess.chessboard import Chessboard
 from sources.chess.lookup_tables import Chessman_2_idx, Fen_2_Idx, Winner
+from sources.chess import planes
 from sources.chess.env_to_train.chessboard import L_Chessboard
+from sources.chess.fast_chessboard import FastChessboard
 
 from logging import getLogger
 
@@ -12,18 +14,30 @@ logger = getLogger(__name__)
 
 class ChessEnv:
 
-    def __init__(self, config=None):
+    def __init__(self, config=None, backend=None):
+        """
+        backend: 'gui'   chessboard.Chessboard, Chessman objects for the pygame front end
+                 'fast'  FastChessboard, the same surface over the static_env board
+                 'light' L_Chessboard
+        Without one, config.trainsetting.light picks 'light', otherwise 'gui'.
+        """
         self.board = None
         self.winner = None
         self.num_halfmoves = 0
         self.config = config
+        self.backend = backend
 
     def reset(self, init=None):
-        if self.config is None or not self.config.trainsetting.light:
+        backend = self.backend
+        if backend is None:
+            backend = 'light' if self.config is not None and self.config.trainsetting.light else 'gui'
+        if backend == 'light':
+            self.board = L_Chessboard(init)
+        elif backend == 'fast':
+            self.board = FastChessboard()
+        else:
             self.board = Chessboard()
             self.board.init_board()
-        else:
-            self.board = L_Chessboard(init)
         self.winner = None
         self.num_halfmoves = 0
         return self
@@ -75,8 +89,9 @@ class ChessEnv:
         self.board.calc_chessmans_moving_list()
 
     def copy(self):
-        env = copy.deepcopy(self)
-        env.board = copy.deepcopy(self.board)
+        # every backend copies its own board; the env itself only holds counters
+        env = copy.copy(self)
+        env.board = self.board.copy()
         return env
 
     def render(self, gui=False):
@@ -94,21 +109,8 @@ class ChessEnv:
         return planes
 
     def fen_to_planes(self, fen):
-        planes = np.zeros(shape=(14, 10, 9), dtype=np.float32)
-        foo = fen.split(' ')
-        rows = foo[0].split('/')
-
-        for i in range(len(rows)):
-            row = rows[i]
-            j = 0
-            for letter in row:
-                if letter.isalpha():
-                    # 0 ~ 7 : upper, 7 ~ 14: lower
-                    planes[Fen_2_Idx[letter] + int(letter.islower()) * 7][i][j] = 1
-                    j += 1
-                else:
-                    j += int(letter)
-        return np.transpose(planes, (1, 2, 0))
+        # (10, 9, 14) channels last: 0 ~ 6 the side to move (upper case), 7 ~ 13 the opponent, see planes
+        return np.transpose(planes.encode_states([fen])[0], (1, 2, 0))
 
     def save_records(self, filename):
         self.board.save_record(filename)
@@ -16,6 +16,18 @@ class L_Chessboard:
         else:
             self.parse_init(init)
 
+    def copy(self):
+        board = L_Chessboard.__new__(L_Chessboard)
+        board.height = self.height
+        board.width = self.width
+        board.board = [row[:] for row in self.board]
+        board.steps = self.steps
+        board._legal_moves = None
+        board._fen = None
+        board.turn = self.turn
+        board.winner = self.winner
+        return board
+
     def _update(self):
         self._fen = None
         self._legal_moves = None
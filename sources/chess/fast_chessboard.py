@@ -0,0 +1,221 @@
+"""
+Chessboard surface over the static_env mailbox board.
+
+FastChessboard answers the calls ChessEnv and the text front ends make on
+chessboard.Chessboard - move_action_str, legal_moves, is_end, FENboard, records and
+make_single_record - without Chessman objects: no per-piece moving lists to rebuild
+after every move, moves are generated on demand from the integer board. Coordinates are
+absolute "x0y0x1y1" strings as in Chessboard (red home rank = 0), except for
+make_single_record, which like the original takes the mover's frame.
+
+The pygame GUI draws Chessman sprites and keeps using Chessboard.
+"""
+
+import codecs
+
+from sources.chess.chessboard import RECORD_NOTES
+from sources.chess.lookup_tables import Winner
+from sources.chess.mailbox import COORD, RED, KING, ROOK, CANNON, PAWN, square
+from sources.chess.static_env import ChessBoard
+
+# piece type -> character of the records, per colour
+RECORD_NAMES = (('帅', '仕', '相', '马', '车', '炮', '兵'),
+                ('将', '仕', '象', '马', '车', '炮', '卒'))
+# piece types whose vertical moves are written as a distance
+STRAIGHT_MOVERS = (KING, ROOK, CANNON, PAWN)
+
+_FEN_TO_STATE = str.maketrans('KABNkabn', 'SMEKsmek')
+
+
+class FastChessboard(object):
+
+    def __init__(self, name='000'):
+        self.name = name
+        self.board = ChessBoard()
+        self.turns = 1
+        self.record = ''
+        self.winner = None
+        self.__screen = ''
+
+    def init_board(self):
+        self.board = ChessBoard()
+        self.turns = 1
+        self.record = ''
+        self.winner = None
+
+    def copy(self):
+        board = FastChessboard(self.name)
+        board.board = self.board.copy()
+        board.turns = self.turns
+        board.record = self.record
+        board.winner = self.winner
+        return board
+
+    @property
+    def is_red_turn(self):
+        return self.board.side == RED
+
+    @property
+    def screen(self):
+        self.print_to_cl(is_print=False)
+        return self.__screen
+
+    # rules have no per-piece state to refresh
+    def calc_chessmans_moving_list(self):
+        pass
+
+    def clear_chessmans_moving_list(self):
+        pass
+
+    def move(self, x0, y0, x1, y1):
+        mv = square(x0, y0) << 8 | square(x1, y1)
+        if mv not in self.board.generate_moves():
+            return False
+        self.record_move(x0, y0, x1, y1)
+        self.board.make_move(mv)
+        self.turns += self.is_red_turn
+        return True
+
+    def move_action_str(self, action):
+        x0, y0, x1, y1 = self.str_to_move(action)
+        return self.move(x0, y0, x1, y1)
+
+    def legal_moves(self):
+        coord = COORD[RED]
+        return [coord[mv >> 8] + coord[mv & 255] for mv in self.board.generate_moves()]
+
+    def is_end(self):
+        return self.is_end_final_move()[0]
+
+    def is_end_final_move(self):
+        # Chessboard rules: a missing king loses, and the side to move wins if it can take the
+        # other king (facing kings included); there is no mate detection
+        final_move = None
+        v, mv = self.board.game_result(mate_check=False)
+        if v:
+            won = (v > 0) == self.is_red_turn
+            self.winner = Winner.red if won else Winner.black
+            if mv:
+                final_move = COORD[RED][mv >> 8] + COORD[RED][mv & 255]
+        return (self.winner != None, final_move)
+
+    def book_key(self, mirror=False):
+        return self.board.book_key(mirror)
+
+    def is_check(self):
+        return self.board.in_check()
+
+    def piece_at(self, x, y):
+        """(is_red, piece type) on an absolute square, or None."""
+        pc = self.board.squares[square(x, y)]
+        if not pc:
+            return None
+        return not pc & 16, pc & 7
+
+    # ---------------------------------------------------------------- records
+
+    def notation(self, old_x, old_y, x, y):
+        """Chinese record of the absolute move old -> new for the side to move, before it is played."""
+        is_red, kind = self.piece_at(old_x, old_y)
+        record = ''
+        has_two, mark = self._file_mark(is_red, kind, old_x, old_y)
+        if has_two:
+            record += mark
+        record += RECORD_NAMES[0 if is_red else 1][kind]
+        # horizontal move
+        if old_y == y:
+            if not is_red:
+                if not has_two:
+                    record += RECORD_NOTES[old_x + 1][0]
+                record += u'平' + RECORD_NOTES[x + 1][0]
+            else:
+                if not has_two:
+                    record += RECORD_NOTES[9 - old_x][1]
+                record += u'平' + RECORD_NOTES[9 - x][1]
+        # vertical move
+        else:
+            if not has_two:
+                if not is_red:
+                    record += RECORD_NOTES[old_x + 1][0]
+                else:
+                    record += RECORD_NOTES[9 - old_x][1]
+            if (y > old_y and is_red) or (y < old_y and not is_red):
+                record += u'进'
+            else:
+                record += u'退'
+            if kind in STRAIGHT_MOVERS:
+                record += RECORD_NOTES[abs(y - old_y)][is_red]
+            elif not is_red:
+                record += RECORD_NOTES[x + 1][0]
+            else:
+                record += RECORD_NOTES[9 - x][1]
+        return record
+
+    def _file_mark(self, is_red, kind, old_x, old_y):
+        # 前 / 后 when a second piece of the same kind stands on the file, as Chessboard does
+        for j in range(10):
+            other = self.piece_at(old_x, j)
+            if j != old_y and other == (is_red, kind):
+                if (j > old_y and not is_red) or (j < old_y and is_red):
+                    return (True, u'前')
+                else:
+                    return (True, u'后')
+        return (False, u'')
+
+    def record_move(self, old_x, old_y, x, y):
+        if self.is_red_turn:
+            if self.turns != 1:
+                self.record += '\n'
+            self.record += str(self.turns) + '.'
+        else:
+            self.record += '\t'
+        self.record += self.notation(old_x, old_y, x, y)
+
+    def make_single_record(self, old_x, old_y, x, y):
+        if not self.is_red_turn:
+            old_y = 9 - old_y
+            y = 9 - y
+            x = 8 - x
+            old_x = 8 - old_x
+        return self.notation(old_x, old_y, x, y)
+
+    def print_record(self):
+        print(self.record)
+
+    def save_record(self, filename, head = ''):
+        with codecs.open(filename, "a", encoding="utf-8") as f:
+            if head != '':
+                f.write(head)
+            f.write(self.record)
+
+    # ---------------------------------------------------------------- text
+
+    def print_to_cl(self, is_print = True):
+        screen = "\r\n"
+        for y in range(9, -1, -1):
+            for x in range(9):
+                piece = self.piece_at(x, y)
+                if piece is None:
+                    screen += "   .   "
+                else:
+                    is_red, kind = piece
+                    screen += f" {RECORD_NAMES[0 if is_red else 1][kind]} {'红' if is_red else '黑'} "
+            screen += "\r\n" * 3
+        if is_print:
+            print(screen)
+        else:
+            self.__screen = screen
+
+    def str_to_move(self, action: str):
+        return int(action[0]), int(action[1]), int(action[2]), int(action[3])
+
+    def move_to_str(self, x0, y0, x1, y1):
+        return str(x0) + str(y0) + str(x1) + str(y1)
+
+    def FENboard(self):
+        # absolute board in state letters, red upper case, as Chessboard.FENboard
+        return self.board.to_fen().split(' ')[0].translate(_FEN_TO_STATE) + ' r - - 0 1'
+
+    def fliped_FENboard(self):
+        rows = self.FENboard().split(' ')[0].split('/')
+        return '/'.join(row[::-1].swapcase() for row in reversed(rows)) + ' b - - 0 1'
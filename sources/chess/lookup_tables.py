@@ -55,6 +55,9 @@ def flip_move(x):
     new = ''.join([new, str(9 - int(x[3]))])
     return new
 
+def mirror_move(x):
+    return ''.join([str(8 - int(x[0])), x[1], str(8 - int(x[2])), x[3]])
+
 def flip_action_labels(labels):
     return [flip_move(x) for x in labels]
 
@@ -134,8 +137,18 @@ def create_action_labels():
 ActionLabelsRed = create_action_labels()
 ActionLabelsBlack = flip_action_labels(ActionLabelsRed)
 
-Unflipped_index = [ActionLabelsRed.index(x) for x in ActionLabelsBlack]
+# action index of every label; strings are only needed at the UCI / GUI / data-file boundary
+ActionIndex = {move: i for i, move in enumerate(ActionLabelsRed)}
+
+Unflipped_index = [ActionIndex[x] for x in ActionLabelsBlack]
+
+# permutations of the action space: FlipIndex[a] is action a seen from the other side
+# (rotated 180 degrees), MirrorIndex[a] is action a mirrored left-right
+FlipIndex = np.asarray(Unflipped_index, dtype=np.uint16)
+MirrorIndex = np.asarray([ActionIndex[mirror_move(x)] for x in ActionLabelsRed], dtype=np.uint16)
 
 def flip_policy(pol):
-    global Unflipped_index
-    return np.asarray([pol[ind] for ind in Unflipped_index])
+    return np.asarray(pol)[..., FlipIndex]
+
+def mirror_policy(pol):
+    return np.asarray(pol)[..., MirrorIndex]
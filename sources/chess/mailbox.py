@@ -0,0 +1,667 @@
+"""
+Integer mailbox board used by static_env and the search.
+
+Squares use the 16x16 layout of ElephantEye / the .obk opening books: file x (0..8) and
+rank y (0..9, red home rank = 0) live at square (12 - y) * 16 + 3 + x. Every square
+outside the 9x10 board holds OFFBOARD, so move generation never needs a bounds check.
+
+Pieces are a side tag (RED_TAG / BLACK_TAG) or-ed with a type (KING .. PAWN). The board
+always keeps the absolute orientation (red at the bottom); states and move strings seen
+from the side to move are produced through index transforms instead of flipping the board.
+"""
+
+import math
+from typing import List, Optional, Tuple
+
+import numpy as np
+
+from sources.chess.lookup_tables import ActionLabelsRed
+from sources.chess.zobrist import VIEW_KEYS, KEY_MASKS, BOOK_KEYS, book_lock
+from sources.chess.bitboard import Bitboards, lowest_bit, KNIGHT_ATTACKERS
+
+KING, ADVISOR, BISHOP, KNIGHT, ROOK, CANNON, PAWN = range(7)
+RED, BLACK = 0, 1
+
+EMPTY = 0
+RED_TAG = 8
+BLACK_TAG = 16
+OFFBOARD = 32
+SIDE_TAG = (RED_TAG, BLACK_TAG)
+
+# letters of the state strings used everywhere in the project (side to move is upper case)
+STATE_LETTERS = 'SMEKRCP'
+# letters of standard FEN (red is upper case)
+FEN_LETTERS = 'KABNRCP'
+
+PIECE_VALUES = (7, 1, 3, 2, 14, 5, 1)      # KING .. PAWN
+
+# Material signature: a 4-bit count per side and piece type, red in the low 28 bits.
+# The board adds / subtracts PIECE_UNIT[code] as pieces appear and disappear.
+SIGNATURE_SHIFT = 28
+SIGNATURE_HALF = (1 << SIGNATURE_SHIFT) - 1
+PIECE_UNIT = tuple((1 << (4 * (code & 7) + SIGNATURE_SHIFT * (code >> 4 & 1))) if code & 24 in (8, 16) else 0
+                   for code in range(32))
+# knights, rooks, cannons and pawns of either side: without them nobody can give mate
+ATTACKER_MASK = sum(15 << (4 * kind + SIGNATURE_SHIFT * side)
+                    for side in (0, 1) for kind in (3, 4, 5, 6))
+
+
+def signature_of(red: str, black: str) -> int:
+    """Signature of the pieces named by FEN letters, e.g. signature_of('KR', 'KAABB')."""
+    total = 0
+    for side, letters in enumerate((red, black)):
+        for letter in letters:
+            total += 1 << (4 * FEN_LETTERS.index(letter.upper()) + SIGNATURE_SHIFT * side)
+    return total
+
+
+# endings no placement of the pieces can win: a lone cannon has no screen, since the kings
+# never share a rank and may not face each other on a file. A lone attacker against
+# advisors and bishops can win or not depending on the placement, so the search decides.
+_DEAD_DRAWS = (
+    ('KC', 'K'),
+)
+DEAD_DRAWS = frozenset(signature_of(*pair) for pair in _DEAD_DRAWS) | \
+             frozenset(signature_of(*reversed(pair)) for pair in _DEAD_DRAWS)
+
+UP, DOWN, LEFT, RIGHT = -16, 16, -1, 1
+ORTHOGONAL = (UP, DOWN, LEFT, RIGHT)
+DIAGONAL = (-17, -15, 15, 17)
+BISHOP_DELTAS = ((-34, -17), (-30, -15), (30, 15), (34, 17))          # (delta, eye)
+KNIGHT_DELTAS = ((-33, -16), (-31, -16), (-18, -1), (14, -1),
+                 (-14, 1), (18, 1), (31, 16), (33, 16))              # (delta, leg)
+PAWN_FORWARD = (UP, DOWN)
+
+
+def square(x: int, y: int) -> int:
+    return (12 - y) * 16 + 3 + x
+
+
+def flip_square(sq: int) -> int:
+    return 254 - sq
+
+
+def mirror_square(sq: int) -> int:
+    # file x <-> 8 - x on the same rank
+    return (sq & 0xF0) | (14 - (sq & 15))
+
+
+def move_src(mv: int) -> int:
+    return mv >> 8
+
+
+def move_dst(mv: int) -> int:
+    return mv & 255
+
+
+def make_move_int(src: int, dst: int) -> int:
+    return src << 8 | dst
+
+
+def _build_tables():
+    in_board = bytearray(256)
+    in_palace = bytearray(256)
+    home_half = (bytearray(256), bytearray(256))
+    sq_x = [-1] * 256
+    sq_y = [-1] * 256
+    for y in range(10):
+        for x in range(9):
+            sq = square(x, y)
+            in_board[sq] = 1
+            sq_x[sq] = x
+            sq_y[sq] = y
+            if 3 <= x <= 5 and (y <= 2 or y >= 7):
+                in_palace[sq] = 1
+            home_half[RED if y <= 4 else BLACK][sq] = 1
+    return bytes(in_board), bytes(in_palace), (bytes(home_half[0]), bytes(home_half[1])), sq_x, sq_y
+
+
+IN_BOARD, IN_PALACE, HOME_HALF, SQ_X, SQ_Y = _build_tables()
+SQUARES = tuple(sq for sq in range(256) if IN_BOARD[sq])
+# mailbox square <-> bit index of sources.chess.bitboard
+BIT_OF = [SQ_Y[sq] * 9 + SQ_X[sq] if IN_BOARD[sq] else -1 for sq in range(256)]
+SQUARE_OF_BIT = tuple(square(b % 9, b // 9) for b in range(90))
+
+# coordinate strings ("xy") of every square, seen from red and from black
+COORD = (
+    [f'{SQ_X[sq]}{SQ_Y[sq]}' if IN_BOARD[sq] else '' for sq in range(256)],
+    [f'{8 - SQ_X[sq]}{9 - SQ_Y[sq]}' if IN_BOARD[sq] else '' for sq in range(256)],
+)
+SQUARE_OF = (
+    {COORD[RED][sq]: sq for sq in SQUARES},
+    {COORD[BLACK][sq]: sq for sq in SQUARES},
+)
+
+# action index (into ActionLabelsRed, mover's frame) <-> move int, for the side to move
+def _action_tables():
+    to_move, to_action = [], []
+    for side in (RED, BLACK):
+        lookup = SQUARE_OF[side]
+        moves = [lookup[label[0:2]] << 8 | lookup[label[2:4]] for label in ActionLabelsRed]
+        actions = [-1] * 65536
+        for i, mv in enumerate(moves):
+            actions[mv] = i
+        to_move.append(moves)
+        to_action.append(actions)
+    return tuple(to_move), tuple(to_action)
+
+
+ACTION_TO_MOVE, MOVE_TO_ACTION = _action_tables()
+
+
+def _piece_tables():
+    # bytes.translate tables between piece codes and letters, seen from each side
+    to_char = []
+    from_state = bytearray(range(256))
+    for side in (RED, BLACK):
+        table = bytearray(b'.' * 256)
+        for t in range(7):
+            table[SIDE_TAG[side] | t] = ord(STATE_LETTERS[t])
+            table[SIDE_TAG[1 - side] | t] = ord(STATE_LETTERS[t].lower())
+        to_char.append(bytes(table))
+    from_fen = bytearray(range(256))
+    for t in range(7):
+        from_state[ord(STATE_LETTERS[t])] = RED_TAG | t
+        from_state[ord(STATE_LETTERS[t].lower())] = BLACK_TAG | t
+        from_fen[ord(FEN_LETTERS[t])] = RED_TAG | t
+        from_fen[ord(FEN_LETTERS[t].lower())] = BLACK_TAG | t
+    from_state[ord('.')] = EMPTY
+    from_fen[ord('.')] = EMPTY
+    return tuple(to_char), bytes(from_state), bytes(from_fen)
+
+
+PIECE_TO_CHAR, STATE_TO_PIECE, FEN_TO_PIECE = _piece_tables()
+EXPAND_DIGITS = str.maketrans({str(n): '.' * n for n in range(1, 10)} | {'/': None})
+RANK_STARTS = tuple(square(0, y) for y in range(9, -1, -1))
+EMPTY_BOARD = bytes(EMPTY if IN_BOARD[sq] else OFFBOARD for sq in range(256))
+
+
+class MailboxBoard:
+    __slots__ = ('squares', 'side', 'kings', 'pieces', 'bits', 'undo', 'keys', 'signature')
+
+    def __init__(self):
+        self.squares = bytearray(EMPTY_BOARD)
+        self.side = RED
+        self.kings = [0, 0]
+        self.pieces = (set(), set())
+        self.bits = Bitboards()
+        self.undo = []                  # (move, captured piece) for every push()
+        self.keys = [0, 0, 0]           # Zobrist keys seen from red / from black, .obk lock pair
+        self.signature = 0              # material signature, see PIECE_UNIT
+
+    # ---------------------------------------------------------------- construction
+
+    @classmethod
+    def from_state(cls, state: str) -> 'MailboxBoard':
+        """Parse a state string; the side to move (upper case) becomes red."""
+        board = cls()
+        board._load(state.split(' ', 1)[0].translate(EXPAND_DIGITS).encode().translate(STATE_TO_PIECE))
+        return board
+
+    @classmethod
+    def from_fen(cls, fen: str) -> 'MailboxBoard':
+        """Parse a standard FEN ('w'/'r' = red to move, 'b' = black to move)."""
+        parts = fen.split(' ')
+        board = cls()
+        board._load(parts[0].translate(EXPAND_DIGITS).encode().translate(FEN_TO_PIECE))
+        if len(parts) > 1 and parts[1] == 'b':
+            board.side = BLACK
+        return board
+
+    def _load(self, codes: bytes) -> None:
+        if len(codes) != 90:
+            raise ValueError(f"Invalid board description: {len(codes)} squares")
+        squares = self.squares
+        for i, start in enumerate(RANK_STARTS):
+            squares[start:start + 9] = codes[i * 9:i * 9 + 9]
+        self.kings = [0, 0]
+        self.pieces = (set(), set())
+        self.bits = Bitboards()
+        red_view, black_view = VIEW_KEYS
+        keys = [0, 0, 0]
+        signature = 0
+        for i, pc in enumerate(codes):
+            if pc:
+                signature += PIECE_UNIT[pc]
+                sq = RANK_STARTS[i // 9] + i % 9
+                keys[0] ^= red_view[pc * 256 + sq]
+                keys[1] ^= black_view[pc * 256 + sq]
+                keys[2] ^= BOOK_KEYS[pc * 256 + sq]
+                side = 0 if pc & RED_TAG else 1
+                if pc & 7 == KING:
+                    self.kings[side] = sq
+                self.pieces[side].add(sq)
+                self.bits.put(BIT_OF[sq], side, pc & 7)
+        self.keys = keys
+        self.signature = signature
+
+    def copy(self) -> 'MailboxBoard':
+        board = object.__new__(type(self))
+        board.squares = self.squares[:]
+        board.side = self.side
+        board.kings = self.kings[:]
+        board.pieces = (set(self.pieces[0]), set(self.pieces[1]))
+        board.bits = self.bits.copy()
+        board.undo = self.undo[:]
+        board.keys = self.keys[:]
+        board.signature = self.signature
+        return board
+
+    # ---------------------------------------------------------------- serialisation
+
+    def to_state(self) -> str:
+        """State string seen from the side to move (upper case, at the bottom)."""
+        squares = self.squares
+        text = '/'.join(squares[start:start + 9].translate(PIECE_TO_CHAR[self.side]).decode()
+                        for start in RANK_STARTS)
+        if self.side == BLACK:
+            text = text[::-1]
+        for n in range(9, 0, -1):
+            text = text.replace('.' * n, str(n))
+        return text
+
+    def to_fen(self) -> str:
+        """Standard FEN in absolute orientation."""
+        squares = self.squares
+        text = '/'.join(squares[start:start + 9].translate(PIECE_TO_CHAR[RED]).decode()
+                        for start in RANK_STARTS)
+        for n in range(9, 0, -1):
+            text = text.replace('.' * n, str(n))
+        return text.translate(_STATE_TO_FEN) + (' w' if self.side == RED else ' b')
+
+    def flipped(self) -> 'MailboxBoard':
+        """Copy with colours swapped and the board rotated, i.e. the other side's view."""
+        board = MailboxBoard()
+        book = 0
+        for side in (RED, BLACK):
+            for sq in self.pieces[side]:
+                pc = self.squares[sq] ^ (RED_TAG | BLACK_TAG)
+                book ^= BOOK_KEYS[pc * 256 + 254 - sq]
+                board.squares[254 - sq] = pc
+                board.pieces[1 - side].add(254 - sq)
+                board.bits.put(BIT_OF[254 - sq], 1 - side, pc & 7)
+            board.kings[1 - side] = 254 - self.kings[side] if self.kings[side] else 0
+        board.keys = [self.keys[1], self.keys[0], book]
+        board.signature = self.signature >> SIGNATURE_SHIFT | (self.signature & SIGNATURE_HALF) << SIGNATURE_SHIFT
+        board.side = 1 - self.side
+        return board
+
+    # ---------------------------------------------------------------- moves
+
+    def move_to_str(self, mv: int) -> str:
+        coord = COORD[self.side]
+        return coord[mv >> 8] + coord[mv & 255]
+
+    def str_to_move(self, action: str) -> int:
+        lookup = SQUARE_OF[self.side]
+        return lookup[action[0:2]] << 8 | lookup[action[2:4]]
+
+    def move_to_action(self, mv: int) -> int:
+        return MOVE_TO_ACTION[self.side][mv]
+
+    def action_to_move(self, action: int) -> int:
+        return ACTION_TO_MOVE[self.side][action]
+
+    def legal_actions(self) -> np.ndarray:
+        """Legal moves as uint16 indices into ActionLabelsRed (mover's frame)."""
+        lookup = MOVE_TO_ACTION[self.side]
+        return np.array([lookup[mv] for mv in self.legal_moves()], dtype=np.uint16)
+
+    def push_action(self, action: int) -> int:
+        return self.push(ACTION_TO_MOVE[self.side][int(action)])
+
+    def generate_moves(self, side: Optional[int] = None) -> List[int]:
+        """Pseudo-legal moves of `side` (default: side to move), including king captures."""
+        if side is None:
+            side = self.side
+        squares = self.squares
+        own = SIDE_TAG[side] | OFFBOARD
+        moves = []
+        append = moves.append
+        for src in self.pieces[side]:
+            kind = squares[src] & 7
+            base = src << 8
+            if kind == ROOK:
+                for d in ORTHOGONAL:
+                    dst = src + d
+                    pc = squares[dst]
+                    while pc == EMPTY:
+                        append(base | dst)
+                        dst += d
+                        pc = squares[dst]
+                    if not pc & own:
+                        append(base | dst)
+            elif kind == CANNON:
+                for d in ORTHOGONAL:
+                    dst = src + d
+                    pc = squares[dst]
+                    while pc == EMPTY:
+                        append(base | dst)
+                        dst += d
+                        pc = squares[dst]
+                    if pc & OFFBOARD:
+                        continue
+                    dst += d
+                    pc = squares[dst]
+                    while pc == EMPTY:
+                        dst += d
+                        pc = squares[dst]
+                    if not pc & own:
+                        append(base | dst)
+            elif kind == KNIGHT:
+                for d, leg in KNIGHT_DELTAS:
+                    if squares[src + leg] == EMPTY and not squares[src + d] & own:
+                        append(base | (src + d))
+            elif kind == PAWN:
+                dst = src + PAWN_FORWARD[side]
+                if not squares[dst] & own:
+                    append(base | dst)
+                if not HOME_HALF[side][src]:
+                    for dst in (src - 1, src + 1):
+                        if not squares[dst] & own:
+                            append(base | dst)
+            elif kind == BISHOP:
+                home = HOME_HALF[side]
+                for d, eye in BISHOP_DELTAS:
+                    dst = src + d
+                    if home[dst] and squares[src + eye] == EMPTY and not squares[dst] & own:
+                        append(base | dst)
+            elif kind == ADVISOR:
+                for d in DIAGONAL:
+                    dst = src + d
+                    if IN_PALACE[dst] and not squares[dst] & own:
+                        append(base | dst)
+            else:
+                for d in ORTHOGONAL:
+                    dst = src + d
+                    if IN_PALACE[dst] and not squares[dst] & own:
+                        append(base | dst)
+                # facing kings: the king may "capture" the other king along an open file
+                d = PAWN_FORWARD[side]
+                dst = src + d
+                pc = squares[dst]
+                while pc == EMPTY:
+                    dst += d
+                    pc = squares[dst]
+                if pc == SIDE_TAG[1 - side] | KING:
+                    append(base | dst)
+        return moves
+
+    def legal_moves(self) -> List[int]:
+        """Moves of the side to move that do not leave its own king capturable."""
+        # Checkers and pins are found once per position. Out of check, a move can only expose
+        # the king if its piece is pinned (the blocker in front of a rook / facing king, the
+        # screen or the piece in front of the screen of a cannon, or a knight leg next to the
+        # king), or if it lands on an empty square between the king and an enemy cannon and
+        # becomes a screen. Only those moves, king moves and evasions are verified.
+        side = self.side
+        moves = self.generate_moves(side)
+        king = self.kings[side]
+        if not king:
+            return moves
+        if self.bits.attackers(BIT_OF[king], 1 - side, flying=True):
+            return [mv for mv in moves if self._is_safe(mv)]
+        pinned, screens = self._pins_and_screens(king, side)
+        pinned.add(king)
+        is_safe = self._is_safe
+        if screens:
+            return [mv for mv in moves
+                    if (mv >> 8 not in pinned and mv & 255 not in screens) or is_safe(mv)]
+        return [mv for mv in moves if mv >> 8 not in pinned or is_safe(mv)]
+
+    def has_legal_move(self) -> bool:
+        side = self.side
+        moves = self.generate_moves(side)
+        king = self.kings[side]
+        if not king:
+            return bool(moves)
+        if self.bits.attackers(BIT_OF[king], 1 - side, flying=True):
+            return any(self._is_safe(mv) for mv in moves)
+        pinned, screens = self._pins_and_screens(king, side)
+        pinned.add(king)
+        return any((mv >> 8 not in pinned and mv & 255 not in screens) or self._is_safe(mv)
+                   for mv in moves)
+
+    def _is_safe(self, mv: int) -> bool:
+        """Does `mv` keep the mover's king out of capture."""
+        side = self.side
+        other = 1 - side
+        src = mv >> 8
+        if src != self.kings[side]:
+            self.push(mv)
+            safe = not self.bits.is_attacked(BIT_OF[self.kings[side]], other, flying=True)
+            self.pop()
+            return safe
+        # king moves: lift the king (and the captured piece) off the bitboards and ask
+        # whether the destination is attacked
+        bits = self.bits
+        dst = mv & 255
+        kb, db = BIT_OF[src], BIT_OF[dst]
+        captured = self.squares[dst]
+        bits.remove(kb, side, KING)
+        if captured:
+            bits.remove(db, other, captured & 7)
+        safe = not bits.is_attacked(db, other, flying=True)
+        if captured:
+            bits.put(db, other, captured & 7)
+        bits.put(kb, side, KING)
+        return safe
+
+    def _pins_and_screens(self, king: int, side: int) -> Tuple[set, set]:
+        """Squares of pinned `side` pieces, and empty squares where a new piece would screen a cannon."""
+        squares = self.squares
+        enemy = SIDE_TAG[1 - side]
+        own = SIDE_TAG[side]
+        pinned = set()
+        screens = set()
+        for d in ORTHOGONAL:
+            sq = king + d
+            while squares[sq] == EMPTY:
+                sq += d
+            first = sq
+            if squares[first] & OFFBOARD:
+                continue
+            if squares[first] == enemy | CANNON:
+                sq = king + d
+                while sq != first:
+                    screens.add(sq)
+                    sq += d
+            sq = first + d
+            while squares[sq] == EMPTY:
+                sq += d
+            second = sq
+            if squares[second] & OFFBOARD:
+                continue
+            sq = second + d
+            while squares[sq] == EMPTY:
+                sq += d
+            third = squares[sq]
+            if squares[first] & own and (squares[second] in (enemy | ROOK, enemy | KING) or third == enemy | CANNON):
+                pinned.add(first)
+            if squares[second] & own and third == enemy | CANNON:
+                pinned.add(second)
+        knights = self.bits.pieces[(1 - side) * 7 + KNIGHT]
+        if knights:
+            for leg, sources in KNIGHT_ATTACKERS[BIT_OF[king]]:
+                if knights & sources:
+                    pinned.add(SQUARE_OF_BIT[lowest_bit(leg)])
+        return pinned, screens
+
+    def make_move(self, mv: int) -> int:
+        """Play `mv` for the side to move and hand the turn over. Returns the captured piece."""
+        src = mv >> 8
+        dst = mv & 255
+        squares = self.squares
+        piece = squares[src]
+        captured = squares[dst]
+        side = self.side
+        bits = self.bits
+        self._rekey(piece, src, dst, captured)
+        if captured:
+            self.signature -= PIECE_UNIT[captured]
+            self.pieces[1 - side].discard(dst)
+            bits.remove(BIT_OF[dst], 1 - side, captured & 7)
+            if captured & 7 == KING:
+                self.kings[1 - side] = 0
+        squares[dst] = piece
+        squares[src] = EMPTY
+        own = self.pieces[side]
+        own.discard(src)
+        own.add(dst)
+        bits.remove(BIT_OF[src], side, piece & 7)
+        bits.put(BIT_OF[dst], side, piece & 7)
+        if piece & 7 == KING:
+            self.kings[side] = dst
+        self.side = 1 - side
+        return captured
+
+    def push(self, mv: int) -> int:
+        """make_move that can be taken back with pop(). Returns the captured piece."""
+        captured = self.make_move(mv)
+        self.undo.append((mv, captured))
+        return captured
+
+    def pop(self) -> int:
+        """Take back the last push(); returns its move."""
+        mv, captured = self.undo.pop()
+        src = mv >> 8
+        dst = mv & 255
+        squares = self.squares
+        piece = squares[dst]
+        side = 1 - self.side
+        bits = self.bits
+        self._rekey(piece, src, dst, captured)
+        squares[src] = piece
+        squares[dst] = captured
+        own = self.pieces[side]
+        own.discard(dst)
+        own.add(src)
+        bits.remove(BIT_OF[dst], side, piece & 7)
+        bits.put(BIT_OF[src], side, piece & 7)
+        if piece & 7 == KING:
+            self.kings[side] = src
+        if captured:
+            self.signature += PIECE_UNIT[captured]
+            self.pieces[1 - side].add(dst)
+            bits.put(BIT_OF[dst], 1 - side, captured & 7)
+            if captured & 7 == KING:
+                self.kings[1 - side] = dst
+        self.side = side
+        return mv
+
+    def _rekey(self, piece: int, src: int, dst: int, captured: int) -> None:
+        # XOR is its own inverse, so the same update serves make_move and pop
+        red_view, black_view = VIEW_KEYS
+        a, b = piece * 256 + src, piece * 256 + dst
+        keys = self.keys
+        red = keys[0] ^ red_view[a] ^ red_view[b]
+        black = keys[1] ^ black_view[a] ^ black_view[b]
+        book = keys[2] ^ BOOK_KEYS[a] ^ BOOK_KEYS[b]
+        if captured:
+            c = captured * 256 + dst
+            red ^= red_view[c]
+            black ^= black_view[c]
+            book ^= BOOK_KEYS[c]
+        keys[0] = red
+        keys[1] = black
+        keys[2] = book
+
+    def position_key(self, bits: int = 64) -> int:
+        """Zobrist key of the position seen from the side to move (64 or 128 bits)."""
+        return self.keys[self.side] & KEY_MASKS[bits]
+
+    def child_key(self, mv: int, bits: int = 64) -> int:
+        """position_key() after `mv`, from the running keys alone: O(1), the board is not touched."""
+        src = mv >> 8
+        dst = mv & 255
+        piece = self.squares[src]
+        captured = self.squares[dst]
+        view = VIEW_KEYS[1 - self.side]
+        key = self.keys[1 - self.side] ^ view[piece * 256 + src] ^ view[piece * 256 + dst]
+        if captured:
+            key ^= view[captured * 256 + dst]
+        return key & KEY_MASKS[bits]
+
+    def book_key(self, mirror: bool = False) -> int:
+        """Lock of the position in .obk opening books, of its left-right mirror if `mirror`."""
+        return book_lock(self.keys[2], self.side == RED, mirror)
+
+    def mirror_key(self, bits: int = 64) -> int:
+        """position_key() of the left-right mirror image, computed from the piece lists."""
+        view = VIEW_KEYS[self.side]
+        squares = self.squares
+        key = 0
+        for pieces in self.pieces:
+            for sq in pieces:
+                key ^= view[squares[sq] * 256 + mirror_square(sq)]
+        return key & KEY_MASKS[bits]
+
+    def canonical_key(self, bits: int = 64) -> Tuple[int, bool]:
+        """The smaller of position_key() and mirror_key(), and whether it is the mirrored one."""
+        key = self.position_key(bits)
+        mirrored = self.mirror_key(bits)
+        if mirrored < key:
+            return mirrored, True
+        return key, False
+
+    # ---------------------------------------------------------------- rules
+
+    def capture_of(self, target: int, side: int) -> int:
+        """A move of `side` that captures on `target`, or 0 when there is none."""
+        b = BIT_OF[target]
+        attackers = self.bits.attackers(b, side, flying=self.squares[target] & 7 == KING)
+        if not attackers:
+            return 0
+        return SQUARE_OF_BIT[lowest_bit(attackers)] << 8 | target
+
+    def is_attacked(self, target: int, side: int) -> bool:
+        """Can `side` capture on `target` (facing kings count when a king stands there)."""
+        return self.bits.is_attacked(BIT_OF[target], side, flying=self.squares[target] & 7 == KING)
+
+    def game_result(self, mate_check: bool = True) -> Tuple[int, int]:
+        """
+        (value, final_move) for the side to move: 1 = wins by taking the king, -1 = lost
+        (king gone, or no legal move left when `mate_check` is set).
+        """
+        side = self.side
+        if not self.kings[side]:
+            return -1, 0
+        if not self.kings[1 - side]:
+            return 1, 0
+        mv = self.capture_of(self.kings[1 - side], side)
+        if mv:
+            return 1, mv
+        if mate_check and not self.has_legal_move():
+            return -1, 0
+        return 0, 0
+
+    def has_attackers(self) -> bool:
+        """Does either side still have a knight, rook, cannon or pawn."""
+        return bool(self.signature & ATTACKER_MASK)
+
+    def is_dead_draw(self) -> bool:
+        """Material that cannot win for either side: no attackers at all, or a DEAD_DRAWS ending."""
+        signature = self.signature
+        return not signature & ATTACKER_MASK or signature in DEAD_DRAWS
+
+    def in_check(self, side: Optional[int] = None) -> bool:
+        if side is None:
+            side = self.side
+        king = self.kings[side]
+        return bool(king) and self.bits.is_attacked(BIT_OF[king], 1 - side, flying=True)
+
+    def material(self, side: int) -> int:
+        squares = self.squares
+        return sum(PIECE_VALUES[squares[sq] & 7] for sq in self.pieces[side])
+
+    def evaluate(self) -> float:
+        """Material balance for the side to move, squashed into (-1, 1)."""
+        own = self.material(self.side)
+        other = self.material(1 - self.side)
+        total = own + other
+        if total == 0:
+            return 0.0
+        return math.tanh((own - other) / total * 3)
+
+
+_STATE_TO_FEN = str.maketrans('SMEKsmek', 'KABNkabn')
@@ -0,0 +1,89 @@
+"""
+Process-wide cache of legal move lists, keyed by the 64-bit position key.
+
+Entries are read-only uint16 arrays of action indices (ActionLabelsRed, mover's frame),
+which depend only on what the side to move sees, like the key. The table is 2-way set
+associative: a key may live in one of the two ways of set `key & (sets - 1)`; a miss
+replaces the way not used most recently. Each way holds one (key, actions) tuple so a
+slot is read and written in a single step from several search threads.
+
+Bounds: at most `2 * sets` entries, and an insert that would take the stored arrays past
+`max_bytes` is skipped (the caller still gets its array back).
+"""
+
+from typing import Optional
+
+import numpy as np
+
+DEFAULT_SETS = 1 << 15
+DEFAULT_MAX_BYTES = 16 << 20
+
+
+class MoveCache:
+    __slots__ = ('sets', 'mask', 'max_bytes', 'ways', 'recent', 'bytes', 'hits', 'misses', 'evictions')
+
+    def __init__(self, sets: int = DEFAULT_SETS, max_bytes: int = DEFAULT_MAX_BYTES):
+        if sets <= 0 or sets & (sets - 1):
+            raise ValueError(f"Move cache set count must be a power of two: {sets}")
+        self.sets = sets
+        self.mask = sets - 1
+        self.max_bytes = max_bytes
+        self.clear()
+
+    def clear(self) -> None:
+        self.ways = [None] * (2 * self.sets)     # (key, actions) or None; set s uses 2s, 2s + 1
+        self.recent = bytearray(self.sets)       # way used last in each set
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key: int) -> Optional[np.ndarray]:
+        s = key & self.mask
+        for way in (0, 1):
+            entry = self.ways[2 * s + way]
+            if entry is not None and entry[0] == key:
+                self.recent[s] = way
+                self.hits += 1
+                return entry[1]
+        self.misses += 1
+        return None
+
+    def put(self, key: int, actions: np.ndarray) -> np.ndarray:
+        s = key & self.mask
+        way = 1 - self.recent[s]
+        slot = 2 * s + way
+        old = self.ways[slot]
+        size = actions.nbytes
+        if old is not None:
+            if self.bytes - old[1].nbytes + size > self.max_bytes:
+                return actions
+            self.bytes -= old[1].nbytes
+            self.evictions += 1
+        elif self.bytes + size > self.max_bytes:
+            return actions
+        actions.flags.writeable = False
+        self.ways[slot] = (key, actions)
+        self.recent[s] = way
+        self.bytes += size
+        return actions
+
+    def __len__(self) -> int:
+        return sum(entry is not None for entry in self.ways)
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {'entries': len(self), 'capacity': 2 * self.sets, 'bytes': self.bytes,
+                'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions,
+                'hit_rate': self.hits / lookups if lookups else 0.0}
+
+
+MOVE_CACHE = MoveCache()
+
+
+def configure(sets: int = DEFAULT_SETS, max_bytes: int = DEFAULT_MAX_BYTES) -> MoveCache:
+    """Resize the process-wide cache; a cache that already has this geometry is kept."""
+    global MOVE_CACHE
+    if MOVE_CACHE.sets != sets or MOVE_CACHE.max_bytes != max_bytes:
+        MOVE_CACHE = MoveCache(sets, max_bytes)
+    return MOVE_CACHE
@@ -0,0 +1,283 @@
+"""
+Perft and move-generation cross-check for the three rule implementations:
+
+    static_env    static_env.ChessBoard, the mailbox board used by the search
+    L_Chessboard  env_to_train.chessboard.L_Chessboard, the light env
+    Chessboard    chessboard.Chessboard with Chessman pieces, behind the GUI ChessEnv
+
+Positions are standard FEN (red upper case, 'w'/'b' side to move) and moves are compared
+as absolute "x0y0x1y1" strings (rank 0 = red home). Counts are pseudo-legal, which is what
+all three generate: a move may leave the own king attacked, a king may be captured, and a
+side without a king has no moves. static_env additionally reports fully legal counts.
+"""
+
+import time
+from typing import Dict, List
+
+from sources.chess import chessman
+from sources.chess.chessboard import Chessboard
+from sources.chess.env_to_train.chessboard import L_Chessboard
+from sources.chess.env_to_train.common import RED as L_RED, BLACK as L_BLACK
+from sources.chess.mailbox import COORD, RED, BLACK
+from sources.chess.static_env import ChessBoard
+
+START_FEN = 'rnbakabnr/9/1c5c1/p1p1p1p1p/9/9/P1P1P1P1P/1C5C1/9/RNBAKABNR w'
+
+# published legal perft counts, checked against the static_env legal column
+KNOWN_PERFT = {
+    START_FEN: (44, 1920, 79666, 3290240, 133312995),
+}
+
+EXTRA_POSITIONS = [
+    START_FEN,
+    # facing kings, pinned pieces and a discovered check
+    '3k5/4a4/4b4/9/2b1C4/9/9/4R4/4A4/3AK4 b',
+    'r1ba1a3/4kn3/2n1b4/pNp1p1p1p/4c4/6P2/P1P2R2P/1CcC5/9/2BAKAB2 w',
+]
+
+
+def parse_fen(fen: str):
+    """FEN -> (grid, side) with grid[y][x] a FEN letter or '.', y = 0 the red home rank."""
+    parts = fen.split(' ')
+    rows = parts[0].split('/')
+    if len(rows) != 10:
+        raise ValueError(f"Invalid FEN: {fen}")
+    grid = []
+    for row in reversed(rows):
+        cells = []
+        for ch in row:
+            cells.extend('.' * int(ch) if ch.isdigit() else ch)
+        if len(cells) != 9:
+            raise ValueError(f"Invalid FEN: {fen}")
+        grid.append(cells)
+    side = BLACK if len(parts) > 1 and parts[1] == 'b' else RED
+    return grid, side
+
+
+class StaticEnvAdapter:
+    name = 'static_env'
+
+    def __init__(self, legal: bool = False):
+        self.legal = legal
+        if legal:
+            self.name = 'static_env(legal)'
+
+    def load(self, fen):
+        return ChessBoard.from_fen(fen)
+
+    def _moves(self, board):
+        if not board.kings[board.side]:
+            return []
+        return board.legal_moves() if self.legal else board.generate_moves()
+
+    def moves(self, board) -> List[str]:
+        return list(self.move_map(board))
+
+    def move_map(self, board) -> Dict[str, int]:
+        coord = COORD[RED]
+        return {coord[mv >> 8] + coord[mv & 255]: mv for mv in self._moves(board)}
+
+    def divide(self, board, depth) -> Dict[str, int]:
+        coord = COORD[RED]
+        result = {}
+        for mv in self._moves(board):
+            board.push(mv)
+            result[coord[mv >> 8] + coord[mv & 255]] = self.perft(board, depth - 1)
+            board.pop()
+        return result
+
+    def perft(self, board, depth) -> int:
+        if depth == 0:
+            return 1
+        moves = self._moves(board)
+        if depth == 1:
+            return len(moves)
+        nodes = 0
+        for mv in moves:
+            board.push(mv)
+            nodes += self.perft(board, depth - 1)
+            board.pop()
+        return nodes
+
+
+class GridAdapter:
+    """Implementations without unmake: positions are (grid, side) and every node is rebuilt."""
+    name = None
+
+    def load(self, fen):
+        return parse_fen(fen)
+
+    def board_moves(self, grid, side) -> List[str]:
+        raise NotImplementedError
+
+    def moves(self, position) -> List[str]:
+        grid, side = position
+        king = 'K' if side == RED else 'k'
+        if not any(king in row for row in grid):
+            return []
+        return self.board_moves(grid, side)
+
+    def child(self, position, move):
+        grid, side = position
+        x0, y0, x1, y1 = (int(c) for c in move)
+        grid = [row[:] for row in grid]
+        grid[y1][x1] = grid[y0][x0]
+        grid[y0][x0] = '.'
+        return grid, 1 - side
+
+    def divide(self, position, depth) -> Dict[str, int]:
+        return {move: self.perft(self.child(position, move), depth - 1) for move in self.moves(position)}
+
+    def perft(self, position, depth) -> int:
+        if depth == 0:
+            return 1
+        moves = self.moves(position)
+        if depth == 1:
+            return len(moves)
+        return sum(self.perft(self.child(position, move), depth - 1) for move in moves)
+
+
+class LightAdapter(GridAdapter):
+    name = 'L_Chessboard'
+
+    def board_moves(self, grid, side):
+        # L_Chessboard keeps rank 0 first with red in lower case
+        board = L_Chessboard()
+        board.board = [[ch.swapcase() for ch in row] for row in grid]
+        board.turn = L_RED if side == RED else L_BLACK
+        return board.legal_moves()
+
+
+class GuiAdapter(GridAdapter):
+    name = 'Chessboard'
+    PIECES = {'r': chessman.Rook, 'n': chessman.Knight, 'b': chessman.Elephant, 'a': chessman.Mandarin,
+              'k': chessman.King, 'c': chessman.Cannon, 'p': chessman.Pawn}
+    NAMES = {'r': 'rook', 'n': 'knight', 'b': 'elephant', 'a': 'mandarin', 'k': 'king', 'c': 'cannon', 'p': 'pawn'}
+    STATE_LETTERS = str.maketrans('NBAKnbak', 'KEMSkems')
+
+    def board_moves(self, grid, side):
+        board = Chessboard()
+        count = {}
+        for y, row in enumerate(grid):
+            for x, ch in enumerate(row):
+                if ch == '.':
+                    continue
+                kind = ch.lower()
+                colour = 'red' if ch.isupper() else 'black'
+                count[ch] = count.get(ch, 0) + 1
+                name = f'{colour}_{self.NAMES[kind]}' + ('' if kind == 'k' else f'_{count[ch]}')
+                piece = self.PIECES[kind]('', name, ch.isupper(), board, ch.translate(self.STATE_LETTERS))
+                piece.add_to_board(x, y)
+        board._Chessboard__is_red_turn = side == RED
+        board.calc_chessmans_moving_list()
+        return board.legal_moves()
+
+
+def implementations():
+    return [StaticEnvAdapter(legal=True), StaticEnvAdapter(), LightAdapter(), GuiAdapter()]
+
+
+def diff_moves(fen, depth, adapters=None, limit=10) -> List[str]:
+    """
+    Walk the pseudo-legal tree of `fen` to `depth` with static_env and compare the move
+    sets of all implementations at every node, including moves generated twice (which
+    inflate perft without changing the set). Returns readable mismatch reports.
+    """
+    adapters = adapters or [StaticEnvAdapter(), LightAdapter(), GuiAdapter()]
+    reference = adapters[0]
+    positions = [a.load(fen) for a in adapters]
+    report = []
+
+    def walk(positions, path, depth):
+        if len(report) >= limit:
+            return
+        board = positions[0]
+        lookup = reference.move_map(board)
+        sets = [set(lookup)]
+        for a, p in zip(adapters[1:], positions[1:]):
+            listed = a.moves(p)
+            moves = set(listed)
+            sets.append(moves)
+            if moves != sets[0]:
+                report.append(f"{' '.join(path) or '(root)'}: {a.name} "
+                              f"missing {sorted(sets[0] - moves)} extra {sorted(moves - sets[0])}")
+            elif len(listed) != len(moves):
+                twice = sorted(m for m in moves if listed.count(m) > 1)
+                report.append(f"{' '.join(path) or '(root)'}: {a.name} duplicates {twice}")
+        if depth == 0:
+            return
+        for move in sorted(sets[0]):
+            board.push(lookup[move])
+            children = [board] + [a.child(p, move) for a, p in zip(adapters[1:], positions[1:])]
+            walk(children, path + [move], depth - 1)
+            board.pop()
+
+    walk(positions, [], depth)
+    return report
+
+
+def run(positions, depth, adapters=None, max_depth=None, divide=False, diff_depth=2, out=print):
+    """Perft table with nodes and nodes/sec per implementation, plus move-set diffs."""
+    adapters = adapters or implementations()
+    max_depth = max_depth or {}
+    failures = 0
+    for index, fen in enumerate(positions):
+        out(f"\n[{index + 1}/{len(positions)}] {fen}")
+        out(f"{'depth':>5}  " + "  ".join(f"{a.name:>28}" for a in adapters))
+        for d in range(1, depth + 1):
+            cells = []
+            counts = {}
+            for a in adapters:
+                if d > max_depth.get(a.name.split('(')[0], depth):
+                    cells.append(f"{'-':>28}")
+                    continue
+                position = a.load(fen)
+                start = time.time()
+                nodes = a.perft(position, d)
+                elapsed = max(time.time() - start, 1e-9)
+                counts[a.name] = nodes
+                cells.append(f"{nodes:>14,} {nodes / elapsed:>10,.0f}/s ")
+            pseudo = {n for name, n in counts.items() if name != 'static_env(legal)'}
+            flag = ''
+            if len(pseudo) > 1:
+                flag = '  <- pseudo-legal counts differ'
+                failures += 1
+            known = KNOWN_PERFT.get(fen)
+            if known and d <= len(known) and 'static_env(legal)' in counts \
+                    and counts['static_env(legal)'] != known[d - 1]:
+                flag += f'  <- legal count, expected {known[d - 1]:,}'
+                failures += 1
+            out(f"{d:>5}  " + "  ".join(cells) + flag)
+        if divide:
+            out(f"divide at depth {depth}:")
+            tables = {}
+            for a in adapters:
+                if depth <= max_depth.get(a.name.split('(')[0], depth):
+                    tables[a.name] = a.divide(a.load(fen), depth)
+            moves = sorted(set().union(*tables.values()))
+            out("  move  " + "  ".join(f"{name:>18}" for name in tables))
+            for move in moves:
+                values = [tables[name].get(move) for name in tables]
+                pseudo = {v for name, v in zip(tables, values) if name != 'static_env(legal)'}
+                mark = '  *' if len(pseudo) > 1 else ''
+                out(f"  {move}  " + "  ".join(f"{'-' if v is None else v:>18}" for v in values) + mark)
+        if diff_depth is not None:
+            report = diff_moves(fen, diff_depth)
+            failures += len(report)
+            out(f"move sets to depth {diff_depth}: " + ('identical' if not report else f'{len(report)} mismatches'))
+            for line in report:
+                out('  ' + line)
+    return failures
+
+
+def start(config, depth=None, fens=None, divide=False):
+    from sources.config_enhanced import BenchmarkConfig
+    bench = BenchmarkConfig()
+    positions = fens or bench.test_positions + [fen for fen in EXTRA_POSITIONS if fen not in bench.test_positions]
+    depth = depth or bench.perft_depth
+    if not 1 <= depth <= 5:
+        raise ValueError("perft depth must be between 1 and 5")
+    failures = run(positions, depth, max_depth=bench.perft_max_depth, divide=divide,
+                   diff_depth=bench.perft_diff_depth)
+    print(f"\n{failures} discrepancies")
+    return failures
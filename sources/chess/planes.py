@@ -0,0 +1,110 @@
+"""
+Batch encoder for the network input planes.
+
+A position becomes 14 one-hot planes of 10 x 9 (channels first, as the model expects):
+planes 0..6 hold the pieces of the side to move (P C R K E M S, the Fen_2_Idx order),
+planes 7..13 the opponent's, and row 0 is the top rank of the state string. History
+inputs stack HISTORY_LENGTH such blocks, current position first.
+
+The encoders translate a whole batch into a (N, 90) array of channel numbers through
+lookup tables and scatter the ones into a caller-supplied C-contiguous buffer, so a batch
+costs a few NumPy calls and no per-position arrays. The buffer may be float32 or uint8.
+"""
+
+import numpy as np
+
+from sources.chess.lookup_tables import Fen_2_Idx
+from sources.chess.mailbox import EXPAND_DIGITS, RANK_STARTS, SIDE_TAG
+
+CHANNELS = 14
+HISTORY_LENGTH = 3          # positions fed to history models: the current one and two before
+PLANE_SHAPE = (CHANNELS, 10, 9)
+NO_CHANNEL = 255            # empty square
+EMPTY_STATE = '/'.join(['9'] * 10)
+
+
+def _channel_tables():
+    # state letter -> channel
+    letters = np.full(256, NO_CHANNEL, dtype=np.uint8)
+    for letter, idx in Fen_2_Idx.items():
+        letters[ord(letter)] = idx + 7 * letter.islower()
+    # mailbox piece code -> channel, per side to move; piece type t is Fen_2_Idx index 6 - t
+    pieces = np.full((2, 256), NO_CHANNEL, dtype=np.uint8)
+    for side in (0, 1):
+        for tag in SIDE_TAG:
+            for kind in range(7):
+                pieces[side, tag | kind] = 6 - kind + (0 if tag == SIDE_TAG[side] else 7)
+    # mailbox square of every state-string cell, per side to move (black sees the board rotated)
+    cells = np.asarray([start + x for start in RANK_STARTS for x in range(9)], dtype=np.intp)
+    squares = np.stack([cells, 254 - cells])
+    return letters, pieces, squares
+
+
+LETTER_CHANNEL, PIECE_CHANNEL, STATE_SQUARES = _channel_tables()
+
+
+def new_buffer(size: int, history: bool = False, dtype=np.float32) -> np.ndarray:
+    channels = CHANNELS * HISTORY_LENGTH if history else CHANNELS
+    return np.zeros((size, channels, 10, 9), dtype=dtype)
+
+
+def _scatter(channels: np.ndarray, out: np.ndarray) -> np.ndarray:
+    # channels: (n, 90) channel per cell; out[:n] is cleared and filled in place
+    n = channels.shape[0]
+    if not out.flags.c_contiguous:
+        raise ValueError("Plane buffer must be C-contiguous")
+    if len(out) < n:
+        raise ValueError(f"Plane buffer holds {len(out)} positions, batch has {n}")
+    flat = out[:n].reshape(n, int(np.prod(out.shape[1:])) // 90, 90)
+    flat.fill(0)
+    rows, cells = np.nonzero(channels != NO_CHANNEL)
+    flat[rows, channels[rows, cells], cells] = 1
+    return out[:n]
+
+
+def encode_states(states, out: np.ndarray = None) -> np.ndarray:
+    """Encode state strings (or FEN board fields, red to move) into out[:len(states)]."""
+    if out is None:
+        out = new_buffer(len(states))
+    text = ''.join(state.split(' ', 1)[0].translate(EXPAND_DIGITS) for state in states)
+    if len(text) != 90 * len(states):
+        raise ValueError("Invalid state in batch")
+    cells = LETTER_CHANNEL[np.frombuffer(text.encode(), dtype=np.uint8)]
+    return _scatter(cells.reshape(len(states), 90), out)
+
+
+def encode_squares(squares, sides, out: np.ndarray = None) -> np.ndarray:
+    """Encode boards given as 256-byte mailbox arrays and sides to move."""
+    n = len(squares)
+    if out is None:
+        out = new_buffer(n)
+    boards = np.frombuffer(b''.join(squares), dtype=np.uint8).reshape(n, 256)
+    sides = np.asarray(sides, dtype=np.intp)
+    codes = boards[np.arange(n)[:, None], STATE_SQUARES[sides]]
+    return _scatter(PIECE_CHANNEL[sides[:, None], codes], out)
+
+
+def encode_boards(boards, out: np.ndarray = None) -> np.ndarray:
+    """Encode MailboxBoard objects (anything with .squares and .side)."""
+    return encode_squares([board.squares for board in boards], [board.side for board in boards], out)
+
+
+def encode_histories(histories, out: np.ndarray = None) -> np.ndarray:
+    """
+    Encode [state, move, state, ..., state] histories, each ending with the position to
+    evaluate, into (N, 14 * HISTORY_LENGTH, 10, 9). Missing earlier positions are empty.
+    """
+    n = len(histories)
+    if out is None:
+        out = new_buffer(n, history=True)
+    states = []
+    for history in histories:
+        past = history[-1::-2][:HISTORY_LENGTH]
+        states.extend(past)
+        states.extend([EMPTY_STATE] * (HISTORY_LENGTH - len(past)))
+    if not out.flags.c_contiguous:
+        raise ValueError("Plane buffer must be C-contiguous")
+    if len(out) < n:
+        raise ValueError(f"Plane buffer holds {len(out)} positions, batch has {n}")
+    encode_states(states, out[:n].reshape(n * HISTORY_LENGTH, *PLANE_SHAPE))
+    return out[:n]
@@ -0,0 +1,202 @@
+"""
+Repetition adjudication: perpetual check, perpetual chase and idle moves.
+
+Every move is summarised once, when it is played, by the threats it creates:
+
+    check    the opponent king is attacked after the move (facing kings included)
+    chased   bit mask (bitboard numbering) of opponent pieces the moved piece newly
+             attacks and that count as chased: a rook attacked by anything but a rook, or
+             any other non-king, non-pawn piece that cannot recapture. Kings and pawns do
+             not chase.
+
+A cycle is the list of plies between two occurrences of the same position key. Each
+side's plies in it are classified as CHECK (all check), CHASE (all check or chase) or
+IDLE, and the side with the stronger perpetual offence loses:
+
+    value for the side to move = sign(kind of the opponent - own kind)
+
+so perpetual check against perpetual chase loses for the checker and equal offences are
+a draw. Classifying a cycle reads the stored summaries, so it costs the cycle length.
+
+RepetitionTracker keeps the summaries along a game. cycle_value() serves the search,
+whose board already holds the path in its undo list: it replays only the cycle.
+"""
+
+from typing import Dict, List, NamedTuple, Tuple
+
+from sources.chess.bitboard import iter_bits
+from sources.chess.mailbox import (MailboxBoard, COORD, BIT_OF, SQUARE_OF_BIT, KING, PAWN, ROOK)
+
+IDLE, CHASE, CHECK = range(3)
+
+
+class Ply(NamedTuple):
+    move: int           # mailbox move, absolute squares
+    side: int           # side that played it
+    check: bool
+    chased: int         # bit mask of chased pieces
+    evasion: bool       # answers a check or chase of the previous ply
+
+
+def _protected(board: MailboxBoard, src: int, target: int, side: int) -> bool:
+    """Can the owner of `target` recapture after `side` takes it from `src`?"""
+    saved = board.side
+    board.side = side
+    board.push(src << 8 | target)
+    try:
+        return board.bits.is_attacked(BIT_OF[target], 1 - side)
+    finally:
+        board.pop()
+        board.side = saved
+
+
+def _chases(board: MailboxBoard, sq: int, side: int, kind: int, before: int) -> int:
+    # pieces newly attacked by the `kind` piece of `side` on `sq` that count as chased
+    bits = board.bits
+    pieces = bits.pieces
+    base = (1 - side) * 7
+    victims = bits.sides[1 - side] & ~(pieces[base + KING] | pieces[base + PAWN])
+    chased = 0
+    for b in iter_bits(bits.attacks(BIT_OF[sq], side, kind) & victims & ~before):
+        if kind != ROOK and pieces[base + ROOK] >> b & 1 or not _protected(board, sq, SQUARE_OF_BIT[b], side):
+            chased |= 1 << b
+    return chased
+
+
+def move_threats(board: MailboxBoard, mv: int) -> Tuple[bool, int]:
+    """(check, chased) of `mv` for the side to move. The board is left unchanged."""
+    side = board.side
+    src = mv >> 8
+    kind = board.squares[src] & 7
+    chaser = kind != KING and kind != PAWN
+    before = board.bits.attacks(BIT_OF[src], side, kind) if chaser else 0
+    board.push(mv)
+    try:
+        other_king = board.kings[1 - side]
+        if not other_king:
+            return False, 0
+        check = board.bits.is_attacked(BIT_OF[other_king], side, flying=True)
+        return check, _chases(board, mv & 255, side, kind, before) if chaser else 0
+    finally:
+        board.pop()
+
+
+def threatened(board: MailboxBoard, side: int) -> bool:
+    """Is `side` in check or has one of its pieces chased, whoever created the threat."""
+    if board.in_check(side):
+        return True
+    bits = board.bits
+    pieces = bits.pieces
+    enemy = 1 - side
+    base = side * 7
+    chasers = bits.sides[enemy] & ~(pieces[enemy * 7 + KING] | pieces[enemy * 7 + PAWN])
+    enemy_rooks = pieces[enemy * 7 + ROOK]
+    for b in iter_bits(bits.sides[side] & ~(pieces[base + KING] | pieces[base + PAWN])):
+        attackers = bits.attackers(b, enemy) & chasers
+        if not attackers:
+            continue
+        if pieces[base + ROOK] >> b & 1 and attackers & ~enemy_rooks:
+            return True
+        target = SQUARE_OF_BIT[b]
+        if not _protected(board, SQUARE_OF_BIT[next(iter_bits(attackers))], target, enemy):
+            return True
+    return False
+
+
+def classify(plies) -> int:
+    """CHECK, CHASE or IDLE for one side's plies of a cycle."""
+    if not plies:
+        return IDLE
+    if all(p.check for p in plies):
+        return CHECK
+    if all(p.check or p.chased for p in plies):
+        return CHASE
+    return IDLE
+
+
+def judge(plies) -> int:
+    """Value of a cycle for the side that played its first ply: -1 lost, 0 draw, 1 won."""
+    own, other = classify(plies[0::2]), classify(plies[1::2])
+    return (other > own) - (other < own)
+
+
+def cycle_value(board: MailboxBoard, plies: int) -> int:
+    """
+    judge() of the last `plies` moves in the board's undo list, for the side to move now.
+    The moves are taken back and replayed, so the cost is proportional to `plies`.
+    """
+    moves = [board.pop() for _ in range(plies)]
+    records = []
+    for mv in reversed(moves):
+        check, chased = move_threats(board, mv)
+        records.append(Ply(mv, board.side, check, chased, False))
+        board.push(mv)
+    return judge(records)
+
+
+class RepetitionTracker:
+    """
+    Threat summaries of the moves played on `board`, with the plies at which every
+    position key occurred. push()/pop() mirror the board's own.
+    """
+    __slots__ = ('board', 'bits', 'plies', 'keys', 'seen')
+
+    def __init__(self, board: MailboxBoard, bits: int = 64):
+        self.board = board
+        self.bits = bits
+        self.plies: List[Ply] = []
+        key = board.position_key(bits)
+        self.keys = [key]                               # keys[i]: position before plies[i]
+        self.seen: Dict[int, List[int]] = {key: [0]}
+
+    def push(self, mv: int) -> int:
+        board = self.board
+        check, chased = move_threats(board, mv)
+        last = self.plies[-1] if self.plies else None
+        self.plies.append(Ply(mv, board.side, check, chased, bool(last and (last.check or last.chased))))
+        captured = board.push(mv)
+        key = board.position_key(self.bits)
+        self.seen.setdefault(key, []).append(len(self.keys))
+        self.keys.append(key)
+        return captured
+
+    def play(self, action: str) -> int:
+        """push() for a move string in the mover's frame; returns the captured piece."""
+        return self.push(self.board.str_to_move(action))
+
+    def pop(self) -> int:
+        key = self.keys.pop()
+        self.seen[key].pop()
+        self.plies.pop()
+        return self.board.pop()
+
+    def occurrences(self) -> List[int]:
+        """Earlier plies at which the current position stood."""
+        return self.seen[self.keys[-1]][:-1]
+
+    def repeated(self) -> bool:
+        return len(self.seen[self.keys[-1]]) > 1
+
+    def offending_moves(self) -> List[str]:
+        """Moves played from earlier occurrences of this position that checked or chased."""
+        moves = []
+        for i in self.occurrences():
+            ply = self.plies[i]
+            if ply.check or ply.chased:
+                coord = COORD[ply.side]
+                moves.append(coord[ply.move >> 8] + coord[ply.move & 255])
+        return moves
+
+    def idle_repeats(self) -> int:
+        """Earlier occurrences left with a move that neither threatened nor answered a threat."""
+        count = 0
+        for i in self.occurrences():
+            ply = self.plies[i]
+            if not (ply.check or ply.chased or ply.evasion):
+                count += 1
+        return count
+
+    def verdict(self) -> int:
+        """judge() of the cycle since the last occurrence of the current position (0 if none)."""
+        seen = self.occurrences()
+        return judge(self.plies[seen[-1]:]) if seen else 0
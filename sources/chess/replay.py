@@ -0,0 +1,119 @@
+"""
+Bulk replay of recorded games into network inputs.
+
+Self-play files hold games as [state, [action, value], [action, value], ..., state, ...]:
+a state string opens a game and every pair is a move in the mover's frame with the value
+for the mover. Replaying them through senv.step parses and serialises a board per ply;
+here all games advance together instead.
+
+A board is a row of 90 plane channels (planes.LETTER_CHANNEL: 0..6 the side to move,
+7..13 the opponent, NO_CHANNEL empty) in state-string order, so a batch of games is a
+(games, 90) uint8 array that planes._scatter encodes as it is. Games are sorted longest
+first, which keeps the ones still running a prefix of the batch; a ply copies the moving
+channel to the target cell, clears the source and hands the turn over by reversing the
+cells (the 180 degree rotation) and swapping the colour halves through a lookup table.
+"""
+
+from typing import List, NamedTuple, Sequence, Tuple
+
+import numpy as np
+
+from sources.chess import planes
+from sources.chess.lookup_tables import ActionIndex, ActionLabelsRed
+from sources.chess.mailbox import EXPAND_DIGITS
+
+# channel of the same piece after the turn changes hands
+SWAP_CHANNEL = np.arange(256, dtype=np.uint8)
+SWAP_CHANNEL[0:7] += 7
+SWAP_CHANNEL[7:14] -= 7
+
+
+class Game(NamedTuple):
+    state: str
+    actions: List[str]
+    values: List[float]
+
+
+def split_games(data) -> List[Game]:
+    """Games of a play data file; a file may hold several, each opened by its state."""
+    games = []
+    for item in data:
+        if isinstance(item, str):
+            games.append(Game(item, [], []))
+        elif games:
+            games[-1].actions.append(item[0])
+            games[-1].values.append(item[1])
+        else:
+            raise ValueError(f"Play data does not start with a state: {item}")
+    return games
+
+
+def _cells(actions: Sequence[str]) -> Tuple[np.ndarray, np.ndarray]:
+    # "x0y0x1y1" in the mover's frame -> source and target cells in state-string order
+    digits = np.frombuffer(''.join(actions).encode(), dtype=np.uint8).reshape(-1, 4).astype(np.intp) - 48
+    return (9 - digits[:, 1]) * 9 + digits[:, 0], (9 - digits[:, 3]) * 9 + digits[:, 2]
+
+
+def replay(games: Sequence[Game]) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Boards before every move of every game: (total plies, 90) channels, game after game in
+    the given order, each seen from its side to move. Also returns the offsets of the games
+    (len(games) + 1 entries).
+    """
+    n = len(games)
+    lengths = np.asarray([len(g.actions) for g in games], dtype=np.intp)
+    offsets = np.zeros(n + 1, dtype=np.intp)
+    np.cumsum(lengths, out=offsets[1:])
+    text = ''.join(g.state.split(' ', 1)[0].translate(EXPAND_DIGITS) for g in games)
+    if len(text) != 90 * n:
+        raise ValueError("Invalid state in play data")
+    boards = planes.LETTER_CHANNEL[np.frombuffer(text.encode(), dtype=np.uint8)].reshape(n, 90)
+    out = np.empty((offsets[-1], 90), dtype=np.uint8)
+    if not n or not offsets[-1]:
+        return out, offsets
+    src, dst = _cells([a for g in games for a in g.actions])
+
+    order = np.argsort(-lengths, kind='stable')
+    boards = boards[order]
+    starts = offsets[:-1][order]
+    running = np.searchsorted(-lengths[order], -np.arange(lengths.max()), side='left')
+    for ply, k in enumerate(running):
+        live = boards[:k]
+        rows = starts[:k] + ply
+        out[rows] = live
+        index = np.arange(k)
+        live[index, dst[rows]] = live[index, src[rows]]
+        live[index, src[rows]] = planes.NO_CHANNEL
+        boards[:k] = SWAP_CHANNEL[live[:, ::-1]]
+    return out, offsets
+
+
+def encode_games(games: Sequence[Game], history: bool = False, out: np.ndarray = None) -> np.ndarray:
+    """Input planes of every ply, as planes.encode_states / encode_histories would give them."""
+    boards, offsets = replay(games)
+    total = len(boards)
+    if out is None:
+        out = planes.new_buffer(total, history=history)
+    if not history:
+        return planes._scatter(boards, out)
+    # ply i of a game sees its boards i, i - 1, ... ; boards before the game are empty
+    depth = planes.HISTORY_LENGTH
+    rows = np.arange(total)
+    first = np.repeat(offsets[:-1], np.diff(offsets))
+    stacked = np.full((total, depth, 90), planes.NO_CHANNEL, dtype=np.uint8)
+    for back in range(depth):
+        seen = rows - back >= first
+        stacked[seen, back] = boards[rows[seen] - back]
+    if len(out) < total:
+        raise ValueError(f"Plane buffer holds {len(out)} positions, batch has {total}")
+    planes._scatter(stacked.reshape(total * depth, 90), out[:total].reshape(total * depth, *planes.PLANE_SHAPE))
+    return out[:total]
+
+
+def training_data(games: Sequence[Game], history: bool = False):
+    """(planes, one-hot policies, values) for every ply of `games`, as float32 arrays."""
+    actions = [a for g in games for a in g.actions]
+    policies = np.zeros((len(actions), len(ActionLabelsRed)), dtype=np.float32)
+    policies[np.arange(len(actions)), [ActionIndex[a] for a in actions]] = 1
+    values = np.asarray([v for g in games for v in g.values], dtype=np.float32)
+    return encode_games(games, history), policies, values
@@ -1,597 +1,252 @@
+"""
+String API over the mailbox rules for the search, the workers and the trainer.
+
+States are board strings seen from the side to move (upper case, at the bottom) and
+actions are "x0y0x1y1" strings in the same frame; every function parses its state into
+a ChessBoard once. Callers that make several queries on one position keep a ChessBoard
+(or take a whole Expansion) instead of calling several functions.
+
+Cost per call on a middlegame position (CPython 3.11, one core), mostly the parse:
+
+    ChessBoard(state)                      ~40 us
+    step, new_step                         ~60 us
+    done, expand, get_legal_moves/actions  ~50-80 us   (legal moves come from movecache)
+    position_key, canonical_key            ~55-70 us
+    has_attack_chessman, is_dead_draw      ~45-75 us
+    will_check_or_catch                    ~95 us
+    be_catched                             ~150 us
+    state_to_fen                           ~115 us     (black to move adds a flipped copy)
+    state_to_planes                        ~35 us      (a batch: planes.encode_states)
+    state_history_to_planes                ~50 us
+    to_uci_move, parse_ucci_move           < 1 us
+    mirror_state                           ~2 us
+"""
 from __future__ import annotations
 import numpy as np
-from abc import ABC, abstractmethod
-from dataclasses import dataclass, field
-from enum import Enum, auto
-from functools import lru_cache
-from typing import List, Tuple, Optional, Set, Dict, Union
+from typing import List, NamedTuple, Tuple, Optional
 from logging import getLogger
 
+from sources.chess.lookup_tables import ActionLabelsRed, MirrorIndex, mirror_policy
+from sources.chess import movecache, planes, repetition
+from sources.chess.mailbox import MailboxBoard, EXPAND_DIGITS, STATE_TO_PIECE
+
 logger = getLogger(__name__)
 
-class PieceType(Enum):
-    ROOK = "R"
-    KNIGHT = "N" 
-    BISHOP = "B"
-    ADVISOR = "A"
-    KING = "K"
-    CANNON = "C"
-    PAWN = "P"
-
-class Color(Enum):
-    RED = auto()
-    BLACK = auto()
-
-class GameResult(Enum):
-    RED_WIN = 1
-    BLACK_WIN = -1
-    ONGOING = 0
-
-@dataclass(frozen=True)
-class Position:
-    x: int
-    y: int
-    
-    def __post_init__(self):
-        if not (0 <= self.x < 9 and 0 <= self.y < 10):
-            raise ValueError(f"Invalid position: ({self.x}, {self.y})")
-    
-    def flip(self) -> Position:
-        return Position(8 - self.x, 9 - self.y)
-    
-    def in_palace(self, color: Color) -> bool:
-        if not (3 <= self.x <= 5):
-            return False
-        if color == Color.RED:
-            return self.y <= 2
-        else:
-            return self.y >= 7
-
-@dataclass(frozen=True)
-class Move:
-    from_pos: Position
-    to_pos: Position
-    
-    def __str__(self) -> str:
-        return f"{self.from_pos.x}{self.from_pos.y}{self.to_pos.x}{self.to_pos.y}"
-    
-    def flip(self) -> Move:
-        return Move(self.from_pos.flip(), self.to_pos.flip())
-
-@dataclass(frozen=True)
-class Piece:
-    type: PieceType
-    color: Color
-    
-    @property
-    def value(self) -> int:
-        values = {
-            PieceType.ROOK: 14,
-            PieceType.KING: 7,
-            PieceType.BISHOP: 3,
-            PieceType.KNIGHT: 2,
-            PieceType.ADVISOR: 1,
-            PieceType.CANNON: 5,
-            PieceType.PAWN: 1
-        }
-        return values[self.type]
-    
-    @property
-    def symbol(self) -> str:
-        symbol = self.type.value
-        return symbol if self.color == Color.RED else symbol.lower()
-    
-    @classmethod
-    def from_symbol(cls, symbol: str) -> Optional[Piece]:
-        if not symbol.isalpha():
-            return None
-        
-        type_map = {
-            'R': PieceType.ROOK, 'r': PieceType.ROOK,
-            'N': PieceType.KNIGHT, 'n': PieceType.KNIGHT,
-            'B': PieceType.BISHOP, 'b': PieceType.BISHOP,
-            'A': PieceType.ADVISOR, 'a': PieceType.ADVISOR,
-            'K': PieceType.KING, 'k': PieceType.KING,
-            'C': PieceType.CANNON, 'c': PieceType.CANNON,
-            'P': PieceType.PAWN, 'p': PieceType.PAWN
-        }
-        
-        piece_type = type_map.get(symbol)
-        if not piece_type:
-            return None
-            
-        color = Color.RED if symbol.isupper() else Color.BLACK
-        return cls(piece_type, color)
-
-class MoveStrategy(ABC):
-    @abstractmethod
-    def get_moves(self, board: ChessBoard, pos: Position) -> List[Move]:
-        pass
-
-class PawnMoveStrategy(MoveStrategy):
-    def get_moves(self, board: ChessBoard, pos: Position) -> List[Move]:
-        moves = []
-        piece = board.get_piece(pos)
-        if not piece or piece.type != PieceType.PAWN:
-            return moves
-            
-        directions = [(0, 1), (0, -1), (1, 0), (-1, 0)]
-        
-        for dx, dy in directions:
-            new_x = pos.x + dx
-            new_y = pos.y + dy
-            
-            if not (0 <= new_x < 9 and 0 <= new_y < 10):
-                continue
-                
-            if piece.color == Color.BLACK and pos.y >= 5 and dx != 0:
-                continue
-                
-            new_pos = Position(new_x, new_y)
-            if board.can_move_to(new_pos, piece.color):
-                moves.append(Move(pos, new_pos))
-                
-        return moves
-
-class RookMoveStrategy(MoveStrategy):
-    def get_moves(self, board: ChessBoard, pos: Position) -> List[Move]:
-        moves = []
-        directions = [(0, 1), (0, -1), (1, 0), (-1, 0)]
-        
-        for dx, dy in directions:
-            for i in range(1, 10):
-                new_x = pos.x + dx * i
-                new_y = pos.y + dy * i
-                
-                if not (0 <= new_x < 9 and 0 <= new_y < 10):
-                    break
-                
-                new_pos = Position(new_x, new_y)
-                target_piece = board.get_piece(new_pos)
-                if target_piece:
-                    if target_piece.color != board.get_piece(pos).color:
-                        moves.append(Move(pos, new_pos))
-            break
-        else:
-                    moves.append(Move(pos, new_pos))
-                    
-        return moves
-
-class CannonMoveStrategy(MoveStrategy):
-    def get_moves(self, board: ChessBoard, pos: Position) -> List[Move]:
-        moves = []
-        directions = [(0, 1), (0, -1), (1, 0), (-1, 0)]
-        
-        for dx, dy in directions:
-            platform_found = False
-            for i in range(1, 10):
-                new_x = pos.x + dx * i
-                new_y = pos.y + dy * i
-                
-                if not (0 <= new_x < 9 and 0 <= new_y < 10):
-                    break
-                
-                new_pos = Position(new_x, new_y)
-                target_piece = board.get_piece(new_pos)
-                if not platform_found:
-                    if target_piece:
-                        platform_found = True
-                    else:
-                        moves.append(Move(pos, new_pos))
-                else:
-                    if target_piece:
-                        if target_piece.color != board.get_piece(pos).color:
-                            moves.append(Move(pos, new_pos))
-                        break
-                        
-        return moves
-
-class KnightMoveStrategy(MoveStrategy):
-    def get_moves(self, board: ChessBoard, pos: Position) -> List[Move]:
-        moves = []
-        knight_moves = [
-            (2, 1, 1, 0), (2, -1, 1, 0), (-2, 1, -1, 0), (-2, -1, -1, 0),
-            (1, 2, 0, 1), (-1, 2, 0, 1), (1, -2, 0, -1), (-1, -2, 0, -1)
-        ]
-        
-        for dx, dy, block_x, block_y in knight_moves:
-            block_pos_x = pos.x + block_x
-            block_pos_y = pos.y + block_y
-            
-            if not (0 <= block_pos_x < 9 and 0 <= block_pos_y < 10):
-                continue
-                
-            block_pos = Position(block_pos_x, block_pos_y)
-            if board.get_piece(block_pos):
-                continue
-                
-            new_x = pos.x + dx
-            new_y = pos.y + dy
-            
-            if not (0 <= new_x < 9 and 0 <= new_y < 10):
-                continue
-                
-            new_pos = Position(new_x, new_y)
-            if board.can_move_to(new_pos, board.get_piece(pos).color):
-                moves.append(Move(pos, new_pos))
-                
-        return moves
-
-class BishopMoveStrategy(MoveStrategy):
-    def get_moves(self, board: ChessBoard, pos: Position) -> List[Move]:
-        moves = []
-        piece = board.get_piece(pos)
-        bishop_moves = [(2, 2, 1, 1), (2, -2, 1, -1), (-2, 2, -1, 1), (-2, -2, -1, -1)]
-        
-        for dx, dy, block_x, block_y in bishop_moves:
-            block_pos_x = pos.x + block_x
-            block_pos_y = pos.y + block_y
-            
-            if not (0 <= block_pos_x < 9 and 0 <= block_pos_y < 10):
-                continue
-                
-            block_pos = Position(block_pos_x, block_pos_y)
-            if board.get_piece(block_pos):
-                continue
-                
-            new_x = pos.x + dx
-            new_y = pos.y + dy
-            
-            if not (0 <= new_x < 9 and 0 <= new_y < 10):
-                continue
-                
-            new_pos = Position(new_x, new_y)
-            
-            if piece.color == Color.BLACK and new_y <= 4:
-                continue
-                
-            if board.can_move_to(new_pos, piece.color):
-                moves.append(Move(pos, new_pos))
-                
-        return moves
-
-class KingMoveStrategy(MoveStrategy):
-    def get_moves(self, board: ChessBoard, pos: Position) -> List[Move]:
-        moves = []
-        piece = board.get_piece(pos)
-        directions = [(0, 1), (0, -1), (1, 0), (-1, 0)]
-        
-        for dx, dy in directions:
-            new_x = pos.x + dx
-            new_y = pos.y + dy
-            
-            if not (0 <= new_x < 9 and 0 <= new_y < 10):
-                continue
-                
-            new_pos = Position(new_x, new_y)
-            if new_pos.in_palace(piece.color) and board.can_move_to(new_pos, piece.color):
-                moves.append(Move(pos, new_pos))
-        
-        if piece.color == Color.BLACK:
-            for y in range(pos.y + 1, 10):
-                target_pos = Position(pos.x, y)
-                target_piece = board.get_piece(target_pos)
-                if target_piece:
-                    if target_piece.type == PieceType.KING and target_piece.color == Color.RED:
-                        moves.append(Move(pos, target_pos))
-                    break
-        
-        return moves
-
-class AdvisorMoveStrategy(MoveStrategy):
-    def get_moves(self, board: ChessBoard, pos: Position) -> List[Move]:
-        moves = []
-        piece = board.get_piece(pos)
-        directions = [(1, 1), (1, -1), (-1, 1), (-1, -1)]
-        
-        for dx, dy in directions:
-            new_x = pos.x + dx
-            new_y = pos.y + dy
-            
-            if not (0 <= new_x < 9 and 0 <= new_y < 10):
-                continue
-                
-            new_pos = Position(new_x, new_y)
-            if (new_pos.in_palace(piece.color) and
-                board.can_move_to(new_pos, piece.color)):
-                moves.append(Move(pos, new_pos))
-                
-        return moves
-
-class ChessBoard:
-    INIT_STATE = 'rkemsmekr/9/1c5c1/p1p1p1p1p/9/9/P1P1P1P1P/1C5C1/9/RKEMSMEKR'
-    
+INIT_STATE = 'rkemsmekr/9/1c5c1/p1p1p1p1p/9/9/P1P1P1P1P/1C5C1/9/RKEMSMEKR'
+
+
+class Expansion(NamedTuple):
+    """What the search needs to expand a position, gathered in one pass over the board."""
+    terminal: bool
+    value: int                  # for the side to move when terminal: 1 king capture, -1 lost, 0 dead draw
+    final_move: Optional[str]   # the king capture when value == 1
+    legal_actions: np.ndarray   # uint16 indices into ActionLabelsRed, empty when terminal
+    key: int                    # position key
+    leaf: tuple                 # (squares, side) for planes.encode_squares
+
+
+NO_ACTIONS = np.zeros(0, dtype=np.uint16)
+
+
+class ChessBoard(MailboxBoard):
+    """
+    Board object behind the string API. The side to move is always red internally, so
+    move strings are the same 4-digit strings used by the state based functions below.
+    The search can keep one instance across calls instead of re-parsing the state.
+    """
+    __slots__ = ()
+    INIT_STATE = INIT_STATE
+
     def __init__(self, state: str = None):
-        self._board: np.ndarray = np.full((10, 9), None, dtype=object)
-        self._state_cache: Dict[str, any] = {}
-        self._move_strategies: Dict[PieceType, MoveStrategy] = {
-            PieceType.PAWN: PawnMoveStrategy(),
-            PieceType.ROOK: RookMoveStrategy(),
-            PieceType.CANNON: CannonMoveStrategy(),
-            PieceType.KNIGHT: KnightMoveStrategy(),
-            PieceType.BISHOP: BishopMoveStrategy(),
-            PieceType.KING: KingMoveStrategy(),
-            PieceType.ADVISOR: AdvisorMoveStrategy()
-        }
-        
-        if state:
-            self._load_from_state(state)
-        else:
-            self._load_from_state(self.INIT_STATE)
-    
-    def _load_from_state(self, state: str) -> None:
-        self._board.fill(None)
-        rows = state.split('/')
-        
-        for i, row in enumerate(rows):
-            y = 9 - i
-            x = 0
-            for char in row:
-                if char.isdigit():
-                    x += int(char)
-                elif char.isalpha():
-                    piece = Piece.from_symbol(self._convert_symbol(char))
-                    if piece:
-                        self._board[y][x] = piece
-                    x += 1
-    
-    @staticmethod
-    def _convert_symbol(symbol: str) -> str:
-        convert_map = {
-            'k': 'K', 'a': 'A', 'b': 'B', 'n': 'N', 'r': 'R', 'c': 'C', 'p': 'P',
-            'K': 'k', 'A': 'a', 'B': 'b', 'N': 'n', 'R': 'r', 'C': 'c', 'P': 'p'
-        }
-        return convert_map.get(symbol, symbol)
-    
-    def get_piece(self, pos: Position) -> Optional[Piece]:
-        if not self.is_valid_position(pos):
-            return None
-        return self._board[pos.y][pos.x]
-    
-    def set_piece(self, pos: Position, piece: Optional[Piece]) -> None:
-        if self.is_valid_position(pos):
-            self._board[pos.y][pos.x] = piece
-    
-    @staticmethod
-    def is_valid_position(pos: Position) -> bool:
-        return 0 <= pos.x < 9 and 0 <= pos.y < 10
-    
-    def can_move_to(self, pos: Position, color: Color) -> bool:
-        if not self.is_valid_position(pos):
+        super().__init__()
+        state = state or INIT_STATE
+        self._load(state.split(' ', 1)[0].translate(EXPAND_DIGITS).encode().translate(STATE_TO_PIECE))
+
+    def get_legal_moves(self, pseudo_legal: bool = False) -> List[str]:
+        """Legal moves as action strings; `pseudo_legal` also keeps moves that leave the king en prise."""
+        if not pseudo_legal:
+            return [ActionLabelsRed[a] for a in self.legal_actions().tolist()]
+        move_to_str = self.move_to_str
+        return [move_to_str(mv) for mv in self.generate_moves()]
+
+    def legal_actions(self) -> np.ndarray:
+        """MailboxBoard.legal_actions through the process-wide move cache (read-only array)."""
+        key = self.position_key()
+        cache = movecache.MOVE_CACHE
+        actions = cache.get(key)
+        if actions is None:
+            actions = cache.put(key, super().legal_actions())
+        return actions
+
+    def has_legal_move(self) -> bool:
+        actions = movecache.MOVE_CACHE.get(self.position_key())
+        if actions is not None:
+            return len(actions) > 0
+        return super().has_legal_move()
+
+    def step(self, action: str) -> int:
+        """Play `action` in place; returns the captured piece code (0 if none)."""
+        return self.make_move(self.str_to_move(action))
+
+    def get_game_result(self, mate_check: bool = True) -> Tuple[int, Optional[str]]:
+        v, mv = self.game_result(mate_check)
+        return v, self.move_to_str(mv) if mv else None
+
+    def expand(self, bits: int = 64, draw_check: bool = True) -> Expansion:
+        """
+        Terminal status, legal actions, key and encoder input of this position. The king
+        capture test and the dead-draw lookup come first, so terminal positions never
+        generate moves; `draw_check` is off at a search root, which is searched anyway.
+        """
+        key = self.position_key(bits)
+        leaf = (bytes(self.squares), self.side)
+        v, mv = self.game_result(mate_check=False)
+        if v:
+            return Expansion(True, v, self.move_to_str(mv) if mv else None, NO_ACTIONS, key, leaf)
+        if draw_check and self.is_dead_draw():
+            return Expansion(True, 0, None, NO_ACTIONS, key, leaf)
+        actions = self.legal_actions()
+        if not len(actions):
+            # mated or stalemated
+            return Expansion(True, -1, None, actions, key, leaf)
+        return Expansion(False, 0, None, actions, key, leaf)
+
+    def gives_check_or_catch(self, mv: int) -> bool:
+        """Does `mv` (for the side to move) check the opponent or start chasing a piece."""
+        check, chased = repetition.move_threats(self, mv)
+        return check or bool(chased)
+
+    def be_catched(self, mv: int) -> bool:
+        """Is the side to move checked or chased, and does `mv` answer it."""
+        side = self.side
+        if not repetition.threatened(self, side):
             return False
-    
-        piece = self.get_piece(pos)
-        return piece is None or piece.color != color
-    
-    @lru_cache(maxsize=1000)
-    def get_legal_moves(self, color: Color) -> List[Move]:
-        moves = []
-        for y in range(10):
-            for x in range(9):
-                pos = Position(x, y)
-                piece = self.get_piece(pos)
-                if piece and piece.color == color:
-                    strategy = self._move_strategies.get(piece.type)
-                    if strategy:
-                        moves.extend(strategy.get_moves(self, pos))
-        return moves
-    
-    def make_move(self, move: Move) -> ChessBoard:
-        new_board = ChessBoard()
-        new_board._board = self._board.copy()
-        
-        piece = new_board.get_piece(move.from_pos)
-        new_board.set_piece(move.to_pos, piece)
-        new_board.set_piece(move.from_pos, None)
-        
-        return new_board.flip()
-    
-    def flip(self) -> ChessBoard:
-        new_board = ChessBoard()
-        for y in range(10):
-            for x in range(9):
-                piece = self._board[y][x]
-                if piece:
-                    flipped_piece = Piece(
-                        piece.type,
-                        Color.RED if piece.color == Color.BLACK else Color.BLACK
-                    )
-                    new_board._board[9-y][8-x] = flipped_piece
-        return new_board
-    
-    def to_state(self) -> str:
-        rows = []
-        for i in range(10):
-            y = 9 - i
-            row_parts = []
-            empty_count = 0
-            
-            for x in range(9):
-                piece = self._board[y][x]
-                if piece:
-                    if empty_count > 0:
-                        row_parts.append(str(empty_count))
-                        empty_count = 0
-                    row_parts.append(piece.symbol)
-                else:
-                    empty_count += 1
-            
-            if empty_count > 0:
-                row_parts.append(str(empty_count))
-            
-            rows.append(''.join(row_parts))
-        
-        return '/'.join(rows)
-    
-    def evaluate(self) -> float:
-        red_value = black_value = 0
-        
-        for y in range(10):
-            for x in range(9):
-                piece = self._board[y][x]
-                if piece:
-                    if piece.color == Color.RED:
-                        red_value += piece.value
-                    else:
-                        black_value += piece.value
-        
-        total = red_value + black_value
-        if total == 0:
-            return 0.0
-        
-        return np.tanh(((red_value - black_value) / total) * 3)
-    
-    def get_game_result(self) -> Tuple[GameResult, Optional[Move]]:
-        red_king = black_king = None
-        
-        for y in range(10):
-            for x in range(9):
-                piece = self._board[y][x]
-                if piece and piece.type == PieceType.KING:
-                    if piece.color == Color.RED:
-                        red_king = Position(x, y)
-                    else:
-                        black_king = Position(x, y)
-        
-        if not red_king:
-            return GameResult.BLACK_WIN, None
-        if not black_king:
-            return GameResult.RED_WIN, None
-        
-        if red_king.x == black_king.x:
-            blocked = False
-            for y in range(red_king.y + 1, black_king.y):
-                if self._board[y][red_king.x] is not None:
-                    blocked = True
-                    break
-            if not blocked:
-                return GameResult.RED_WIN, None
-        
-        black_moves = self.get_legal_moves(Color.BLACK)
-        for move in black_moves:
-            if move.to_pos == red_king:
-                return GameResult.RED_WIN, move
-        
-        return GameResult.ONGOING, None
-
-@dataclass
-class GameState:
-    board: ChessBoard
-    current_player: Color = Color.BLACK
-    move_history: List[Move] = field(default_factory=list)
-    state_history: List[str] = field(default_factory=list)
-    
-    def make_move(self, move: Move) -> GameState:
-        new_board = self.board.make_move(move)
-        new_history = self.move_history + [move]
-        new_state_history = self.state_history + [self.board.to_state()]
-        new_player = Color.RED if self.current_player == Color.BLACK else Color.BLACK
-        
-        return GameState(new_board, new_player, new_history, new_state_history)
-    
-    def get_legal_moves(self) -> List[Move]:
-        return self.board.get_legal_moves(self.current_player)
-    
-    def is_game_over(self) -> bool:
-        result, _ = self.board.get_game_result()
-        return result != GameResult.ONGOING
-    
-    def get_winner(self) -> Optional[Color]:
-        result, _ = self.board.get_game_result()
-        if result == GameResult.RED_WIN:
-            return Color.RED
-        elif result == GameResult.BLACK_WIN:
-            return Color.BLACK
-        return None
+        self.push(mv)
+        try:
+            return not repetition.threatened(self, side)
+        finally:
+            self.pop()
 
 def done(state: str, turns: int = -1, need_check: bool = False):
     board = ChessBoard(state)
-    result, final_move = board.get_game_result()
-    
-    if result != GameResult.ONGOING:
-        v = 1 if result == GameResult.RED_WIN else -1
-        move_str = str(final_move) if final_move else None
-        return (True, v, move_str) if not need_check else (True, v, move_str, False)
-    
+    v, final_move = board.get_game_result()
+    if v:
+        return (True, v, final_move) if not need_check else (True, v, final_move, False)
     if need_check:
-        return (False, 0, None, False)
-    
+        return (False, 0, None, board.in_check())
     return (False, 0, None)
 
+def expand(state: str, out: np.ndarray = None, slot: int = 0, bits: int = 64,
+           draw_check: bool = True) -> Expansion:
+    """
+    Parse `state` once and return its Expansion. With `out` (a planes.new_buffer batch)
+    the input planes are also written into out[slot]. One parse, one move generation
+    and one scatter per call, instead of one parse per done / get_legal_moves /
+    position_key / state_to_planes call.
+    """
+    record = ChessBoard(state).expand(bits, draw_check)
+    if out is not None:
+        planes.encode_squares([record.leaf[0]], [record.leaf[1]], out[slot:slot + 1])
+    return record
+
+def has_attack_chessman(state: str) -> bool:
+    """Does either side have a knight, rook, cannon or pawn left."""
+    return ChessBoard(state).has_attackers()
+
+def is_dead_draw(state: str) -> bool:
+    """No attackers, or a material balance in mailbox.DEAD_DRAWS; a table lookup on the board."""
+    return ChessBoard(state).is_dead_draw()
+
 def step(state: str, action: str) -> str:
     board = ChessBoard(state)
-    move = Move(
-        Position(int(action[0]), int(action[1])),
-        Position(int(action[2]), int(action[3]))
-    )
-    new_board = board.make_move(move)
-    return new_board.to_state()
-
-def get_legal_moves(state: str, board=None) -> List[str]:
-    chess_board = ChessBoard(state)
-    moves = chess_board.get_legal_moves(Color.BLACK)
-    return [str(move) for move in moves]
+    board.step(action)
+    return board.to_state()
+
+def new_step(state: str, action: str) -> Tuple[str, bool]:
+    """step() that also reports whether the move was quiet: (next state, nothing captured)."""
+    board = ChessBoard(state)
+    captured = board.step(action)
+    return board.to_state(), not captured
+
+def get_legal_moves(state: str, board: ChessBoard = None, pseudo_legal: bool = False) -> List[str]:
+    if board is None:
+        board = ChessBoard(state)
+    return board.get_legal_moves(pseudo_legal)
+
+def get_legal_actions(state: str, board: ChessBoard = None) -> np.ndarray:
+    """Legal moves as uint16 indices into ActionLabelsRed."""
+    if board is None:
+        board = ChessBoard(state)
+    return board.legal_actions()
 
 def evaluate(state: str) -> float:
+    return ChessBoard(state).evaluate()
+
+def state_to_planes(state: str) -> np.ndarray:
+    """(14, 10, 9) float32 planes of one state; batches go through sources.chess.planes."""
+    return planes.encode_states([state])[0]
+
+def state_history_to_planes(state: str, history: list) -> np.ndarray:
+    """(14 * HISTORY_LENGTH, 10, 9) planes; `history` is [state, move, ..., state] ending at `state`."""
+    if not history or history[-1] != state:
+        history = list(history or []) + [state]
+    return planes.encode_histories([history])[0]
+
+def position_key(state: str, bits: int = 64) -> int:
+    """Zobrist key of `state`, the same number ChessBoard maintains incrementally."""
+    return ChessBoard(state).position_key(bits)
+
+# Left-right mirror canonicalisation. A position and its mirror image share one canonical
+# form: the orientation with the smaller position key. Actions and policies convert with
+# MirrorIndex / mirror_policy, which are their own inverse, so the same call maps to and
+# from the canonical orientation.
+
+def mirror_state(state: str) -> str:
+    # run-length digits stay valid when a rank is read backwards
+    return '/'.join(rank[::-1] for rank in state.split('/'))
+
+def canonical_key(state: str, bits: int = 64) -> Tuple[int, bool]:
+    return ChessBoard(state).canonical_key(bits)
+
+def canonical_state(state: str, bits: int = 64) -> Tuple[str, bool]:
+    """(canonical state, mirrored): mirrored is True when the canonical form is the mirror image."""
+    _, mirrored = canonical_key(state, bits)
+    return (mirror_state(state) if mirrored else state), mirrored
+
+def orient_action(action: int, mirrored: bool) -> int:
+    return int(MirrorIndex[action]) if mirrored else action
+
+def orient_policy(policy, mirrored: bool) -> np.ndarray:
+    return mirror_policy(policy) if mirrored else np.asarray(policy)
+
+# Conversions for UCCI engines and the console. UCCI moves and FENs are absolute (red at
+# rank 0, files a..i), states and actions are seen from the side to move.
+
+def to_uci_move(action: str) -> str:
+    """'x0y0x1y1' -> 'a0b2' style coordinates; no flipping, pass absolute moves."""
+    return chr(97 + int(action[0])) + action[1] + chr(97 + int(action[2])) + action[3]
+
+def parse_ucci_move(move: str) -> str:
+    """Inverse of to_uci_move: 'h2e2' -> '7242'."""
+    return str(ord(move[0]) - 97) + move[1] + str(ord(move[2]) - 97) + move[3]
+
+def state_to_fen(state: str, turns: int) -> str:
+    """Full FEN of `state` for an engine; odd `turns` mean black is to move and sees `state`."""
     board = ChessBoard(state)
-    return board.evaluate()
-
-def will_check_or_catch(from_state: str, to_state: str) -> bool:
-    try:
-        from_board = ChessBoard(from_state)
-        to_board = ChessBoard(to_state)
-        
-        from_result, from_check_move = from_board.get_game_result()
-        to_result, to_check_move = to_board.get_game_result()
-        
-        if to_check_move is not None:
-            return True
-        
-        from_red_king = from_black_king = None
-        to_red_king = to_black_king = None
-        
-        for y in range(10):
-            for x in range(9):
-                from_piece = from_board.get_piece(Position(x, y))
-                to_piece = to_board.get_piece(Position(x, y))
-                
-                if from_piece and from_piece.type == PieceType.KING:
-                    if from_piece.color == Color.RED:
-                        from_red_king = Position(x, y)
-                    else:
-                        from_black_king = Position(x, y)
-                        
-                if to_piece and to_piece.type == PieceType.KING:
-                    if to_piece.color == Color.RED:
-                        to_red_king = Position(x, y)
-                    else:
-                        to_black_king = Position(x, y)
-        
-        if not from_red_king or not from_black_king or not to_red_king or not to_black_king:
-            return False
+    if turns % 2 == 1:
+        board = board.flipped()
+    return f"{board.to_fen()} - - 0 {turns // 2 + 1}"
 
-        to_moves = to_board.get_legal_moves(Color.BLACK)
-        for move in to_moves:
-            if move.to_pos == to_red_king:
-                return True
-        
-        red_moves = to_board.get_legal_moves(Color.RED)
-        for move in red_moves:
-            if move.to_pos == to_black_king:
-                return True
-        
-        captured_value = 0
-        for y in range(10):
-            for x in range(9):
-                from_piece = from_board.get_piece(Position(x, y))
-                to_piece = to_board.get_piece(Position(x, y))
-                
-                if from_piece and not to_piece:
-                    captured_value += from_piece.value
-                elif from_piece and to_piece and from_piece.color != to_piece.color:
-                    captured_value += from_piece.value
-        
-        return captured_value > 1
-        
-    except Exception:
-        return False
+def render(state: str) -> None:
+    """Print the ten ranks of `state`, the side to move (upper case) at the bottom."""
+    for rank in state.split(' ', 1)[0].split('/'):
+        print(rank.translate(EXPAND_DIGITS))
+
+def will_check_or_catch(state: str, action: str) -> bool:
+    board = ChessBoard(state)
+    return board.gives_check_or_catch(board.str_to_move(action))
+
+def be_catched(state: str, action: str) -> bool:
+    """The side to move is checked or chased in `state` and `action` gets it out."""
+    board = ChessBoard(state)
+    return board.be_catched(board.str_to_move(action))
@@ -0,0 +1,83 @@
+"""
+Zobrist keys for MailboxBoard.
+
+State strings are always written from the side to move, so the key of a position is
+the key of what the side to move sees: VIEW_KEYS[RED] hashes the absolute board and
+VIEW_KEYS[BLACK] the board rotated by 180 degrees with the colours swapped. The board
+keeps both running keys and XORs a few table entries per move; position_key() picks
+the one of the side to move.
+
+Keys are drawn as 128-bit numbers. The default 64-bit key is the low half, the
+collision-safe mode uses all 128 bits.
+
+The same board also keeps the lock of the .obk opening books (BookUtils): the book's own
+table over absolute squares, which happen to be numbered like mailbox squares, with the
+player constant XORed in when red is to move. A book is probed with the lock of the
+board and of its left-right mirror, so BOOK_KEYS packs both in one 128-bit entry
+(plain | mirrored << 64) and a move updates the pair with a single XOR per square.
+"""
+
+import random
+
+from sources.BookHandler.BookUtils import BookUtils
+
+KEY_BITS = 64
+KEY_MASKS = {64: (1 << 64) - 1, 128: (1 << 128) - 1}
+
+# piece codes as in sources.chess.mailbox: side tag (8 red / 16 black) | type (0..6)
+_SWAP_COLOUR = 8 | 16
+
+
+def _view_tables(seed: int = 0x5EED):
+    rng = random.Random(seed)
+    base = [0] * (32 * 256)
+    for tag in (8, 16):
+        for kind in range(7):
+            for sq in range(256):
+                base[(tag | kind) * 256 + sq] = rng.getrandbits(128)
+    black_view = [0] * (32 * 256)
+    for code in range(32):
+        if code & 24 in (8, 16):
+            for sq in range(256):
+                black_view[code * 256 + sq] = base[(code ^ _SWAP_COLOUR) * 256 + (254 - sq) % 256]
+    return base, black_view
+
+
+VIEW_KEYS = _view_tables()
+
+BOOK_PLAYER = BookUtils.ZobristPlayer
+_LOW_64 = (1 << 64) - 1
+
+
+def _book_table():
+    # .obk pieces: K A B N R C P = 0..6 for red, 7..13 for black - the mailbox type order
+    table = BookUtils.ZobristTable
+    keys = [0] * (32 * 256)
+    for tag, first in ((8, 0), (16, 7)):
+        for kind in range(7):
+            row = (first + kind) * 256
+            for sq in range(256):
+                mirrored = sq & ~15 | (14 - (sq & 15)) % 16
+                keys[(tag | kind) * 256 + sq] = table[row + sq] | table[row + mirrored] << 64
+    return keys
+
+
+BOOK_KEYS = _book_table()
+
+
+def book_lock(packed: int, red_to_move: bool, mirror: bool = False) -> int:
+    """The .obk lock out of a running BOOK_KEYS value, as BookUtils.GetZobristFromFen gives it."""
+    lock = packed >> 64 if mirror else packed & _LOW_64
+    return lock ^ BOOK_PLAYER if red_to_move else lock
+
+
+def piece_key(side: int, code: int, sq: int) -> int:
+    """Key of piece `code` on mailbox square `sq` in the view of `side`."""
+    return VIEW_KEYS[side][code * 256 + sq]
+
+
+def key_mask(bits: int) -> int:
+    try:
+        return KEY_MASKS[bits]
+    except KeyError:
+        raise ValueError(f"Unsupported position key size: {bits} (use 64 or 128)")
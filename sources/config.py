@@ -88,12 +88,30 @@ class PlayConfig:
         self.dirichlet_alpha = 0.2
         self.tau_decay_rate = 0.9
         self.virtual_loss = 3
+        self.batch_size_neural_network = 0      # leaves per NN request of the single-threaded search; 0: a thread per simulation
         self.resign_threshold = -0.98
         self.min_resign_turn = 40
         self.enable_resign_rate = 0.5
         self.max_game_length = 200
         self.share_mtcs_info_in_self_play = False
         self.reset_mtcs_info_per_game = 5
+        self.enable_tree_reuse = True       # keep the subtree of the new root between moves, drop the rest
+        self.tree_reuse_depth = 3           # plies of that subtree kept below the new root
+        self.enable_early_stopping = False  # stop once the most visited root move cannot be overtaken;
+                                            # play and evaluation only, it changes self-play policy targets
+        self.early_stopping_confidence = 0.95   # also stop once its Q is this surely the best; 0: off
+        self.time_safety_margin = 0.1       # seconds of every time budget kept back for move overhead
+        self.time_moves_left_opening = 50   # moves a clock is shared over with all 32 pieces on the board,
+        self.time_moves_left_endgame = 20   # and with the kings alone
+        self.time_max_extension = 2.0       # an undecided root may search this many times its share,
+        self.time_max_fraction = 0.2        # but never for more than this part of the clock
+        self.time_stable_share = 0.5        # root visit share of the best move that counts as decided
+        self.position_key_bits = 64         # 64 or 128 (collision-safe)
+        self.verify_position_keys = False   # check every new tree key against its state string
+        self.share_mirror_evaluations = False   # reuse NN results for left-right mirrored positions
+        self.evaluation_cache_size = 100000
+        self.move_cache_sets = 1 << 15      # legal move cache: 2 entries per set, power of two
+        self.move_cache_bytes = 16 << 20    # and at most this many bytes of move arrays
 
 
 class TrainerConfig:
@@ -101,6 +119,7 @@ class TrainerConfig:
         self.min_games_to_begin_learn = 100
         self.min_data_size_to_learn = 0
         self.cleaning_processes = 4
+        self.files_per_task = 50            # play data files replayed together by one cleaning process
         self.vram_frac = 1.0
         self.batch_size = 512
         self.epoch_to_checkpoint = 3
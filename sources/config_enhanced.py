@@ -46,7 +46,6 @@ class EnhancedPlayConfig:
         # 新增：转置表参数
         self.enable_transposition_table = True
         self.transposition_table_size = 1000000  # 转置表大小
-        self.transposition_table_threshold = 10  # 使用缓存的最小访问次数
         
         # 新增：渐进解锁参数
         self.enable_progressive_unlock = True
@@ -55,17 +54,33 @@ class EnhancedPlayConfig:
         
         # 新增：搜索树复用
         self.enable_tree_reuse = True
-        self.tree_reuse_depth = 3  # 树复用的最大深度
+        self.tree_reuse_depth = 3  # 树复用的最大深度：保留新根节点以下几层
         
         # 新增：并行优化
-        self.batch_size_neural_network = 32  # 神经网络批处理大小
+        self.batch_size_neural_network = 0  # 单线程批量搜索每次送神经网络评估的叶子数（如32）；0则每次模拟一个线程
         self.max_queue_size = 256  # 最大队列大小
         
         # 新增：搜索优化
         self.enable_smart_pruning = True  # 智能剪枝
         self.pruning_threshold = 0.01  # 剪枝阈值
-        self.enable_early_stopping = True  # 早停
-        self.early_stopping_confidence = 0.95  # 早停置信度
+        self.enable_early_stopping = False  # 早停：只用于对弈和评测，自我对弈中会改变训练数据的访问次数策略
+        self.early_stopping_confidence = 0.95  # 早停置信度：按Q方差判定最优着法的把握，0则只按访问次数差早停
+        
+        # 时间管理（action传入movetime或剩余时间time_left/每步加秒increment时生效，单位秒）
+        self.time_safety_margin = 0.1  # 每步预留的走子开销时间
+        self.time_moves_left_opening = 50  # 满盘32子时剩余时间按这么多步分配
+        self.time_moves_left_endgame = 20  # 只剩双将时按这么多步分配，其间按子数插值
+        self.time_max_extension = 2.0  # 根节点未分胜负时最多延长到分配时间的倍数
+        self.time_max_fraction = 0.2  # 但单步不超过剩余时间的这一比例
+        self.time_stable_share = 0.5  # 最优着法访问占比达到此值视为已确定
+
+        # 新增：局面键
+        self.position_key_bits = 64  # 64位，或128位（防碰撞）
+        self.verify_position_keys = False  # 调试：逐个校验新节点的键与局面字符串是否一致
+        self.share_mirror_evaluations = False  # 左右镜像局面共用神经网络评估结果
+        self.evaluation_cache_size = 100000  # 评估缓存大小
+        self.move_cache_sets = 1 << 15  # 合法着法缓存组数（每组2路，须为2的幂）
+        self.move_cache_bytes = 16 << 20  # 合法着法缓存的内存上限（字节）
 
 class EnhancedConfig:
     """增强的整体配置"""
@@ -170,6 +185,11 @@ class BenchmarkConfig:
         self.test_duration_seconds = 60
         self.warmup_moves = 5
 
+        # perft：走法生成正确性与速度
+        self.perft_depth = 3
+        self.perft_max_depth = {'static_env': 5, 'L_Chessboard': 4, 'Chessboard': 3}  # 各实现允许的最大深度
+        self.perft_diff_depth = 2  # 逐局面比对走法集合的深度
+
 def create_benchmark_report(config, results):
     """创建性能基准测试报告"""
     report = f"""
@@ -1,7 +1,6 @@
 import os
 import subprocess
 import numpy as np
-from collections import defaultdict
 from logging import getLogger
 from time import sleep, time
 
@@ -9,7 +8,7 @@ import sources.chess.static_env as senv
 from sources.chess.chessboard import Chessboard
 from sources.chess.chessman import *
 from sources.AlphaZero.ModelManager import ModelManager
-from sources.AlphaZero.Enhanced_AI_Player import Enhanced_AI_Player as AI_Player, EnhancedVisitState as VisitState
+from sources.AlphaZero.Enhanced_AI_Player import Enhanced_AI_Player as AI_Player, EnhancedSearchTree as SearchTree
 from sources.config_enhanced import EnhancedConfig as Config
 from sources.chess.env import ChessEnv
 from sources.chess.lookup_tables import Winner, ActionLabelsRed, flip_move
@@ -20,6 +19,7 @@ logger = getLogger(__name__)
 
 def start(config: Config, ucci=False, ai_move_first=True):
     set_session_config(per_process_gpu_memory_fraction=1, allow_growth=True, device_list=config.trainsetting.device_list)
+    config.play.enable_early_stopping = True  # 观战/评测对局不产生训练数据，可以早停
     if not ucci:
         play = ObSelfPlay(config)
     else:
@@ -29,7 +29,7 @@ def start(config: Config, ucci=False, ai_move_first=True):
 class ObSelfPlay:
     def __init__(self, config: Config):
         self.config = config
-        self.env = ChessEnv()
+        self.env = ChessEnv(backend='fast')
         self.model = None
         self.pipe = None
         self.ai = None
@@ -44,7 +44,7 @@ class ObSelfPlay:
         self.env.reset()
         self.load_model()
         self.pipe = self.model.get_pipes()
-        self.ai = AI_Player(self.config, search_tree=defaultdict(VisitState), pipes=self.pipe,
+        self.ai = AI_Player(self.config, search_tree=SearchTree(), pipes=self.pipe,
                             enable_resign=True, debugging=False)
 
         labels = ActionLabelsRed
@@ -82,7 +82,7 @@ class ObSelfPlay:
 class ObSelfPlayUCCI:
     def __init__(self, config: Config, ai_move_first=True):
         self.config = config
-        self.env = ChessEnv()
+        self.env = ChessEnv(backend='fast')
         self.model = None
         self.pipe = None
         self.ai = None
@@ -98,7 +98,7 @@ class ObSelfPlayUCCI:
         self.env.reset()
         self.load_model()
         self.pipe = self.model.get_pipes()
-        self.ai = AI_Player(self.config, search_tree=defaultdict(VisitState), pipes=self.pipe,
+        self.ai = AI_Player(self.config, search_tree=SearchTree(), pipes=self.pipe,
                             enable_resign=True, debugging=False)
 
         labels = ActionLabelsRed
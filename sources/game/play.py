@@ -22,7 +22,7 @@ logger = getLogger(__name__)
 from sources.chess.chessboard import Chessboard
 from sources.chess.chessman import *
 from sources.AlphaZero.ModelManager import ModelManager
-from sources.AlphaZero.Enhanced_AI_Player import Enhanced_AI_Player as AI_Player, EnhancedVisitState as VisitState
+from sources.AlphaZero.Enhanced_AI_Player import Enhanced_AI_Player as AI_Player, EnhancedSearchTree as SearchTree
 from sources.config_enhanced import EnhancedConfig as Config
 from sources.chess.env import ChessEnv
 from sources.chess.lookup_tables import Winner, ActionLabelsRed, flip_move
@@ -41,6 +41,7 @@ main_dir = os.path.split(os.path.abspath(__file__))[0]
 
 def start(config: Config, human_move_first=None):
     global PIECE_STYLE
+    config.play.enable_early_stopping = True  # 对弈不产生训练数据，可以早停
     play = PVE(config)
     play.start(human_move_first)
 
@@ -77,10 +78,7 @@ class PVE:
         self.nn_value = 0
         self.mcts_moves = {}
         self.history = []
-        self.chessman_history = []
-        self.record_history = []
-        self.turn_history = []
-        self.chessman_hash_history = []
+        self.board_history = []     # Chessboard.snapshot() after every move, for undo
         self.bookhandler = Book(self.config.resource.book_path)
         self.BsetMove = []
         self.book_msg = None
@@ -284,7 +282,7 @@ class PVE:
         self.env.reset()
         self.load_model()
         self.pipe = self.model.get_pipes()
-        self.ai = AI_Player(self.config, search_tree=defaultdict(VisitState), pipes=self.pipe,
+        self.ai = AI_Player(self.config, search_tree=SearchTree(), pipes=self.pipe,
                             enable_resign=True, debugging=True)
         self.human_move_first = human_first
 
@@ -310,14 +308,11 @@ class PVE:
         sleep(1)
 
         # 确保历史记录初始化
-        if len(self.chessman_history) == 0:
-            self.chessman_history.append(copy.deepcopy(self.env.board.chessmans))
-            self.chessman_hash_history.append((copy.deepcopy(self.env.board.chessmans_hash)))
-            self.record_history.append(copy.deepcopy(self.env.board.record))
-            self.turn_history.append(copy.deepcopy(self.env.board.turns))
+        if len(self.board_history) == 0:
+            self.board_history.append(self.env.board.snapshot())
 
         def undo_move():
-            if (len(self.chessman_history) > (2 if not self.human_move_first else 1)):
+            if (len(self.board_history) > (2 if not self.human_move_first else 1)):
                 logger.info("🔄 执行悔棋操作，回退2步")
                 # 记录当前状态用于日志
                 current_moves = len([m for m in self.env.board.record.split('\n') if m.strip()])
@@ -344,16 +339,10 @@ class PVE:
                     self.history.pop()
                 for i in range(2):
                     self.moves_history.pop()
-                self.chessman_history.pop()
-                self.record_history.pop()
-                self.turn_history.pop()
-                self.chessman_hash_history.pop()
+                self.board_history.pop()
 
-                # 重置棋盘状态
-                self.env.board.Set_chessmans(copy.deepcopy(self.chessman_history[-1]))
-                self.env.board.Set_chessmans_hash(copy.deepcopy(self.chessman_hash_history[-1]))
-                self.env.board.turns = self.turn_history[-1]
-                self.env.board.record = self.record_history[-1]
+                # 重置棋盘状态（快照恢复，复用原有棋子对象）
+                self.env.board.restore(self.board_history[-1])
 
                 # 重新计算可移动列表
                 self.env.board.calc_chessmans_moving_list()
@@ -642,7 +631,7 @@ class PVE:
                     self.book_msg = "未启用历史局面缓存..."
                 if self.config.resource.Use_Book and (
                         self.config.resource.Out_Book_Step == -1 or self.env.board.turns <= self.config.resource.Out_Book_Step):
-                    BookResult = self.bookhandler.query(BookHandler.fixFen(self.env.get_state()), ai_move_first)
+                    BookResult = self.bookhandler.probe(self.env.board)
                     BookResult.sort(key=cmp_to_key(Bookcmp), reverse=1)
                     if len(BookResult) > 0:
                         self.book_msg = '命中历史局面!'
@@ -652,7 +641,10 @@ class PVE:
                 action = None
                 self.BsetMove = []
                 if not self.config.resource.Use_EngineHelp:
-                    action, policy = self.ai.action(state, self.env.num_halfmoves, no_act)
+                    # 按AI一方的剩余时间限时，模拟次数仍不超过simulation_num_per_move
+                    time_left = self.red_time_left if self.env.red_to_move else self.black_time_left
+                    action, policy = self.ai.action(state, self.env.num_halfmoves, no_act,
+                                                    depth=self.config.play.simulation_num_per_move, time_left=time_left)
                     if not self.env.red_to_move:
                         action = flip_move(action)
                 if self.config.resource.Use_Book and len(BookResult) > 0:
@@ -696,7 +688,7 @@ class PVE:
                 if action is None:
                     return
                 if not self.config.resource.Use_EngineHelp:
-                    key = self.env.get_state()
+                    key = self.ai.state_key(self.env.get_state())
                     p, v = self.ai.debug[key]
                     logger.info(f"check = {check}, NN value = {v:.3f}")
                     self.nn_value = v
@@ -723,10 +715,7 @@ class PVE:
                     sprite_dest.kill()
                 chessman_sprite.move(x1, y1, self.chessman_w, self.chessman_h)
                 self.history.append(self.env.get_state())
-                self.chessman_history.append(copy.deepcopy(self.env.board.chessmans))
-                self.record_history.append(copy.deepcopy(self.env.board.record))
-                self.turn_history.append(copy.deepcopy(self.env.board.turns))
-                self.chessman_hash_history.append((copy.deepcopy(self.env.board.chessmans_hash)))
+                self.board_history.append(self.env.board.snapshot())
                 # 切换到红方计时
                 self.current_timer = 'red'
                 self.last_move_time = time.time()
@@ -20,13 +20,16 @@ logger = getLogger(__name__)
 logging.getLogger("requests").setLevel(logging.WARNING)
 logging.getLogger("urllib3").setLevel(logging.WARNING)
 
-CMD_LIST = ['generate_data', 'train', 'play', 'play_to_self']
+CMD_LIST = ['generate_data', 'train', 'play', 'play_to_self', 'perft']
 
 def create_parser():
     parser = argparse.ArgumentParser()
     parser.add_argument("cmd", choices=CMD_LIST)
     parser.add_argument("--ai-move-first", action="store_true")
     parser.add_argument("--ucci", action="store_true")
+    parser.add_argument("--depth", type=int, help="perft depth (1-5)")
+    parser.add_argument("--fen", action="append", help="perft position, may be repeated")
+    parser.add_argument("--divide", action="store_true", help="perft: print node counts per root move")
     return parser
 
 def setup(config: Config, args):
@@ -74,6 +77,9 @@ def start():
         PlayConfig = PVEConfig()
         PlayConfig.update_play_config(config.play)
         PlayToSelf.start(config, args.ucci, args.ai_move_first)
+    elif args.cmd == 'perft':
+        from sources.chess import perft
+        return perft.start(config, args.depth, args.fen, args.divide)
 
 if __name__ == "__main__":
     # mp.set_start_method('spawn')
@@ -22,7 +22,8 @@ from sources.utils.dataReaderWriter import get_game_data_filenames, read_game_da
 from sources.utils.modelReaderWriter import load_best_model_weight, save_as_best_model
 from sources.utils.modelReaderWriter import need_to_reload_best_model_weight, save_as_next_generation_model, save_as_best_model
 from sources.chess.env import ChessEnv
-from sources.chess.lookup_tables import Winner, ActionLabelsRed, flip_policy, flip_move
+from sources.chess import planes, replay
+from sources.chess.lookup_tables import Winner, ActionLabelsRed, ActionIndex, FlipIndex, flip_move
 from sources.utils.tensorflow_utils import set_session_config
 
 from keras.optimizers import SGD
@@ -38,75 +39,82 @@ def start(config: Config):
 
 
 def load_data_from_file(filename, use_history=False):
+    return load_data_from_files([filename], use_history)
+
+
+def load_data_from_files(filenames, use_history=False):
+    """Read a chunk of play data files and replay all their games in one batch"""
+    files = []
+    for filename in filenames:
+        try:
+            data = read_game_data_from_file(filename)
+            if data:
+                files.append((filename, replay.split_games(data)))
+        except Exception as e:
+            logger.error(f"Error when loading data {e}, file = {filename}")
+            os.remove(filename)
+    if not files:
+        return None
     try:
-        data = read_game_data_from_file(filename)
+        return replay.training_data([game for _, games in files for game in games], history=use_history)
     except Exception as e:
-        logger.error(f"Error when loading data {e}")
-        os.remove(filename)
-        return None
-    if data is None:
+        logger.error(f"Expand data error {e}, replaying {len(files)} files one by one")
+    # one bad game fails the whole batch: replay file by file and drop only the bad files
+    parts = []
+    for filename, games in files:
+        try:
+            parts.append(replay.training_data(games, history=use_history))
+        except Exception as e:
+            logger.error(f"Expand data error {e}, file = {filename}")
+            os.remove(filename)
+    if not parts:
         return None
-    return expanding_data(data, use_history)
+    return tuple(np.concatenate(arrays) for arrays in zip(*parts))
 
 
 def expanding_data(data, use_history=False):
-    state = data[0]
-    real_data = []
-    action = None
-    policy = None
-    value = None
-    if use_history:
-        history = [state]
-    else:
-        history = None
-    for item in data[1:]:
-        action = item[0]
-        value = item[1]
-        try:
-            policy = build_policy(action, flip=False)
-        except Exception as e:
-            logger.error(f"Expand data error {e}, item = {item}, data = {data}, state = {state}")
-            return None
-        real_data.append([state, policy, value])
-        state = senv.step(state, action)
-        if use_history:
-            history.append(action)
-            history.append(state)
-
-    return convert_to_trainging_data(real_data, history)
+    try:
+        games = replay.split_games(data)
+    except Exception as e:
+        logger.error(f"Expand data error {e}, data = {data}")
+        return None
+    return expanding_games(games, use_history)
 
 
-def build_policy(action, flip):
-    labels_n = len(ActionLabelsRed)
-    move_lookup = {move: i for move, i in zip(ActionLabelsRed, range(labels_n))}
-    policy = np.zeros(labels_n)
+def expanding_games(games, use_history=False):
+    # positions are rebuilt for all games at once, see sources.chess.replay
+    try:
+        return replay.training_data(games, history=use_history)
+    except Exception as e:
+        logger.error(f"Expand data error {e}")
+        return None
 
-    policy[move_lookup[action]] = 1
 
+def build_policy(action, flip):
+    policy = np.zeros(len(ActionLabelsRed))
+    index = ActionIndex[action]
     if flip:
-        policy = flip_policy(policy)
-    return list(policy)
+        index = FlipIndex[index]
+    policy[index] = 1
+    return policy
 
 
 def convert_to_trainging_data(data, history):
-    state_list = []
     policy_list = []
     value_list = []
-    i = 0
 
     for state, policy, value in data:
-        if history is None:
-            state_planes = senv.state_to_planes(state)
-        else:
-            state_planes = senv.state_history_to_planes(state, history[0:i * 2 + 1])
-        sl_value = value
-
-        state_list.append(state_planes)
         policy_list.append(policy)
-        value_list.append(sl_value)
-        i += 1
+        value_list.append(value)
 
-    return np.asarray(state_list, dtype=np.float32), \
+    # encode all positions of the game in one batch
+    state_ary = planes.new_buffer(len(data), history=history is not None)
+    if history is None:
+        planes.encode_states([state for state, _, _ in data], state_ary)
+    else:
+        planes.encode_histories([history[0:i * 2 + 1] for i in range(len(data))], state_ary)
+
+    return state_ary, \
         np.asarray(policy_list, dtype=np.float32), \
         np.asarray(value_list, dtype=np.float32)
 
@@ -217,13 +225,14 @@ class OptimizeWorker:
     def fill_queue(self):
         futures = deque()
         n = len(self.filenames)
+        chunk = self.config.trainer.files_per_task
+        logged = 0
         with ProcessPoolExecutor(max_workers=self.config.trainer.cleaning_processes) as executor:
             for _ in range(self.config.trainer.cleaning_processes):
                 if len(self.filenames) == 0:
                     break
-                filename = self.filenames.pop()
-                # logger.debug("loading data from %s" % (filename))
-                futures.append(executor.submit(load_data_from_file, filename, self.config.trainsetting.has_history))
+                filenames = self.pop_filenames(chunk)
+                futures.append(executor.submit(load_data_from_files, filenames, self.config.trainsetting.has_history))
             while futures and len(self.dataset[0]) < self.config.trainer.dataset_size: #fill tuples
                 _tuple = futures.popleft().result()
                 if _tuple is not None:
@@ -231,11 +240,14 @@ class OptimizeWorker:
                         x.extend(y)
                 m = len(self.filenames)
                 if m > 0:
-                    if (n - m) % 1000 == 0:
+                    if n - m >= logged + 1000:
+                        logged = (n - m) // 1000 * 1000
                         logger.info(f"Reading {n - m} files")
-                    filename = self.filenames.pop()
-                    # logger.debug("loading data from %s" % (filename))
-                    futures.append(executor.submit(load_data_from_file, filename, self.config.trainsetting.has_history))
+                    filenames = self.pop_filenames(chunk)
+                    futures.append(executor.submit(load_data_from_files, filenames, self.config.trainsetting.has_history))
+
+    def pop_filenames(self, count):
+        return [self.filenames.pop() for _ in range(min(count, len(self.filenames)))]
 
     def collect_all_loaded_data(self):
         state_ary, policy_ary, value_ary = self.dataset
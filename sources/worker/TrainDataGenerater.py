@@ -8,17 +8,17 @@ from datetime import datetime, timezone, timedelta
 from logging import getLogger
 from multiprocessing import Manager
 from time import time, sleep
-from collections import defaultdict
 from random import random
 from threading import Thread
 
 import sources.chess.static_env as senv
+from sources.chess import repetition
 from sources.AlphaZero.ModelManager import ModelManager
-from sources.AlphaZero.Enhanced_AI_Player import Enhanced_AI_Player as AI_Player, EnhancedVisitState as VisitState
+from sources.AlphaZero.Enhanced_AI_Player import Enhanced_AI_Player as AI_Player, EnhancedSearchTree as SearchTree
 from sources.AlphaZero.Predictor import Predictor
 from sources.config_enhanced import EnhancedConfig as Config
 from sources.chess.env import ChessEnv
-from sources.chess.lookup_tables import Winner, ActionLabelsRed, flip_policy, flip_move
+from sources.chess.lookup_tables import Winner, ActionLabelsRed, ActionIndex, FlipIndex, flip_move
 from sources.utils.dataReaderWriter import get_game_data_filenames, write_game_data_to_file
 from sources.utils.modelReaderWriter import load_model_weight, save_as_best_model
 from sources.utils.tensorflow_utils import set_session_config
@@ -74,11 +74,11 @@ class SelfPlayWorker:
 
         idx = 1
         self.buffer = []
-        search_tree = defaultdict(VisitState)
+        search_tree = SearchTree()
 
         while True:
             start_time = time()
-            search_tree = defaultdict(VisitState)
+            search_tree = SearchTree()
             value, turns, state, store = self.start_game(idx, search_tree)
             end_time = time()
             logger.debug(f"Process {self.pid}-{self.id} play game {idx} time={(end_time - start_time):.1f} sec, "
@@ -94,7 +94,7 @@ class SelfPlayWorker:
 
         if not self.config.play.share_mtcs_info_in_self_play or \
             idx % self.config.play.reset_mtcs_info_per_game == 0:
-            search_tree = defaultdict(VisitState)
+            search_tree = SearchTree()
 
         if random() > self.config.play.enable_resign_rate:
             enable_resign = True
@@ -106,6 +106,7 @@ class SelfPlayWorker:
 
         state = senv.INIT_STATE
         history = [state]
+        tracker = repetition.RepetitionTracker(senv.ChessBoard(state))
         # policys = [] 
         value = 0
         turns = 0       # even == red; odd == black
@@ -126,7 +127,8 @@ class SelfPlayWorker:
                 break
             history.append(action)
             try:
-                state, no_eat = senv.new_step(state, action)
+                no_eat = not tracker.play(action)
+                state = tracker.board.to_state()
             except Exception as e:
                 logger.error(f"{e}, no_act = {no_act}, policy = {policy}")
                 game_over = True
@@ -145,27 +147,22 @@ class SelfPlayWorker:
             else:
                 game_over, value, final_move, check = senv.done(state, need_check=True)
                 if not game_over:
-                    if not senv.has_attack_chessman(state):
-                        logger.info(f"双方无进攻子力，作和。state = {state}")
+                    if tracker.board.is_dead_draw():
+                        logger.info(f"双方无进攻子力或子力必和，作和。state = {state}")
                         game_over = True
                         value = 0
                 increase_temp = False
                 no_act = []
-                if not game_over and not check and state in history[:-1]:
-                    free_move = defaultdict(int)
-                    for i in range(len(history) - 1):
-                        if history[i] == state:
-                            if senv.will_check_or_catch(state, history[i+1]):
-                                no_act.append(history[i + 1])
-                            elif not senv.be_catched(state, history[i+1]):
-                                increase_temp = True
-                                free_move[state] += 1
-                                if free_move[state] >= 3:
-                                    # 作和棋处理
-                                    game_over = True
-                                    value = 0
-                                    logger.info("闲着循环三次，作和棋处理")
-                                    break
+                if not game_over and not check and tracker.repeated():
+                    no_act.extend(tracker.offending_moves())
+                    idle = tracker.idle_repeats()
+                    if idle:
+                        increase_temp = True
+                    if idle >= 3:
+                        # 作和棋处理
+                        game_over = True
+                        value = 0
+                        logger.info("闲着循环三次，作和棋处理")
 
         if final_move:
             # policy = self.build_policy(final_move, False)
@@ -231,13 +228,10 @@ class SelfPlayWorker:
             pass
 
     def build_policy(self, action, flip):
-        labels_n = len(ActionLabelsRed)
-        move_lookup = {move: i for move, i in zip(ActionLabelsRed, range(labels_n))}
-        policy = np.zeros(labels_n)
-
-        policy[move_lookup[action]] = 1
-
+        policy = np.zeros(len(ActionLabelsRed))
+        index = ActionIndex[action]
         if flip:
-            policy = flip_policy(policy)
-        return list(policy)
+            index = FlipIndex[index]
+        policy[index] = 1
+        return policy
 
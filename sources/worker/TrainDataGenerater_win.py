@@ -8,18 +8,18 @@ from logging import getLogger
 from multiprocessing import Manager
 from threading import Thread
 from time import time
-from collections import defaultdict
 from threading import Lock
 from time import sleep
 from random import random
 
 import sources.chess.static_env as senv
+from sources.chess import repetition
 from sources.AlphaZero.ModelManager import ModelManager
-from sources.AlphaZero.Enhanced_AI_Player import Enhanced_AI_Player as AI_Player, EnhancedVisitState as VisitState
+from sources.AlphaZero.Enhanced_AI_Player import Enhanced_AI_Player as AI_Player, EnhancedSearchTree as SearchTree
 from sources.AlphaZero.Predictor import Predictor
 from sources.config_enhanced import EnhancedConfig as Config
 from sources.chess.env import ChessEnv
-from sources.chess.lookup_tables import Winner, ActionLabelsRed, flip_policy, flip_move
+from sources.chess.lookup_tables import Winner, ActionLabelsRed, ActionIndex, FlipIndex, flip_move
 from sources.utils.dataReaderWriter import get_game_data_filenames, write_game_data_to_file
 from sources.utils.modelReaderWriter import load_model_weight, save_as_best_model
 from sources.utils.tensorflow_utils import set_session_config
@@ -149,11 +149,12 @@ def self_play_buffer(config, cur, use_history=False) -> (tuple, list):
     else:
         enable_resign = False
 
-    player = AI_Player(config, search_tree=defaultdict(VisitState), pipes=pipe,
+    player = AI_Player(config, search_tree=SearchTree(), pipes=pipe,
                        enable_resign=enable_resign, debugging=False, use_history=use_history)
 
     state = senv.INIT_STATE
     history = [state]
+    tracker = repetition.RepetitionTracker(senv.ChessBoard(state))
     # policys = [] 
     value = 0
     turns = 0
@@ -176,7 +177,8 @@ def self_play_buffer(config, cur, use_history=False) -> (tuple, list):
         # policys.append(policy)
         history.append(action)
         try:
-            state, no_eat = senv.new_step(state, action)
+            no_eat = not tracker.play(action)
+            state = tracker.board.to_state()
         except Exception as e:
             logger.error(f"{e}, no_act = {no_act}, policy = {policy}")
             game_over = True
@@ -197,25 +199,20 @@ def self_play_buffer(config, cur, use_history=False) -> (tuple, list):
             no_act = []
             increase_temp = False
             if not game_over:
-                if not senv.has_attack_chessman(state):
-                    logger.info(f"双方无进攻子力，作和。state = {state}")
+                if tracker.board.is_dead_draw():
+                    logger.info(f"双方无进攻子力或子力必和，作和。state = {state}")
                     game_over = True
                     value = 0
-            if not game_over and not check and state in history[:-1]:
-                free_move = defaultdict(int)
-                for i in range(len(history) - 1):
-                    if history[i] == state:
-                        if senv.will_check_or_catch(state, history[i+1]):
-                            no_act.append(history[i + 1])
-                        elif not senv.be_catched(state, history[i+1]):
-                            increase_temp = True
-                            free_move[state] += 1
-                            if free_move[state] >= 3:
-                                # 作和棋处理
-                                game_over = True
-                                value = 0
-                                logger.info("闲着循环三次，作和棋处理")
-                                break
+            if not game_over and not check and tracker.repeated():
+                no_act.extend(tracker.offending_moves())
+                idle = tracker.idle_repeats()
+                if idle:
+                    increase_temp = True
+                if idle >= 3:
+                    # 作和棋处理
+                    game_over = True
+                    value = 0
+                    logger.info("闲着循环三次，作和棋处理")
 
     if final_move:
         # policy = build_policy(final_move, False)
@@ -244,12 +241,9 @@ def self_play_buffer(config, cur, use_history=False) -> (tuple, list):
     return (turns, v), data
 
 def build_policy(action, flip):
-    labels_n = len(ActionLabelsRed)
-    move_lookup = {move: i for move, i in zip(ActionLabelsRed, range(labels_n))}
-    policy = np.zeros(labels_n)
-
-    policy[move_lookup[action]] = 1
-
+    policy = np.zeros(len(ActionLabelsRed))
+    index = ActionIndex[action]
     if flip:
-        policy = flip_policy(policy)
-    return list(policy)
+        index = FlipIndex[index]
+    policy[index] = 1
+    return policy
@@ -9,16 +9,15 @@ from datetime import datetime
 from logging import getLogger
 from multiprocessing import Manager
 from time import time, sleep
-from collections import defaultdict
 from random import random
 
 import sources.chess.static_env as senv
 from sources.AlphaZero.ModelManager import ModelManager
-from sources.AlphaZero.Enhanced_AI_Player import Enhanced_AI_Player as AI_Player, EnhancedVisitState as VisitState
+from sources.AlphaZero.Enhanced_AI_Player import Enhanced_AI_Player as AI_Player, EnhancedSearchTree as SearchTree
 from sources.AlphaZero.Predictor import Predictor
 from sources.config_enhanced import EnhancedConfig as Config
 from sources.chess.env import ChessEnv
-from sources.chess.lookup_tables import ActionLabelsRed, flip_policy, flip_move
+from sources.chess.lookup_tables import ActionLabelsRed, ActionIndex, FlipIndex, flip_move
 from sources.utils.dataReaderWriter import get_game_data_filenames, write_game_data_to_file
 from sources.utils.modelReaderWriter import load_best_model_weight, save_as_best_model
 from sources.utils.tensorflow_utils import set_session_config
@@ -64,7 +63,7 @@ class SelfPlayWorker:
         self.buffer = []
 
         while True:
-            search_tree = defaultdict(VisitState)
+            search_tree = SearchTree()
             start_time = time()
             value, turns, state, store = self.start_game(idx, search_tree)
             end_time = time()
@@ -87,7 +86,7 @@ class SelfPlayWorker:
 
         if not self.config.play.share_mtcs_info_in_self_play or \
             idx % self.config.play.reset_mtcs_info_per_game == 0:
-            search_tree = defaultdict(VisitState)
+            search_tree = SearchTree()
 
         if random() > self.config.play.enable_resign_rate:
             enable_resign = True
@@ -223,13 +222,10 @@ class SelfPlayWorker:
             pass
 
     def build_policy(self, action, flip):
-        labels_n = len(ActionLabelsRed)
-        move_lookup = {move: i for move, i in zip(ActionLabelsRed, range(labels_n))}
-        policy = np.zeros(labels_n)
-
-        policy[move_lookup[action]] = 1
-
+        policy = np.zeros(len(ActionLabelsRed))
+        index = ActionIndex[action]
         if flip:
-            policy = flip_policy(policy)
-        return list(policy)
+            index = FlipIndex[index]
+        policy[index] = 1
+        return policy
 